@@ -2,31 +2,66 @@ import os
 import io
 import csv
 import json
+import hashlib
+import queue
+import secrets
+import atexit
 import sqlite3
-from datetime import datetime
-from flask import Flask, render_template, redirect, url_for, request, session, jsonify, Response
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import Flask, render_template, redirect, url_for, request, session, jsonify, Response, abort, send_from_directory
+from flask.sessions import SessionInterface, SessionMixin
+from jinja2.utils import htmlsafe_json_dumps
 import uuid
 from dotenv import load_dotenv
 
+from assets import DIST_DIR, IMMUTABLE, AssetManifest
+from turns import as_lines
+
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "multipartyllm")
 
-CONV_DIR = "json/"
+CONV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json")
 CONDITIONS = ["control", "supportive", "refutational", "prebunking", "combined"]
+CONVERSATION_INDICES = [1, 2, 3]
 
 # DB_PATH: use /data/ for Railway persistent volume, local file for development
 DB_PATH = os.environ.get("DB_PATH", os.path.join(os.path.dirname(__file__), "database.db"))
 
+# Connection pool tuning (per gunicorn worker)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+DB_STATEMENT_CACHE = 128
+
+# Client events are buffered and written in batches by a background thread
+EVENT_FLUSH_SIZE = int(os.environ.get("EVENT_FLUSH_SIZE", 50))
+EVENT_FLUSH_INTERVAL = float(os.environ.get("EVENT_FLUSH_INTERVAL", 1.0))
+
+# Admin CSV exports are streamed this many rows at a time
+EXPORT_CHUNK_ROWS = 500
+
+# "cookie": Flask's signed-cookie sessions. "server": the cookie only carries an
+# opaque id; the state lives in the sessions table behind a per-worker LRU.
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "cookie")
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 4096))
+
 
 # --------------------------
 # Database setup and helpers
 # --------------------------
 
-def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+# Schema changes are applied in order by init_db(). Each migration runs in its
+# own transaction and bumps PRAGMA user_version, so a database is only ever
+# migrated forward once. Migrations must tolerate databases created before
+# versioning existed (user_version 0 with some of the tables already present).
+
+def _migration_base_tables(conn):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS participants (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,12 +73,6 @@ def init_db():
             created_at TEXT
         )
     """)
-    #Add claim_token if it doesn't exist
-    cols = [r[1] for r in conn.execute("PRAGMA table_info(participants);")]
-    if "claim_token" not in cols:
-        conn.execute("ALTER TABLE participants ADD COLUMN claim_token TEXT;")
-        conn.commit()
-
     conn.execute("""
         CREATE TABLE IF NOT EXISTS responses (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -55,7 +84,6 @@ def init_db():
             FOREIGN KEY (participant_id) REFERENCES participants(id)
         )
     """)
-
     conn.execute("""
         CREATE TABLE IF NOT EXISTS events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -65,69 +93,631 @@ def init_db():
             FOREIGN KEY (participant_id) REFERENCES participants(id)
         )
     """)
-    conn.commit()
+
+
+def _add_column(conn, table, column, decl):
+    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table});")]
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl};")
+
+
+def _migration_claim_token(conn):
+    _add_column(conn, "participants", "claim_token", "TEXT")
+
+
+def _migration_assignment_counts(conn):
+    # Materialized condition x conversation_index counts used for balancing.
+    # Triggers keep it in step with participants inside the same transaction.
+    counts_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'assignment_counts'"
+    ).fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS assignment_counts (
+            condition TEXT NOT NULL,
+            conversation_index INTEGER NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (condition, conversation_index)
+        ) WITHOUT ROWID
+    """)
+    if not counts_exist:
+        conn.executemany(
+            "INSERT INTO assignment_counts (condition, conversation_index, n) VALUES (?, ?, 0)",
+            [(c, i) for c in CONDITIONS for i in CONVERSATION_INDICES]
+        )
+        conn.execute("""
+            INSERT INTO assignment_counts (condition, conversation_index, n)
+            SELECT condition, conversation_index, COUNT(*) FROM participants
+            WHERE condition IS NOT NULL AND conversation_index IS NOT NULL
+            GROUP BY condition, conversation_index
+            ON CONFLICT (condition, conversation_index) DO UPDATE SET n = excluded.n
+        """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS assignment_counts_insert AFTER INSERT ON participants
+        BEGIN
+            INSERT OR IGNORE INTO assignment_counts (condition, conversation_index, n)
+                VALUES (NEW.condition, NEW.conversation_index, 0);
+            UPDATE assignment_counts SET n = n + 1
+                WHERE condition = NEW.condition AND conversation_index = NEW.conversation_index;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS assignment_counts_delete AFTER DELETE ON participants
+        BEGIN
+            UPDATE assignment_counts SET n = n - 1
+                WHERE condition = OLD.condition AND conversation_index = OLD.conversation_index;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS assignment_counts_update
+        AFTER UPDATE OF condition, conversation_index ON participants
+        BEGIN
+            UPDATE assignment_counts SET n = n - 1
+                WHERE condition = OLD.condition AND conversation_index = OLD.conversation_index;
+            INSERT OR IGNORE INTO assignment_counts (condition, conversation_index, n)
+                VALUES (NEW.condition, NEW.conversation_index, 0);
+            UPDATE assignment_counts SET n = n + 1
+                WHERE condition = NEW.condition AND conversation_index = NEW.conversation_index;
+        END
+    """)
+
+
+def _migration_event_duration(conn):
+    _add_column(conn, "events", "duration_ms", "REAL")
+
+
+def _migration_indexes(conn):
+    # Per-condition / per-vignette counts
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_participants_condition_index
+        ON participants (condition, conversation_index)
+    """)
+    # /admin/export: join on participant_id, ordered by phase, item_key (covering)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_responses_participant_phase_item
+        ON responses (participant_id, phase, item_key, value, created_at)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses (created_at)")
+    # /admin/events: join on participant_id, ordered by timestamp (covering)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_participant_timestamp
+        ON events (participant_id, timestamp, event, duration_ms)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp)")
+
+
+def _migration_sessions(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def _migration_session_version(conn):
+    conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+MIGRATIONS = [
+    (1, "base tables", _migration_base_tables),
+    (2, "participants.claim_token", _migration_claim_token),
+    (3, "assignment_counts table and triggers", _migration_assignment_counts),
+    (4, "events.duration_ms", _migration_event_duration),
+    (5, "indexes for assignment, exports and event ordering", _migration_indexes),
+    (6, "sessions table for server-side sessions", _migration_sessions),
+    (7, "sessions.version", _migration_session_version),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """Apply pending MIGRATIONS; return the resulting schema version."""
+    for version, description, apply in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read inside the write lock: another worker may have migrated already
+            if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                app.logger.info("Applied schema migration %d: %s", version, description)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    # WAL is persistent in the database file, so setting it once here is enough
+    conn.execute("PRAGMA journal_mode=WAL")
+    migrate(conn)
     conn.close()
 
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+class ConnectionPool:
+    """Per-process pool of reusable SQLite connections.
 
+    Connections are opened lazily and handed back after each request instead of
+    being closed. A pool inherited through fork() is discarded, so gunicorn
+    workers never share a connection with the master.
+    """
 
-init_db()
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._pid == os.getpid() and self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+db_pool = ConnectionPool(DB_PATH)
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection for the duration of a with-block."""
+    conn = db_pool.acquire()
+    try:
+        yield conn
+    finally:
+        db_pool.release(conn)
+
+
+# --------------------------
+# Server-side sessions
+# --------------------------
+
+# Keys whose first value or change means a new participant identity; the
+# session id is rotated when they are set (consent, condition assignment)
+SESSION_IDENTITY_KEYS = ("prolific_pid", "participant_id")
+
+
+class SessionStore:
+    """Session state in the sessions table, with a per-worker LRU in front.
+
+    Saving updates a session's row in place and bumps its version; the
+    cookie carries both ("<id>.<version>"). A worker answers from its cache
+    while the cached version is at least the cookie's, so a session saved in
+    another worker is read from the database once, and a request that still
+    carries an older cookie gets the current state instead of an empty one.
+    """
+
+    def __init__(self, size=SESSION_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # sid -> (version, data)
+
+    def _remember(self, sid, version, data):
+        with self._lock:
+            cached = self._cache.get(sid)
+            if cached is None or cached[0] <= version:
+                self._cache[sid] = (version, data)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+
+    def get(self, sid, version=0):
+        """(version, state) stored under sid (state is shared; do not modify), or None."""
+        with self._lock:
+            cached = self._cache.get(sid)
+            if cached is not None and cached[0] >= version:
+                self._cache.move_to_end(sid)
+                return cached
+        with db_connection() as conn:
+            row = conn.execute("SELECT version, data FROM sessions WHERE id = ?", (sid,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row["data"])
+        self._remember(sid, row["version"], data)
+        return row["version"], data
+
+    def create(self, data, replaces=None):
+        """Store data under a new id, dropping the replaced one; return (id, version)."""
+        sid = secrets.token_urlsafe(32)
+        with db_connection() as conn:
+            conn.execute(
+                "INSERT INTO sessions (id, data, created_at) VALUES (?, ?, ?)",
+                (sid, json.dumps(data), datetime.utcnow().isoformat())
+            )
+            if replaces:
+                conn.execute("DELETE FROM sessions WHERE id = ?", (replaces,))
+            conn.commit()
+        self._remember(sid, 0, data)
+        self.forget(replaces)
+        return sid, 0
+
+    def update(self, sid, data):
+        """Store data under sid and bump its version; return (id, version).
+
+        Falls back to create() if the row is gone (deleted in the meantime).
+        """
+        with db_connection() as conn:
+            conn.execute("UPDATE sessions SET data = ?, version = version + 1 WHERE id = ?", (json.dumps(data), sid))
+            # Same transaction as the UPDATE, so this is the version just written
+            row = conn.execute("SELECT version FROM sessions WHERE id = ?", (sid,)).fetchone()
+            conn.commit()
+        if row is None:
+            return self.create(data)
+        version = row["version"]
+        self._remember(sid, version, data)
+        return sid, version
+
+    def delete(self, sid):
+        with db_connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+            conn.commit()
+        self.forget(sid)
+
+    def forget(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+
+class ServerSession(SessionMixin):
+    """A session whose state is only loaded from the store when first used."""
+
+    def __init__(self, store, sid=None, version=0):
+        self.store = store
+        self.sid = sid
+        self.version = version
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.rotate = False
+        self._data = None if sid else {}
+
+    @property
+    def data(self):
+        self.accessed = True
+        if self._data is None:
+            stored = self.store.get(self.sid, self.version)
+            self._data = dict(stored[1]) if stored else {}
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if key in SESSION_IDENTITY_KEYS and self.data.get(key) != value:
+            self.rotate = True
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps only a random session id and version in the cookie; nothing is signed per request.
+
+    The cookie is only set when the session changes, so requests that just
+    read the session send no Set-Cookie. The id itself only changes when a
+    SESSION_IDENTITY_KEYS value does.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid, _, version = (request.cookies.get(self.get_cookie_name(app)) or "").partition(".")
+        if not sid:
+            return ServerSession(self.store)
+        return ServerSession(self.store, sid, int(version) if version.isdigit() else 0)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        partitioned = self.get_cookie_partitioned(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not session.modified:
+            return
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly, partitioned=partitioned)
+            return
+        if session.sid is None or session.rotate:
+            sid, version = self.store.create(dict(session), replaces=session.sid)
+        else:
+            sid, version = self.store.update(session.sid, dict(session))
+        response.set_cookie(name, f"{sid}.{version}", expires=self.get_expiration_time(app, session),
+                            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite,
+                            partitioned=partitioned)
+
+
+session_store = SessionStore()
+if SESSION_BACKEND == "server":
+    app.session_interface = ServerSessionInterface(session_store)
+elif SESSION_BACKEND != "cookie":
+    raise RuntimeError(f"SESSION_BACKEND must be 'cookie' or 'server', not {SESSION_BACKEND!r}")
+
+
+# --------------------------
+# Static assets
+# --------------------------
+
+# Built by `python assets.py build`; empty (sources are served) without a build
+static_assets = AssetManifest()
+
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a static file: its fingerprinted build if there is one (not in debug mode)."""
+    built = None if app.debug else static_assets.built(filename)
+    if built is None:
+        return url_for("static", filename=filename)
+    return url_for("asset", filename=built)
+
+
+@app.route("/assets/<path:filename>")
+def asset(filename):
+    """A built asset, in the best format and encoding the browser accepts, cached for good."""
+    picked = static_assets.pick(
+        filename,
+        encodings=[value for value, quality in request.accept_encodings if quality],
+        formats=[value for value, quality in request.accept_mimetypes if quality],
+    )
+    if picked is None:
+        abort(404)
+    path, mimetype, encoding = picked
+    response = send_from_directory(DIST_DIR, path, mimetype=mimetype, download_name=os.path.basename(filename))
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.vary.update(["Accept", "Accept-Encoding"])
+    return response
 
 
 # --------------------------
 # Helper: Load conversation
 # --------------------------
 
+def conversation_path(condition, index):
+    return os.path.join(CONV_DIR, condition, f"conversation_{condition}{index}.json")
+
+
 def load_conversation_from_file(condition, index):
-    folder = os.path.join(CONV_DIR, condition)
-    filename = f"conversation_{condition}{index}.json"
-    filepath = os.path.join(folder, filename)
-    if not os.path.exists(filepath):
-        return ["Error: Conversation file not found"]
-    with open(filepath, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """Load a vignette as "Role: text" lines (either saved format is accepted)."""
+    with open(conversation_path(condition, index), "r", encoding="utf-8") as f:
+        return as_lines(json.load(f))
+
+
+Vignette = namedtuple("Vignette", ["history", "history_json", "mtime"])
+
+
+class VignetteCache:
+    """All study vignettes, read once per worker instead of once per request.
+
+    Each entry keeps the history as a tuple together with its HTML-safe JSON
+    (what the template's tojson filter would produce), so rendering a
+    conversation page does no file I/O or serialization. With check_mtime,
+    a vignette is reloaded when its file changes (used in debug mode).
+    """
+
+    def __init__(self, conditions, indices):
+        self.keys = [(c, i) for c in conditions for i in indices]
+        self._entries = {}
+
+    def _load(self, condition, index):
+        mtime = os.path.getmtime(conversation_path(condition, index))
+        history = tuple(load_conversation_from_file(condition, index))
+        return Vignette(history, htmlsafe_json_dumps(list(history)), mtime)
+
+    def load_all(self):
+        """Load every expected vignette; raise if any of them is missing."""
+        missing = [conversation_path(c, i) for c, i in self.keys if not os.path.exists(conversation_path(c, i))]
+        if missing:
+            raise RuntimeError("Missing conversation vignettes: " + ", ".join(missing))
+        self._entries = {key: self._load(*key) for key in self.keys}
+
+    def get(self, condition, index, check_mtime=False):
+        entry = self._entries[(condition, index)]
+        if check_mtime and os.path.getmtime(conversation_path(condition, index)) != entry.mtime:
+            entry = self._load(condition, index)
+            self._entries = {**self._entries, (condition, index): entry}
+        return entry
+
+
+vignettes = VignetteCache(CONDITIONS, CONVERSATION_INDICES)
+
+
+Page = namedtuple("Page", ["vignette", "body", "etag"])
+
+
+class PageCache:
+    """conversation.html rendered once per vignette and worker.
+
+    The page only depends on the vignette and its condition (nothing about
+    the participant is shown on it), so each (condition, index) is rendered
+    on its first request and served as stored bytes with a strong ETag after
+    that. A page is re-rendered when its vignette was reloaded; in debug
+    mode every request renders, so template edits show up.
+    """
+
+    def __init__(self, vignettes):
+        self.vignettes = vignettes
+        self._pages = {}
+
+    def _render(self, condition, vignette):
+        body = render_template("conversation.html", history_json=vignette.history_json, mode=condition).encode()
+        return Page(vignette, body, hashlib.blake2b(body, digest_size=16).hexdigest())
+
+    def get(self, condition, index):
+        vignette = self.vignettes.get(condition, index, check_mtime=app.debug)
+        if app.debug:
+            return self._render(condition, vignette)
+        page = self._pages.get((condition, index))
+        if page is None or page.vignette is not vignette:
+            page = self._render(condition, vignette)
+            self._pages = {**self._pages, (condition, index): page}
+        return page
+
+
+conversation_pages = PageCache(vignettes)
+
+
+def conversation_page(condition, index):
+    """The vignette page, or 304 Not Modified if the browser already has it.
+
+    no-cache makes the browser revalidate every time, so the session checks
+    in front of this still run on a reload; only the body is saved.
+    """
+    page = conversation_pages.get(condition, index)
+    response = Response(page.body, mimetype="text/html")
+    response.set_etag(page.etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
 
 
 # --------------------------
 # Helper: Store survey responses
 # --------------------------
 
+class EventQueue:
+    """Write-behind buffer for client events.
+
+    Events are collected in memory and inserted with one executemany() when
+    the buffer reaches flush_size or every flush_interval seconds, whichever
+    comes first. The writer thread is started lazily in each process, so a
+    forked gunicorn worker gets its own.
+    """
+
+    def __init__(self, flush_size=EVENT_FLUSH_SIZE, flush_interval=EVENT_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = []
+        self._pid = None
+
+    def put(self, participant_id, event, duration_ms=None):
+        row = (participant_id, event, duration_ms, datetime.utcnow().isoformat())
+        with self._lock:
+            self._ensure_writer()
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self._wakeup.set()
+
+    def _ensure_writer(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._buffer = []
+        threading.Thread(target=self._run, name="event-writer", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far. Safe to call from any thread."""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        try:
+            with db_connection() as conn:
+                conn.executemany(
+                    "INSERT INTO events (participant_id, event, duration_ms, timestamp) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+        except sqlite3.Error:
+            app.logger.exception("Failed to write %d events; keeping them for the next flush", len(rows))
+            with self._lock:
+                self._buffer[:0] = rows
+
+
+event_queue = EventQueue()
+# Flush whatever is still buffered when the worker shuts down
+atexit.register(event_queue.flush)
+
+
 def log_event(participant_id, event):
     """Log a timestamped event for a participant."""
     if not participant_id:
         return
-    conn = get_db_connection()
-    conn.execute(
-        "INSERT INTO events (participant_id, event, timestamp) VALUES (?, ?, ?)",
-        (participant_id, event, datetime.utcnow().isoformat())
-    )
-    conn.commit()
-    conn.close()
+    event_queue.put(participant_id, event)
 
 
-def store_survey_responses(participant_id, phase, data):
-    """Flatten and store survey JSON data into the responses table."""
-    conn = get_db_connection()
-    now = datetime.utcnow().isoformat()
+def iter_response_rows(participant_id, phase, data, created_at):
+    """Yield one responses row per answered item.
+
+    Nested dicts (matrix cells, panels, panels inside panels) are flattened
+    recursively; each leaf is stored under its own key.
+    """
     for key, value in data.items():
         if isinstance(value, dict):
-            # Matrix / nested question — flatten
-            for inner_key, inner_value in value.items():
-                conn.execute(
-                    "INSERT INTO responses (participant_id, phase, item_key, value, created_at) VALUES (?, ?, ?, ?, ?)",
-                    (participant_id, phase, inner_key, str(inner_value), now)
-                )
+            yield from iter_response_rows(participant_id, phase, value, created_at)
         else:
-            conn.execute(
-                "INSERT INTO responses (participant_id, phase, item_key, value, created_at) VALUES (?, ?, ?, ?, ?)",
-                (participant_id, phase, key, str(value), now)
-            )
-    conn.commit()
-    conn.close()
+            yield (participant_id, phase, key, str(value), created_at)
+
+
+def store_survey_responses(participant_id, phase, data):
+    """Flatten and store survey JSON data into the responses table."""
+    now = datetime.utcnow().isoformat()
+    with db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO responses (participant_id, phase, item_key, value, created_at) VALUES (?, ?, ?, ?, ?)",
+            iter_response_rows(participant_id, phase, data, now)
+        )
+        conn.commit()
 
 
 # --------------------------
@@ -165,64 +755,53 @@ def assign_condition():
         claim_token = str(uuid.uuid4())
         session['claim_token'] = claim_token
 
-    conn = get_db_connection()
-    try:
-        conn.execute("BEGIN EXCLUSIVE")
-        participant = conn.execute(
-            "SELECT * FROM participants WHERE prolific_pid = ?", (prolific_pid,)
-        ).fetchone()
-        if participant:
-
-            if participant['claim_token'] == claim_token:
-                session['participant_id'] = participant['id']
-                session['participant_number'] = participant['participant_number']
-                session['condition'] = participant['condition']
-                session['conversation_index'] = participant['conversation_index']
-            else:
-
-                conn.close()
-                return "Already assigned in another session. Please refresh.", 409
-        else:
-            # Condition balancing (count only completed participants)
-            condition_counts = {
-                c: conn.execute(
-                    "SELECT COUNT(*) FROM participants WHERE condition = ?", (c,)
-                ).fetchone()[0]
-                for c in CONDITIONS
-            }
-            condition = min(condition_counts, key=condition_counts.get)
-            convo_counts = {
-                i: conn.execute(
-                    "SELECT COUNT(*) FROM participants WHERE condition = ? AND conversation_index = ?",
-                    (condition, i)
-                ).fetchone()[0]
-                for i in [1, 2, 3]
-            }
-            convo_index = min(convo_counts, key=convo_counts.get)
-            last_num = conn.execute("SELECT MAX(participant_number) FROM participants").fetchone()[0] or 0
-            new_number = last_num + 1
-
-            conn.execute("""
-                INSERT INTO participants (prolific_pid, participant_number, condition, conversation_index, status, created_at, claim_token)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (prolific_pid, new_number, condition, convo_index, "started", datetime.utcnow().isoformat(), claim_token))
-
-            # Get the inserted participant's id
-            row = conn.execute(
-                "SELECT id FROM participants WHERE prolific_pid = ?", (prolific_pid,)
+    with db_connection() as conn:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            participant = conn.execute(
+                "SELECT * FROM participants WHERE prolific_pid = ?", (prolific_pid,)
             ).fetchone()
-            session['participant_id'] = row['id']
-            session['participant_number'] = new_number
-            session['condition'] = condition
-            session['conversation_index'] = convo_index
+            if participant:
 
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        return f"Error assigning participant: {e}", 500
+                if participant['claim_token'] == claim_token:
+                    session['participant_id'] = participant['id']
+                    session['participant_number'] = participant['participant_number']
+                    session['condition'] = participant['condition']
+                    session['conversation_index'] = participant['conversation_index']
+                else:
+
+                    conn.rollback()
+                    return "Already assigned in another session. Please refresh.", 409
+            else:
+                # Condition balancing from the materialized counts (all assigned participants)
+                counts = {
+                    (row['condition'], row['conversation_index']): row['n']
+                    for row in conn.execute("SELECT condition, conversation_index, n FROM assignment_counts")
+                }
+                condition = min(
+                    CONDITIONS,
+                    key=lambda c: sum(counts.get((c, i), 0) for i in CONVERSATION_INDICES)
+                )
+                convo_index = min(CONVERSATION_INDICES, key=lambda i: counts.get((condition, i), 0))
+                # participant_number is UNIQUE, so MAX() is an index lookup
+                last_num = conn.execute("SELECT MAX(participant_number) FROM participants").fetchone()[0] or 0
+                new_number = last_num + 1
+
+                cur = conn.execute("""
+                    INSERT INTO participants (prolific_pid, participant_number, condition, conversation_index, status, created_at, claim_token)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (prolific_pid, new_number, condition, convo_index, "started", datetime.utcnow().isoformat(), claim_token))
+
+                session['participant_id'] = cur.lastrowid
+                session['participant_number'] = new_number
+                session['condition'] = condition
+                session['conversation_index'] = convo_index
+
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return f"Error assigning participant: {e}", 500
 
-    conn.close()
     return redirect(url_for("pre_survey"))
 
 
@@ -257,19 +836,7 @@ def conversation_entry():
     condition = session['condition']
     convo_index = session['conversation_index']
 
-    history = load_conversation_from_file(condition, convo_index)
-    finished = False
-
-    return render_template(
-        "conversation.html",
-        history=history,
-        mode=condition,
-        step=1,
-        total=1,
-        finished=finished,
-        participant_number=session.get('participant_number'),
-        prolific_pid=session.get('prolific_pid'),
-    )
+    return conversation_page(condition, convo_index)
 
 
 @app.route("/post-survey")
@@ -308,13 +875,12 @@ def finish():
     participant_number = session.get("participant_number")
 
     if prolific_pid:
-        conn = get_db_connection()
-        conn.execute(
-            "UPDATE participants SET status = ? WHERE prolific_pid = ? and participant_number = ?",
-            ("completed", prolific_pid, participant_number)
-        )
-        conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            conn.execute(
+                "UPDATE participants SET status = ? WHERE prolific_pid = ? and participant_number = ?",
+                ("completed", prolific_pid, participant_number)
+            )
+            conn.commit()
 
     session['finished'] = True
     return '', 200
@@ -324,30 +890,55 @@ def finish():
 # Admin: See participants
 # --------------------------
 
+def parse_event(data):
+    """Return (event, duration_ms) from a client event payload, or None if invalid."""
+    if not isinstance(data, dict) or not data.get("event"):
+        return None
+    duration_ms = data.get("duration_ms")
+    if duration_ms is not None:
+        try:
+            duration_ms = float(duration_ms)
+        except (TypeError, ValueError):
+            return None
+    return str(data["event"]), duration_ms
+
+
 @app.route("/api/event", methods=["POST"])
 def api_event():
     """Log a client-side timing event."""
     if "participant_id" not in session:
         return jsonify({"error": "Not authenticated"}), 401
-    data = request.get_json()
+    data = request.get_json(silent=True)
     if not data or "event" not in data:
         return jsonify({"error": "No event"}), 400
-    conn = get_db_connection()
-    conn.execute(
-        "INSERT INTO events (participant_id, event, timestamp) VALUES (?, ?, ?)",
-        (session['participant_id'], data['event'], datetime.utcnow().isoformat())
-    )
-    # Store duration if provided
-    if "duration_ms" in data:
-        conn.execute(
-            "INSERT INTO events (participant_id, event, timestamp) VALUES (?, ?, ?)",
-            (session['participant_id'], f"{data['event']}_duration_ms:{data['duration_ms']}", datetime.utcnow().isoformat())
-        )
-    conn.commit()
-    conn.close()
+    parsed = parse_event(data)
+    if parsed is None:
+        return jsonify({"error": "Invalid event"}), 400
+    event_queue.put(session['participant_id'], *parsed)
     return jsonify({"ok": True})
 
 
+@app.route("/api/events", methods=["POST"])
+def api_events():
+    """Log several client-side timing events sent in one POST.
+
+    Accepts either a JSON list of events or {"events": [...]}; each event has
+    the same shape as for /api/event.
+    """
+    if "participant_id" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    data = request.get_json(silent=True)
+    events = data.get("events") if isinstance(data, dict) else data
+    if not events or not isinstance(events, list):
+        return jsonify({"error": "No events"}), 400
+    parsed = [parse_event(e) for e in events]
+    if None in parsed:
+        return jsonify({"error": "Invalid event"}), 400
+    for event, duration_ms in parsed:
+        event_queue.put(session['participant_id'], event, duration_ms)
+    return jsonify({"ok": True, "accepted": len(parsed)})
+
+
 @app.route("/test")
 def test_page():
     return render_template("test.html")
@@ -355,9 +946,8 @@ def test_page():
 
 @app.route("/admin/participants")
 def show_participants():
-    conn = get_db_connection()
-    participants = conn.execute("SELECT * FROM participants ORDER BY id").fetchall()
-    conn.close()
+    with db_connection() as conn:
+        participants = conn.execute("SELECT * FROM participants ORDER BY id").fetchall()
     return {
         "participants": [dict(p) for p in participants]
     }
@@ -367,71 +957,267 @@ def show_participants():
 # Admin: CSV export
 # --------------------------
 
-@app.route("/admin/export")
-def admin_export():
-    conn = get_db_connection()
-    rows = conn.execute("""
-        SELECT
-            p.id AS participant_id,
-            p.prolific_pid,
-            p.participant_number,
-            p.condition,
-            p.conversation_index,
-            p.status,
-            p.created_at AS participant_created_at,
-            r.phase,
-            r.item_key,
-            r.value,
-            r.created_at AS response_created_at
-        FROM participants p
-        LEFT JOIN responses r ON p.id = r.participant_id
-        ORDER BY p.id, r.phase, r.item_key
-    """).fetchall()
-    conn.close()
+def stream_csv(header, query, params=()):
+    """Yield a CSV export chunk by chunk straight from a database cursor."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    with db_connection() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def csv_export_response(filename, header, query, params=()):
+    """Stream a CSV download, gzip-encoded when the client accepts it (disable with ?gzip=0)."""
+    chunks = stream_csv(header, query, params)
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding"}
+    if request.args.get("gzip") != "0" and "gzip" in request.accept_encodings:
+        chunks = gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(chunks, mimetype="text/csv", headers=headers)
+
+
+def parse_since():
+    """Read the optional ?since=<ISO timestamp> filter; raises ValueError if malformed.
+
+    Returned in the stored format (naive UTC, "T" separator) so it compares
+    correctly as a string: "2024-05-01 10:00" and offsets like "+02:00" are
+    normalized first.
+    """
+    since = request.args.get("since")
+    if not since:
+        return None
+    moment = datetime.fromisoformat(since)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.isoformat()
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
-        "participant_id", "prolific_pid", "participant_number", "condition",
-        "conversation_index", "status", "participant_created_at",
-        "phase", "item_key", "value", "response_created_at"
-    ])
-    for row in rows:
-        writer.writerow(list(row))
 
-    return Response(
-        output.getvalue(),
-        mimetype="text/csv",
-        headers={"Content-Disposition": "attachment; filename=mindfort_export.csv"}
+@app.route("/admin/export")
+def admin_export():
+    try:
+        since = parse_since()
+    except ValueError:
+        return jsonify({"error": "since must be an ISO timestamp"}), 400
+    # Filtering on r turns the LEFT JOIN into an inner join: a since= export
+    # only has participants with responses recorded after that time
+    where, params = ("WHERE r.created_at > ?", (since,)) if since else ("", ())
+    return csv_export_response(
+        "mindfort_export.csv",
+        [
+            "participant_id", "prolific_pid", "participant_number", "condition",
+            "conversation_index", "status", "participant_created_at",
+            "phase", "item_key", "value", "response_created_at"
+        ],
+        f"""
+            SELECT
+                p.id AS participant_id,
+                p.prolific_pid,
+                p.participant_number,
+                p.condition,
+                p.conversation_index,
+                p.status,
+                p.created_at AS participant_created_at,
+                r.phase,
+                r.item_key,
+                r.value,
+                r.created_at AS response_created_at
+            FROM participants p
+            LEFT JOIN responses r ON p.id = r.participant_id
+            {where}
+            ORDER BY p.id, r.phase, r.item_key
+        """,
+        params,
     )
 
 
 @app.route("/admin/events")
 def admin_events():
-    conn = get_db_connection()
-    rows = conn.execute("""
-        SELECT
-            p.id AS participant_id,
-            p.prolific_pid,
-            p.condition,
-            e.event,
-            e.timestamp
-        FROM events e
-        JOIN participants p ON p.id = e.participant_id
-        ORDER BY p.id, e.timestamp
-    """).fetchall()
-    conn.close()
+    try:
+        since = parse_since()
+    except ValueError:
+        return jsonify({"error": "since must be an ISO timestamp"}), 400
+    where, params = ("WHERE e.timestamp > ?", (since,)) if since else ("", ())
+    return csv_export_response(
+        "mindfort_events.csv",
+        ["participant_id", "prolific_pid", "condition", "event", "duration_ms", "timestamp"],
+        f"""
+            SELECT
+                p.id AS participant_id,
+                p.prolific_pid,
+                p.condition,
+                e.event,
+                e.duration_ms,
+                e.timestamp
+            FROM events e
+            JOIN participants p ON p.id = e.participant_id
+            {where}
+            ORDER BY p.id, e.timestamp
+        """,
+        params,
+    )
+
+
+# --------------------------
+# Admin: Wide-format export
+# --------------------------
+
+WIDE_ID_COLUMNS = ["participant_id", "prolific_pid", "participant_number", "condition", "conversation_index", "status"]
+WIDE_ID_INT_TYPES = {"participant_id": "int32", "participant_number": "int32", "conversation_index": "int8"}
+
+
+class WideResponses:
+    """Responses pivoted to one row per participant, one column per phase x item_key.
+
+    The pivot is kept in memory per worker and only responses with an id
+    above the last one seen are read on each refresh, so the database work
+    per download is O(new rows). The rest is not incremental: each refresh
+    re-reads the participants and copies the pivot, and wide_table()
+    rebuilds every column, which is O(participants x columns) in memory.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._values = {}
+        self._columns = set()
+
+    def refresh(self, conn):
+        """Fold in new responses; return (participants, columns, values) to export."""
+        with self._lock:
+            rows = conn.execute(
+                "SELECT id, participant_id, phase, item_key, value FROM responses WHERE id > ? ORDER BY id",
+                (self._last_id,)
+            )
+            for response_id, participant_id, phase, item_key, value in rows:
+                column = f"{phase}_{item_key}"
+                self._values.setdefault(participant_id, {})[column] = value
+                self._columns.add(column)
+                self._last_id = response_id
+            participants = conn.execute("""
+                SELECT id AS participant_id, prolific_pid, participant_number, condition, conversation_index, status
+                FROM participants ORDER BY id
+            """).fetchall()
+            values = {pid: dict(answers) for pid, answers in self._values.items()}
+            return participants, sorted(self._columns), values
+
+
+wide_responses = WideResponses()
+
+
+def small_int_type(values):
+    """Return "int8"/"int16" if every non-empty value is an integer that fits, else None."""
+    present = [v for v in values if v not in (None, "")]
+    if not present:
+        return None
+    try:
+        ints = [int(v) for v in present]
+    except ValueError:
+        return None
+    if all(-128 <= i <= 127 for i in ints):
+        return "int8"
+    if all(-32768 <= i <= 32767 for i in ints):
+        return "int16"
+    return None
+
+
+def wide_column_type(name, column):
+    """Integer dtype for a wide column, or None to keep it as text."""
+    if name in WIDE_ID_COLUMNS:
+        return WIDE_ID_INT_TYPES.get(name)
+    return small_int_type(column)
+
+
+def wide_table():
+    """Return the wide export as an ordered {column: list of values} mapping."""
+    with db_connection() as conn:
+        participants, columns, values = wide_responses.refresh(conn)
+    table = {name: [p[name] for p in participants] for name in WIDE_ID_COLUMNS}
+    for column in columns:
+        table[column] = [values.get(p["participant_id"], {}).get(column) for p in participants]
+    return table
+
+
+def wide_columnar(table):
+    """Serialize to Parquet if pyarrow is installed, else to a typed NumPy .npz.
+
+    Integer-valued items (Likert scales, age) are stored as small ints; in the
+    .npz a missing answer is -1 because NumPy ints have no null.
+    Returns (bytes, filename, mimetype), or None if neither library is available.
+    """
+    buffer = io.BytesIO()
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = None
+    if pa is not None:
+        arrays = {}
+        for name, column in table.items():
+            int_type = wide_column_type(name, column)
+            if int_type:
+                arrays[name] = pa.array([None if v in (None, "") else int(v) for v in column], type=getattr(pa, int_type)())
+            else:
+                arrays[name] = pa.array([None if v is None else str(v) for v in column], type=pa.string())
+        pq.write_table(pa.table(arrays), buffer, compression="zstd")
+        return buffer.getvalue(), "mindfort_wide.parquet", "application/vnd.apache.parquet"
+
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    arrays = {}
+    for name, column in table.items():
+        int_type = wide_column_type(name, column)
+        if int_type:
+            arrays[name] = np.array([-1 if v in (None, "") else int(v) for v in column], dtype=int_type)
+        else:
+            arrays[name] = np.array(["" if v is None else str(v) for v in column], dtype=str)
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue(), "mindfort_wide.npz", "application/octet-stream"
+
+
+@app.route("/admin/export/wide")
+def admin_export_wide():
+    """Wide-format export: ?format=csv (default) or ?format=columnar."""
+    export_format = request.args.get("format", "csv")
+    if export_format not in ("csv", "columnar"):
+        return jsonify({"error": "format must be csv or columnar"}), 400
+
+    table = wide_table()
+    if export_format == "columnar":
+        result = wide_columnar(table)
+        if result is None:
+            return jsonify({"error": "columnar export needs pyarrow or numpy installed"}), 501
+        data, filename, mimetype = result
+        return Response(data, mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename={filename}"})
 
     output = io.StringIO()
     writer = csv.writer(output)
-    writer.writerow(["participant_id", "prolific_pid", "condition", "event", "timestamp"])
-    for row in rows:
-        writer.writerow(list(row))
-
+    writer.writerow(table.keys())
+    writer.writerows(zip(*table.values()))
     return Response(
         output.getvalue(),
         mimetype="text/csv",
-        headers={"Content-Disposition": "attachment; filename=mindfort_events.csv"}
+        headers={"Content-Disposition": "attachment; filename=mindfort_wide.csv"}
     )
 
 
@@ -441,27 +1227,68 @@ def admin_events():
 
 @app.route("/conversation/<condition_name>/<int:index>")
 def conversation_entry_direct(condition_name, index):
-    if condition_name not in CONDITIONS or not 1 <= index <= 3:
+    if condition_name not in CONDITIONS or index not in CONVERSATION_INDICES:
         return "Invalid conversation", 404
 
-    history = load_conversation_from_file(condition_name, index)
-    finished = False
+    return conversation_page(condition_name, index)
+
+# --------------------------
+# App factory
+# --------------------------
+
+# Seconds spent in each create_app() step, for the gunicorn boot log
+startup_timings = {}
+_created = threading.Event()
+_create_lock = threading.RLock()
+
+
+def create_app(init_schema=True):
+    """Set up the database and warm every per-process cache; return the app.
+
+    Importing this module touches neither the database nor the vignettes;
+    this does (on the first request, if nothing called it). Under gunicorn the master
+    calls this once with preload_app (see gunicorn.conf.py) and the schema
+    is set up in its on_starting hook, so workers fork with the vignettes,
+    compiled templates and rendered conversation pages already in
+    (copy-on-write) memory.
+    """
+    steps = [("vignettes", vignettes.load_all), ("templates", warm_templates), ("pages", warm_pages)]
+    if init_schema:
+        steps.insert(0, ("schema", init_db))
+    with _create_lock:
+        for name, step in steps:
+            start = time.perf_counter()
+            step()
+            startup_timings[name] = time.perf_counter() - start
+        _created.set()
+    return app
+
+
+@app.before_request
+def ensure_created():
+    """Run create_app() on the first request if whatever serves app:app never called it."""
+    if not _created.is_set():
+        with _create_lock:
+            if not _created.is_set():
+                create_app()
+
+
+def warm_templates():
+    """Compile every template into the Jinja cache."""
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
+
+def warm_pages():
+    """Render every conversation page into the page cache."""
+    with app.test_request_context():
+        for condition, index in vignettes.keys:
+            conversation_pages.get(condition, index)
 
-    return render_template(
-        "conversation.html",
-        history=history,
-        mode=condition_name,
-        step=index,
-        total=1,
-        finished=finished,
-        participant_number=None,
-        prolific_pid=None,
-    )
 
 # --------------------------
 # Run the app
 # --------------------------
 
 if __name__ == "__main__":
-    init_db()
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 3001)), debug=os.environ.get("FLASK_DEBUG", "true").lower() == "true")
+    create_app().run(host="0.0.0.0", port=int(os.environ.get("PORT", 3001)), debug=os.environ.get("FLASK_DEBUG", "true").lower() == "true")
@@ -0,0 +1,201 @@
+"""
+ASGI serving mode for the study app.
+
+The Flask routes stay as they are; AsgiApp runs them behind an asyncio
+server (uvicorn), so slow clients no longer hold a worker while their
+request body or response trickles through the socket:
+
+- request bodies are read and responses written on the event loop
+- routes that only read in-memory state (LOOP_ENDPOINTS: the vignette
+  pages from the page cache, the survey and debrief pages) run directly on
+  the loop
+- everything else, which includes every database write, runs in a thread
+  pool of ASGI_THREADS; streamed responses (CSV exports) are produced in
+  that thread and sent as they come
+
+    SERVER_MODE=asgi gunicorn -c gunicorn.conf.py     # uvicorn workers
+    uvicorn --factory asgi:create_app --port 3001      # single process
+
+Requires uvicorn. bench.py load compares this mode with the sync workers.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+import app as study_app
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 16))
+# Chunks of a streamed response buffered ahead of a slow client
+STREAM_BUFFER = 8
+
+# Endpoints that do no I/O beyond the session cookie; with server-side
+# sessions the ones reading the session may query the sessions table
+SESSIONLESS_ENDPOINTS = {"consent", "conversation_entry_direct"}
+SESSION_ENDPOINTS = {"start_page", "pre_survey", "conversation_entry", "post_survey", "debrief"}
+LOOP_ENDPOINTS = SESSIONLESS_ENDPOINTS | (SESSION_ENDPOINTS if study_app.SESSION_BACKEND == "cookie" else set())
+
+
+def wsgi_environ(scope, body):
+    """The PEP 3333 environ for an ASGI HTTP scope and its complete body."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name != "content-length":
+            key = "HTTP_" + name.upper().replace("-", "_")
+            separator = "; " if key == "HTTP_COOKIE" else ","
+            environ[key] = f"{environ[key]}{separator}{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(wsgi_app, environ):
+    """Call a WSGI app; return ([status, headers], its response iterable)."""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    return started, wsgi_app(environ, start_response)
+
+
+def response_start(status, headers):
+    return {
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    }
+
+
+class AsgiApp:
+    def __init__(self, flask_app, threads=ASGI_THREADS):
+        self.flask_app = flask_app
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            body = bytearray()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            environ = wsgi_environ(scope, bytes(body))
+            if self.on_loop(environ):
+                await self.run_inline(environ, send)
+            else:
+                await self.run_in_pool(environ, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(self.pool, study_app.event_queue.flush)
+                self.pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def on_loop(self, environ):
+        """Whether the request's route is safe to run on the event loop."""
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except (HTTPException, RequestRedirect):
+            return False
+        return endpoint in LOOP_ENDPOINTS and not self.flask_app.debug
+
+    async def run_inline(self, environ, send):
+        started, result = call_wsgi(self.flask_app, environ)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        await send(response_start(*started))
+        await send({"type": "http.response.body", "body": body})
+
+    async def run_in_pool(self, environ, send):
+        """Run the Flask app in one pool thread; its chunks are sent as the thread produces them.
+
+        The thread hands chunks to the loop without waiting for it and only
+        blocks once STREAM_BUFFER chunks are waiting on a slow client.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        room = threading.Semaphore(STREAM_BUFFER)
+        cancelled = threading.Event()
+
+        def put(message):
+            room.acquire()
+            if cancelled.is_set():
+                return False
+            loop.call_soon_threadsafe(chunks.put_nowait, message)
+            return True
+
+        def produce():
+            try:
+                started, result = call_wsgi(self.flask_app, environ)
+                try:
+                    for chunk in result:
+                        if chunk and not put(("body", started, chunk)):
+                            return
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()
+                put(("end", started, b""))
+            except BaseException as exc:
+                put(("error", exc, None))
+
+        loop.run_in_executor(self.pool, produce)
+        sent_start = False
+        try:
+            while True:
+                kind, value, chunk = await chunks.get()
+                if kind == "error":
+                    raise value
+                if not sent_start:
+                    await send(response_start(*value))
+                    sent_start = True
+                await send({"type": "http.response.body", "body": chunk, "more_body": kind == "body"})
+                room.release()
+                if kind == "end":
+                    return
+        finally:
+            cancelled.set()
+            room.release(STREAM_BUFFER)
+
+
+def create_app(init_schema=True):
+    """The study app set up by app.create_app(), served over ASGI."""
+    return AsgiApp(study_app.create_app(init_schema))
@@ -0,0 +1,225 @@
+"""
+Fingerprinted, precompressed static assets.
+
+The build step writes every asset the templates load to static/dist/ under
+a content-hashed name, so it can be cached by browsers for a year and never
+revalidated:
+
+- images are resized to IMAGE_WIDTHS (the CSS width the templates show them
+  at, times PIXEL_DENSITY) and recompressed to WebP and AVIF
+- CSS and JS are minified and precompressed with gzip and brotli
+
+    python assets.py build      # static/dist/ + static/dist/manifest.json
+    python assets.py clean
+
+static/dist/manifest.json maps each source name ("css/style.css") to its
+built file and variants. The app's asset_url() serves the built file when
+the manifest has it and the source otherwise, so a checkout without a build
+works unchanged. Pillow (with AVIF support for the .avif variants), brotli
+and rjsmin are optional; without them images are left as they are, only
+gzip is produced and JS is not minified.
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+
+try:
+    from PIL import Image, features
+except ImportError:  # optional: images are served unconverted
+    Image = features = None
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:  # optional: JS is only precompressed
+    rjsmin = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+
+# CSS pixel width each image is displayed at (conversation.html avatars, navbar icon)
+IMAGE_WIDTHS = {
+    "img/participant.png": 40,
+    "img/misinfo.png": 40,
+    "img/supportive.png": 40,
+    "img/refutational.png": 40,
+    "img/prebunking.png": 40,
+    "img/person.crop.circle.png": 18,
+}
+PIXEL_DENSITY = 2
+TEXT_ASSETS = ["css/style.css", "js/scripts.js", "surveys/survey_definitions.js"]
+
+WEBP_QUALITY = 82
+AVIF_QUALITY = 60
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+MIMETYPES = {".css": "text/css", ".js": "text/javascript", ".webp": "image/webp", ".avif": "image/avif"}
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+# ---------------------------------------------------------------------------
+# Serving
+# ---------------------------------------------------------------------------
+
+class AssetManifest:
+    """The built assets, as recorded by the last build.
+
+    entries: source name -> {"file": built name, "encodings": [...], "formats": [...]}
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self._variants = {entry["file"]: entry for entry in self.entries.values()}
+
+    def built(self, filename):
+        """The built name of a source file, or None if the build did not produce one."""
+        entry = self.entries.get(filename)
+        return entry["file"] if entry else None
+
+    def pick(self, built, encodings=(), formats=()):
+        """(file under DIST_DIR, Content-Type, Content-Encoding or None) to send for a built name.
+
+        encodings and formats are what the client accepts ("br", "gzip";
+        "image/avif"). Returns None for names that are not in the manifest.
+        """
+        entry = self._variants.get(built)
+        if entry is None:
+            return None
+        stem, ext = os.path.splitext(built)
+        if "image/avif" in formats and "avif" in entry.get("formats", ()):
+            return stem + ".avif", MIMETYPES[".avif"], None
+        for encoding in ("br", "gzip"):
+            if encoding in encodings and encoding in entry.get("encodings", ()):
+                return built + ENCODINGS[encoding], MIMETYPES[ext], encoding
+        return built, MIMETYPES[ext], None
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def minify_css(css):
+    """Drop comments and collapse whitespace (style.css has no strings that contain either)."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def minify(name, text):
+    if name.endswith(".css"):
+        return minify_css(text)
+    if rjsmin is not None:
+        return rjsmin.jsmin(text)
+    return text
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def build_text(name):
+    with open(os.path.join(STATIC_DIR, name), "r", encoding="utf-8") as f:
+        data = minify(name, f.read()).encode("utf-8")
+    stem, ext = os.path.splitext(name)
+    built = f"{stem}.{fingerprint(data)}{ext}"
+    write(os.path.join(DIST_DIR, built), data)
+    write(os.path.join(DIST_DIR, built + ".gz"), gzip.compress(data, 9, mtime=0))
+    encodings = ["gzip"]
+    if brotli is not None:
+        write(os.path.join(DIST_DIR, built + ".br"), brotli.compress(data, quality=11))
+        encodings.insert(0, "br")
+    return {"file": built, "encodings": encodings}
+
+
+def encode_image(image, fmt, quality):
+    out = io.BytesIO()
+    image.save(out, fmt, quality=quality)
+    return out.getvalue()
+
+
+def build_image(name, width):
+    with open(os.path.join(STATIC_DIR, name), "rb") as f:
+        source = f.read()
+    image = Image.open(io.BytesIO(source))
+    image.load()
+    image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    size = width * PIXEL_DENSITY
+    if image.width > size:
+        image = image.resize((size, round(image.height * size / image.width)), Image.LANCZOS)
+    # Named after the source and encoder settings, so the name is stable across encoder versions
+    stem = os.path.splitext(name)[0]
+    settings = f"{size}:{WEBP_QUALITY}:{AVIF_QUALITY}".encode()
+    built = f"{stem}.{fingerprint(source + settings)}.webp"
+    webp = encode_image(image, "WEBP", WEBP_QUALITY)
+    write(os.path.join(DIST_DIR, built), webp)
+    formats = []
+    if features.check("avif"):
+        avif = encode_image(image, "AVIF", AVIF_QUALITY)
+        if len(avif) < len(webp):  # tiny icons can come out larger
+            write(os.path.join(DIST_DIR, os.path.splitext(built)[0] + ".avif"), avif)
+            formats.append("avif")
+    return {"file": built, "formats": formats}
+
+
+def build():
+    """Rebuild static/dist/ from scratch and write the manifest; return it."""
+    clean()
+    manifest = {name: build_text(name) for name in TEXT_ASSETS}
+    if Image is None:
+        print("Pillow is not installed: images are served unconverted")
+    else:
+        manifest.update({name: build_image(name, width) for name, width in IMAGE_WIDTHS.items()})
+    write(MANIFEST_PATH, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+    lines = []
+    for name, entry in manifest.items():
+        stem = os.path.splitext(entry["file"])[0]
+        variants = [entry["file"]] + [entry["file"] + ENCODINGS[e] for e in entry.get("encodings", ())]
+        variants += [f"{stem}.{fmt}" for fmt in entry.get("formats", ())]
+        sizes = "  ".join(f"{os.path.splitext(v)[1][1:]} {os.path.getsize(os.path.join(DIST_DIR, v))}" for v in variants)
+        lines.append(f"  {name:<32} {os.path.getsize(os.path.join(STATIC_DIR, name)):8d} -> {sizes}")
+    print(f"Built {len(manifest)} assets into {os.path.relpath(DIST_DIR)} (bytes):")
+    print("\n".join(lines))
+    return manifest
+
+
+def clean():
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets.")
+    parser.add_argument("command", choices=["build", "clean"])
+    args = parser.parse_args()
+    if args.command == "build":
+        build()
+    else:
+        clean()
+
+
+if __name__ == "__main__":
+    main()
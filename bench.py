@@ -0,0 +1,985 @@
+"""
+Local benchmarks for the study app.
+
+Runs against a throwaway SQLite database in a temp directory, never against
+database.db. Usage:
+
+    python bench.py db [--threads 16] [--requests 2000]
+    python bench.py assign [--threads 64] [--participants 500]
+    python bench.py survey [--submits 500]
+    python bench.py plans [--participants 200]
+    python bench.py acts [--rounds 200]
+    python bench.py retry [--calls 300] [--threads 16]
+    python bench.py drafts [--conversations 6] [--drafts 3]
+    python bench.py engine [--runs 500]
+    python bench.py prompts [--conversations 4] [--prefill 0.2]
+    python bench.py pages [--requests 2000] [--threads 8]
+    python bench.py assets
+    python bench.py sessions [--requests 4000] [--threads 8]
+    python bench.py boot [--workers 4]
+    python bench.py load [--participants 500] [--modes wsgi asgi]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Point the app at a scratch database before it is imported
+_TMP_DIR = tempfile.mkdtemp(prefix="mindfort_bench_")
+os.environ["DB_PATH"] = os.path.join(_TMP_DIR, "bench.db")
+
+import app as study_app  # noqa: E402
+import assets  # noqa: E402
+import context  # noqa: E402
+import conversation  # noqa: E402
+import conversation_no_participant  # noqa: E402
+import dialogue_acts  # noqa: E402
+import engine  # noqa: E402
+import llm_client  # noqa: E402
+import mock_openai_server  # noqa: E402
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+from openai import OpenAI  # noqa: E402
+
+study_app.create_app()
+
+
+# ─── Helpers ─────────────────────────────────────────────────────────────────
+
+def fresh_database(name, journal_mode="WAL"):
+    """Create an empty, initialised database and point the app at it."""
+    path = os.path.join(_TMP_DIR, name)
+    if os.path.exists(path):
+        os.remove(path)
+    study_app.DB_PATH = path
+    study_app.init_db()
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.close()
+    return path
+
+
+def add_participants(n):
+    """Assign n participants through /assign and return their session data."""
+    sessions = []
+    for i in range(n):
+        client = study_app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["prolific_pid"] = f"BENCH_{i}"
+        client.get("/assign")
+        with client.session_transaction() as sess:
+            sessions.append(dict(sess))
+    return sessions
+
+
+def client_for(sess):
+    client = study_app.app.test_client()
+    with client.session_transaction() as s:
+        s.update(sess)
+    return client
+
+
+def run_concurrent(worker, jobs, threads):
+    """Run worker(job) for every job on a thread pool; return elapsed seconds."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for result in pool.map(worker, jobs):
+            if result is not None and result >= 400:
+                raise RuntimeError(f"request failed with status {result}")
+    return time.perf_counter() - start
+
+
+SURVEY_DEFINITIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "surveys", "survey_definitions.js")
+
+
+def survey_payload(survey_name):
+    """Build a complete SurveyJS result for window.<survey_name> in survey_definitions.js."""
+    with open(SURVEY_DEFINITIONS, encoding="utf-8") as f:
+        source = f.read()
+    start = source.index(f"window.{survey_name} =")
+    end = source.find("window.", start + 1)
+    block = source[start:end if end != -1 else len(source)]
+
+    payload = {}
+    questions = list(re.finditer(r'type: "(\w+)",\s*name: "(\w+)"', block))
+    for n, match in enumerate(questions):
+        qtype, name = match.groups()
+        body = block[match.end():questions[n + 1].start() if n + 1 < len(questions) else len(block)]
+        if qtype == "matrix":
+            rows = re.findall(r'\{ value: "(\w+)", text:', body)
+            payload[name] = {row: (i % 7) + 1 for i, row in enumerate(rows)}
+        elif qtype == "radiogroup":
+            payload[name] = "Real"
+        elif qtype == "dropdown":
+            payload[name] = re.search(r'choices: \[\s*"([^"]+)"', body).group(1)
+        elif qtype == "checkbox":
+            payload[name] = ["agreed"]
+        elif qtype == "text":
+            payload[name] = 34
+        elif qtype == "comment":
+            payload[name] = "The bots made me think twice about the claims. " * 4
+    return payload
+
+
+def store_row_by_row(participant_id, phase, data):
+    """The original store_survey_responses: one execute() per item."""
+    now = study_app.datetime.utcnow().isoformat()
+    with study_app.db_connection() as conn:
+        for key, value in data.items():
+            if isinstance(value, dict):
+                for inner_key, inner_value in value.items():
+                    conn.execute(
+                        "INSERT INTO responses (participant_id, phase, item_key, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (participant_id, phase, inner_key, str(inner_value), now)
+                    )
+            else:
+                conn.execute(
+                    "INSERT INTO responses (participant_id, phase, item_key, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (participant_id, phase, key, str(value), now)
+                )
+        conn.commit()
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+class UnpooledConnections:
+    """The original behaviour: one fresh connection per request, default pragmas."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def acquire(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn):
+        conn.close()
+
+    def close_all(self):
+        pass
+
+
+# ─── Benchmarks ──────────────────────────────────────────────────────────────
+
+def bench_db(args):
+    """Requests/sec of the DB-bound routes with and without the connection pool."""
+
+    def one_request(job):
+        sess, i = job
+        client = client_for(sess)
+        if i % 4 == 3:
+            return client.get("/finish").status_code
+        return client.post("/api/event", json={"event": "page_bench", "duration_ms": i}).status_code
+
+    results = {}
+    for label, journal_mode, make_pool in [
+        ("before (connect per request, rollback journal)", "DELETE", UnpooledConnections),
+        ("after  (pooled, WAL)", "WAL", study_app.ConnectionPool),
+    ]:
+        path = fresh_database(f"db_{journal_mode.lower()}.db", journal_mode)
+        study_app.db_pool.close_all()
+        study_app.db_pool = make_pool(path)
+        sessions = add_participants(args.threads)
+        jobs = [(sessions[i % len(sessions)], i) for i in range(args.requests)]
+        elapsed = run_concurrent(one_request, jobs, args.threads)
+        results[label] = args.requests / elapsed
+        study_app.db_pool.close_all()
+
+    for label, rps in results.items():
+        print(f"{label:<50} {rps:8.1f} req/s")
+    before, after = results.values()
+    print(f"{'speedup':<50} {after / before:8.2f}x")
+
+
+def bench_assign(args):
+    """Fire concurrent /assign calls and verify that condition balance holds."""
+    fresh_database("assign.db")
+    study_app.db_pool.close_all()
+    study_app.db_pool = study_app.ConnectionPool(study_app.DB_PATH)
+    latencies = []
+
+    def one_assign(i):
+        client = study_app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["prolific_pid"] = f"ASSIGN_{i}"
+        start = time.perf_counter()
+        status = client.get("/assign").status_code
+        latencies.append(time.perf_counter() - start)
+        return status
+
+    elapsed = run_concurrent(one_assign, range(args.participants), args.threads)
+
+    with study_app.db_connection() as conn:
+        actual = {
+            (r["condition"], r["conversation_index"]): r["n"]
+            for r in conn.execute(
+                "SELECT condition, conversation_index, COUNT(*) AS n FROM participants GROUP BY 1, 2"
+            )
+        }
+        materialized = {
+            (r["condition"], r["conversation_index"]): r["n"]
+            for r in conn.execute("SELECT condition, conversation_index, n FROM assignment_counts WHERE n > 0")
+        }
+        numbers = [r[0] for r in conn.execute("SELECT participant_number FROM participants ORDER BY 1")]
+
+    per_condition = {
+        c: sum(actual.get((c, i), 0) for i in study_app.CONVERSATION_INDICES) for c in study_app.CONDITIONS
+    }
+    per_cell = list(actual.values())
+    checks = {
+        "all participants assigned": len(numbers) == args.participants,
+        "participant numbers are 1..N": numbers == list(range(1, args.participants + 1)),
+        "conditions differ by at most 1": max(per_condition.values()) - min(per_condition.values()) <= 1,
+        "vignettes differ by at most 1": max(per_cell) - min(per_cell) <= 1,
+        "counter table matches participants": actual == materialized,
+    }
+
+    latencies.sort()
+    print(f"{args.participants} assignments on {args.threads} threads in {elapsed:.2f}s")
+    print(f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p95 {percentile(latencies, 0.95) * 1000:.1f} ms")
+    print("per condition:", per_condition)
+    for name, ok in checks.items():
+        print(f"  [{'ok' if ok else 'FAIL'}] {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+def bench_survey(args):
+    """Per-submit latency of store_survey_responses on the real pre/post surveys."""
+    payloads = {"pre": survey_payload("preSurvey"), "post": survey_payload("postSurvey")}
+    for phase, payload in payloads.items():
+        rows = sum(1 for _ in study_app.iter_response_rows(0, phase, payload, ""))
+        print(f"{phase}-survey payload: {rows} response rows")
+
+    for label, store in [
+        ("row by row (before)", store_row_by_row),
+        ("executemany (after)", study_app.store_survey_responses),
+    ]:
+        fresh_database(f"survey_{store.__name__}.db")
+        study_app.db_pool.close_all()
+        study_app.db_pool = study_app.ConnectionPool(study_app.DB_PATH)
+        for phase, payload in payloads.items():
+            latencies = []
+            for i in range(args.submits):
+                start = time.perf_counter()
+                store(i + 1, phase, payload)
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(f"{label:<22} {phase:<5} p50 {percentile(latencies, 0.5) * 1000:6.3f} ms  "
+                  f"p95 {percentile(latencies, 0.95) * 1000:6.3f} ms")
+
+
+# (name, SQL, params, allowed): allowed names the tables that may be scanned in
+# full (the driving participants table of a full export) and "sort" where a
+# temp B-tree over just the new rows is acceptable.
+HOT_QUERIES = [
+    ("assign: participant by prolific_pid",
+     "SELECT * FROM participants WHERE prolific_pid = ?", ("P_1",), set()),
+    ("assign: next participant_number",
+     "SELECT MAX(participant_number) FROM participants", (), set()),
+    # assignment_counts has one row per condition x vignette, so reading all of it is the lookup
+    ("assign: balancing counts",
+     "SELECT condition, conversation_index, n FROM assignment_counts", (), {"assignment_counts"}),
+    ("assign: count trigger",
+     "UPDATE assignment_counts SET n = n + 1 WHERE condition = ? AND conversation_index = ?",
+     ("control", 1), set()),
+    ("finish: mark completed",
+     "UPDATE participants SET status = ? WHERE prolific_pid = ? and participant_number = ?",
+     ("completed", "P_1", 1), set()),
+    ("export: participants x responses",
+     """SELECT p.id, p.prolific_pid, p.participant_number, p.condition, p.conversation_index, p.status,
+               p.created_at, r.phase, r.item_key, r.value, r.created_at
+        FROM participants p LEFT JOIN responses r ON p.id = r.participant_id
+        ORDER BY p.id, r.phase, r.item_key""", (), {"p"}),
+    ("export since: new responses only",
+     """SELECT p.id, r.phase, r.item_key, r.value, r.created_at
+        FROM participants p LEFT JOIN responses r ON p.id = r.participant_id
+        WHERE r.created_at > ? ORDER BY p.id, r.phase, r.item_key""", ("2099-01-01",), {"sort"}),
+    ("events: ordered per participant",
+     """SELECT p.id, p.prolific_pid, p.condition, e.event, e.duration_ms, e.timestamp
+        FROM events e JOIN participants p ON p.id = e.participant_id
+        ORDER BY p.id, e.timestamp""", (), {"p"}),
+    ("session: state by id",
+     "SELECT version, data FROM sessions WHERE id = ?", ("x",), set()),
+    ("session: update in place",
+     "UPDATE sessions SET data = ?, version = version + 1 WHERE id = ?", ("{}", "x"), set()),
+    ("events since: new events only",
+     """SELECT p.id, e.event, e.timestamp FROM events e JOIN participants p ON p.id = e.participant_id
+        WHERE e.timestamp > ? ORDER BY p.id, e.timestamp""", ("2099-01-01",), {"p", "sort"}),
+]
+
+
+def bench_plans(args):
+    """EXPLAIN QUERY PLAN the hot queries and fail on unexpected full scans or sorts."""
+    fresh_database("plans.db")
+    study_app.db_pool.close_all()
+    study_app.db_pool = study_app.ConnectionPool(study_app.DB_PATH)
+    sessions = add_participants(args.participants)
+    payload = survey_payload("preSurvey")
+    for sess in sessions:
+        study_app.store_survey_responses(sess["participant_id"], "pre", payload)
+        study_app.event_queue.put(sess["participant_id"], "page__conversation", 1234.0)
+    study_app.event_queue.flush()
+
+    failed = False
+    with study_app.db_connection() as conn:
+        print(f"schema version {conn.execute('PRAGMA user_version').fetchone()[0]}")
+        for name, sql, params, allowed in HOT_QUERIES:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            problems = [
+                step for step in plan
+                if ("TEMP B-TREE" in step and "sort" not in allowed)
+                or (step.startswith("SCAN") and step.split()[1] not in allowed)
+            ]
+            failed = failed or bool(problems)
+            print(f"[{'FAIL' if problems else 'ok'}] {name}")
+            for step in plan:
+                print(f"       {step}")
+    if failed:
+        raise SystemExit(1)
+
+
+def legacy_dialogue_act(role, text):
+    """The original get_dialogue_act: lowercase plus substring scans per call."""
+    ltext = text.lower()
+    if role == "MisInfoBot":
+        return "Claim"
+    elif role == "SupportBot":
+        if any(word in ltext for word in ["not", "incorrect", "false", "important", "in fact", "research shows", "evidence", "in reality", "actually"]):
+            return "Correction"
+        return "Info"
+    elif role == "PrebunkingBot":
+        if "tactic" in ltext or any(x in ltext for x in ["misinformation", "manipulation", "out of context", "debunk"]):
+            if "doesn't contain misinformation" in ltext or "no misinformation" in ltext:
+                return "NoAction"
+            return "Debunk"
+        return "NoAction"
+    elif role == "RefutationalBot":
+        if any(phrase in ltext for phrase in ["false claim", "debunk", "disprove", "incorrect", "not true", "refute"]):
+            return "Refutation"
+        return "NoAction"
+    elif role == "Participant":
+        if any(q in ltext for q in ["?", "could", "would", "do you think"]):
+            return "Reflection-Question"
+        return "Reflection"
+    return "Other"
+
+
+def bench_acts(args):
+    """Classify the saved corpus with the original and the compiled classifier."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.join(root, "json")] + sorted(
+        os.path.join(root, name) for name in os.listdir(root)
+        if name.startswith("conversation_") and name.endswith(".json")
+    )
+    corpus = dict(dialogue_acts.iter_corpus(paths))
+    turns = [turn for conv in corpus.values() for turn in conv]
+    print(f"corpus: {len(turns)} turns in {len(corpus)} files")
+
+    def timed(classify, clear=None):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            if clear:
+                clear()
+            classify(turns)
+        return (time.perf_counter() - start) / (args.rounds * len(turns)) * 1e6
+
+    get_act = dialogue_acts.get_dialogue_act
+    for label, us in [
+        ("substring scans (before)", timed(lambda ts: [legacy_dialogue_act(r, t) for r, t in ts])),
+        ("compiled regex, cold", timed(dialogue_acts.classify_many, get_act.cache_clear)),
+        ("compiled regex, memoized", timed(dialogue_acts.classify_many)),
+    ]:
+        print(f"{label:<26} {us:6.2f} us/turn")
+
+    changed = [(r, t, legacy_dialogue_act(r, t), get_act(r, t)) for r, t in turns
+               if legacy_dialogue_act(r, t) != get_act(r, t)]
+    print(f"{len(changed)} turns classified differently (whole-word cues):")
+    for role, text, old, new in changed[:args.examples]:
+        print(f"  {role}: {old} -> {new}  {text[:70]!r}")
+
+
+def bench_retry(args):
+    """Calls against the fault-injecting mock server, bare client vs. retry layer."""
+    server = mock_openai_server.serve(
+        port=0, latency=0.01, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+        retry_after=0.2, hang_rate=args.hang_rate, hang=3.0, seed=1,
+    )
+    client = OpenAI(api_key="mock", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+                    max_retries=0, timeout=1.0)
+    messages = [[{"role": "system", "content": f"You are {speaker}, a bot."}, {"role": "user", "content": "hi"}]
+                for speaker in ("MisInfoBot", "SupportBot", "RefutationalBot", "PrebunkingBot")]
+    policy = llm_client.RetryPolicy(max_attempts=8, attempt_timeout=1.0, deadline=30.0, base_delay=0.05,
+                                    max_delay=1.0)
+
+    def run(create):
+        failures = []
+
+        def call(i):
+            try:
+                create(model="mock", messages=messages[i % len(messages)], max_tokens=20)
+            except Exception as e:
+                failures.append(type(e).__name__)
+
+        return run_concurrent(call, range(args.calls), args.threads), failures
+
+    print(f"{args.calls} calls on {args.threads} threads; faults: {args.error_rate:.0%} 500, "
+          f"{args.throttle_rate:.0%} 429 (Retry-After 0.2s), {args.hang_rate:.0%} hang past the 1s timeout")
+    seconds, failures = run(client.chat.completions.create)
+    print(f"bare client:  {args.calls - len(failures)}/{args.calls} succeeded in {seconds:.1f}s")
+
+    stats, breaker = llm_client.LatencyStats(), llm_client.CircuitBreaker(threshold=args.threshold, cooldown=1.0)
+    chat = llm_client.ResilientChat(client, policy, breaker, stats)
+    seconds, failures = run(chat.create)
+    print(f"retry layer:  {args.calls - len(failures)}/{args.calls} succeeded in {seconds:.1f}s "
+          f"({', '.join(sorted(set(failures))) or 'no errors'})")
+    print(stats.summary(breaker))
+    print(f"injected: {server.state.faults}")
+
+    # Full outage: the breaker opens, holds every worker, and lets traffic back once the provider recovers
+    server.state.error_rate = server.state.throttle_rate = server.state.hang_rate = 0.0
+    server.state.started = time.monotonic()
+    server.state.outage = (0.0, 2.0)
+    stats, breaker = llm_client.LatencyStats(), llm_client.CircuitBreaker(threshold=args.threshold, cooldown=1.0)
+    chat = llm_client.ResilientChat(client, policy, breaker, stats)
+    before = server.state.faults["outage"]
+    seconds, failures = run(chat.create)
+    print(f"\n2s outage:    {args.calls - len(failures)}/{args.calls} succeeded in {seconds:.1f}s, "
+          f"{server.state.faults['outage'] - before} requests hit the outage, "
+          f"breaker opened {breaker.trips} times")
+    server.shutdown()
+
+
+def bench_drafts(args):
+    """Defense-bot turns with and without speculative drafts, against a mock that repeats itself."""
+    server = mock_openai_server.serve(port=0, latency=args.latency, duplicate_rate=args.duplicate_rate, seed=1)
+    client = OpenAI(api_key="mock", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+    conversation.chat = llm_client.ResilientChat(client)
+    conversation.response_cache.mode = "off"
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "lessons.json"), encoding="utf-8") as f:
+        lesson = json.load(f)[0]
+
+    turn_seconds = []
+    original = conversation.ask_gpt_drafts
+
+    def timed_drafts(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return original(*a, **kw)
+        finally:
+            turn_seconds.append(time.perf_counter() - start)
+
+    conversation.ask_gpt_drafts = timed_drafts
+    print(f"mock latency {args.latency}s, {args.duplicate_rate:.0%} of replies repeat the persona's last one")
+    for drafts in (1, args.drafts):
+        conversation.DEFENSE_DRAFTS = drafts
+        turn_seconds.clear()
+        kept = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(args.conversations):
+                for mode, role in (("supportive", "SupportBot"), ("refutational", "RefutationalBot")):
+                    kept += conversation.RUNNERS[mode](lesson, seed=i).count(role)
+        seconds = time.perf_counter() - start
+        turn_seconds.sort()
+        dropped = len(turn_seconds) - kept
+        print(f"drafts={drafts}: {len(turn_seconds)} defense turns, {dropped} dropped as repeats, "
+              f"turn p50 {percentile(turn_seconds, 0.5):.3f}s p95 {percentile(turn_seconds, 0.95):.3f}s, "
+              f"{seconds:.1f}s total")
+    conversation.ask_gpt_drafts = original
+    server.shutdown()
+
+
+def bench_engine(args):
+    """Per-turn overhead of the conversation engine itself, with replies served instantly."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "lessons.json"), encoding="utf-8") as f:
+        lesson = json.load(f)[0]
+    replies = iter(range(10 ** 9))
+
+    def ask(request):
+        return f"Reply {next(replies)} to {request.role}."
+
+    for module in (conversation, conversation_no_participant):
+        for policy in (module.SUPPORTIVE, module.REFUTATIONAL, module.PREBUNKING):
+            turns = 0
+            start = time.perf_counter()
+            for seed in range(args.runs):
+                turns += len(engine.run(policy, lesson, ask, seed=seed))
+            seconds = time.perf_counter() - start
+            print(f"{module.__name__:<31} {policy.name:<13} {turns // args.runs:3d} turns/run  "
+                  f"{seconds / turns * 1e6:6.1f} us/turn")
+
+
+def legacy_prompts():
+    """The prompt builders as laid out before the prefix/suffix split: one system message with
+    the per-turn value in the middle."""
+    def misinfo_prompt(misinfo, strong_argument, all_misinfo):
+        return conversation.misinfo_prefix(strong_argument, all_misinfo).replace(
+            "based on the misconception given at the end", f"based on this misconception: {misinfo}")
+
+    def refutation_prompt(truth, refutation, last_misinfo=""):
+        return conversation.refutation_prefix(truth, refutation).replace(
+            "4. Debunk the last misinformation claim, quoted at the end.",
+            f'4. Below is the last misinformation claim to debunk:\n{" " * 36}"{last_misinfo}"')
+
+    def prebunk_prompt(truth, refutation, last_misinfo=""):
+        return conversation.prebunk_prefix(truth, refutation).replace(
+            "\n\n                Constraints:",
+            f'\n\n\n                Below is the last misinformation claim to debunk:\n                "{last_misinfo}"'
+            "\n                Constraints:")
+
+    def participant_prompt(final_turn=False):
+        return conversation.PARTICIPANT_PROMPT + (conversation.FINAL_TURN if final_turn else "")
+
+    return {"misinfo_prompt": misinfo_prompt, "refutation_prompt": refutation_prompt,
+            "prebunk_prompt": prebunk_prompt, "participant_prompt": participant_prompt}
+
+
+def bench_prompts(args):
+    """Prompt-cache reuse and call latency of both prompt layouts, against a mock that caches prefixes."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "lessons.json"), encoding="utf-8") as f:
+        lesson = json.load(f)[0]
+    conversation.response_cache.mode = "off"
+    call_seconds = []
+    original_fetch, original_usage = conversation.GptCall.fetch, conversation.token_usage
+
+    def timed_fetch(call):
+        start = time.perf_counter()
+        try:
+            return original_fetch(call)
+        finally:
+            call_seconds.append(time.perf_counter() - start)
+
+    conversation.GptCall.fetch = timed_fetch
+    # Mock tokens are words, about 3/4 of a real token count
+    providers = [
+        ("OpenAI-like (1024-token minimum, 128-token steps)", 96, 768),
+        ("vLLM-like (16-token blocks)", 12, 12),
+    ]
+    print(f"mock: {args.latency}s + {args.prefill}s per 1000 uncached prompt tokens, {args.reply_words}-word replies")
+    for provider, cache_block, cache_min in providers:
+        print(provider)
+        for label, patches in (("per-turn values mid-prompt", legacy_prompts()), ("static prefix + suffix", {})):
+            server = mock_openai_server.serve(
+                port=0, latency=args.latency, prefix_cache=True, cache_block=cache_block, cache_min=cache_min,
+                prefill=args.prefill, reply_words=args.reply_words, seed=1,
+            )
+            client = OpenAI(api_key="mock", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+            conversation.chat = llm_client.ResilientChat(client)
+            conversation.token_usage = usage = context.TokenUsage()
+            originals = {name: getattr(conversation, name) for name in patches}
+            for name, builder in patches.items():
+                setattr(conversation, name, builder)
+            call_seconds.clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for seed in range(args.conversations):
+                    for runner in conversation.RUNNERS.values():
+                        runner(lesson, seed=seed)
+            for name, builder in originals.items():
+                setattr(conversation, name, builder)
+            server.shutdown()
+            cached, prompt = usage.prompt_cache()
+            call_seconds.sort()
+            print(f"  {label:<28} {len(call_seconds)} calls, {cached / prompt:4.0%} of prompt tokens cached, "
+                  f"call p50 {percentile(call_seconds, 0.5) * 1000:.0f} ms "
+                  f"p95 {percentile(call_seconds, 0.95) * 1000:.0f} ms")
+    conversation.GptCall.fetch, conversation.token_usage = original_fetch, original_usage
+
+def legacy_conversation_entry():
+    """The original /conversation view: a Jinja render on every hit."""
+    if "prolific_pid" not in study_app.session:
+        return study_app.redirect(study_app.url_for("start_page"))
+    condition = study_app.session["condition"]
+    convo_index = study_app.session["conversation_index"]
+    vignette = study_app.vignettes.get(condition, convo_index, check_mtime=study_app.app.debug)
+    return study_app.render_template(
+        "conversation.html", history_json=vignette.history_json, mode=condition, step=1, total=1,
+        finished=False, participant_number=study_app.session.get("participant_number"),
+        prolific_pid=study_app.session.get("prolific_pid"),
+    )
+
+
+def bench_pages(args):
+    """Per-request CPU of /conversation: per-hit render vs. pre-rendered page vs. 304 revalidation."""
+    fresh_database("pages.db")
+    sessions = add_participants(args.participants)
+    clients = [client_for(sess) for sess in sessions]
+    etags = {}
+    for client in clients:
+        response = client.get("/conversation")
+        etags[id(client)] = response.headers["ETag"]
+    view = study_app.app.view_functions["conversation_entry"]
+
+    def measure(label, headers):
+        jobs = [clients[i % len(clients)] for i in range(args.requests)]
+        sizes = []
+
+        def worker(client):
+            response = client.get("/conversation", headers=headers(client))
+            sizes.append(len(response.data))
+            return response.status_code
+
+        cpu = time.process_time()
+        seconds = run_concurrent(worker, jobs, args.threads)
+        cpu = time.process_time() - cpu
+        print(f"{label:<28} {cpu / args.requests * 1e6:7.0f} us CPU/request  "
+              f"{args.requests / seconds:7.0f} req/s  {sum(sizes) // len(sizes):6d} bytes/response")
+
+    study_app.app.view_functions["conversation_entry"] = legacy_conversation_entry
+    try:
+        measure("render per request", lambda client: {})
+    finally:
+        study_app.app.view_functions["conversation_entry"] = view
+    measure("pre-rendered", lambda client: {})
+    measure("revalidated (304)", lambda client: {"If-None-Match": etags[id(client)]})
+
+
+ASSET_URL = re.compile(r"""(/(?:static|assets)/[^"' )]+)""")
+BROWSER_HEADERS = {"Accept": "image/avif,image/webp,*/*", "Accept-Encoding": "br, gzip"}
+
+
+def page_asset_bytes(client, path):
+    """{asset URL: bytes sent to a current browser} for the local assets a page loads."""
+    html = re.sub(r"<!--.*?-->", "", client.get(path).get_data(as_text=True), flags=re.S)
+    sent = {}
+    for url in set(ASSET_URL.findall(html)):
+        response = client.get(url, headers=BROWSER_HEADERS)
+        if response.status_code == 200:  # skips fallbacks that are never requested (bot.png)
+            sent[url] = len(response.data)
+    return sent
+
+
+def bench_assets(args):
+    """Bytes of local assets per page, sources vs. the fingerprinted build."""
+    built = study_app.static_assets
+    if not built.entries:
+        print("No build found; run `python assets.py build` first")
+        return
+    client = study_app.app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(prolific_pid="BENCH_ASSETS", participant_id=1, participant_number=1, conversation_index=1)
+    pages = ["/pre-survey"] + [f"/conversation/{c}/1" for c in study_app.CONDITIONS] + ["/post-survey", "/debrief"]
+
+    results = {}
+    for label, manifest in (("sources", assets.AssetManifest(os.path.join(_TMP_DIR, "no_manifest.json"))), ("built", built)):
+        study_app.static_assets = manifest
+        study_app.conversation_pages = study_app.PageCache(study_app.vignettes)
+        results[label] = {page: page_asset_bytes(client, page) for page in pages}
+    study_app.static_assets = built
+    study_app.conversation_pages = study_app.PageCache(study_app.vignettes)
+
+    total_before = total_after = 0
+    for page in pages:
+        before, after = sum(results["sources"][page].values()), sum(results["built"][page].values())
+        total_before, total_after = total_before + before, total_after + after
+        saved = 1 - after / before if before else 0
+        print(f"{page:<28} {len(results['built'][page]):2d} assets  {before:8d} -> {after:7d} bytes  ({saved:.0%} saved)")
+    print(f"{'all pages':<28}            {total_before:8d} -> {total_after:7d} bytes  "
+          f"({total_before - total_after} saved)")
+
+
+def bench_sessions(args):
+    """Cookie vs. server-side sessions: /api/event pings and the cookie each request carries."""
+    flask_app = study_app.app
+    cookie_interface = flask_app.session_interface
+    backends = [
+        ("signed cookie", SecureCookieSessionInterface()),
+        ("server, LRU", study_app.ServerSessionInterface(study_app.SessionStore())),
+        ("server, no LRU", study_app.ServerSessionInterface(study_app.SessionStore(size=0))),
+    ]
+    payload = {"event": "page_conversation", "duration_ms": 1234}
+    for n, (label, interface) in enumerate(backends):
+        fresh_database(f"sessions_{n}.db")
+        study_app.db_pool.close_all()
+        study_app.db_pool = study_app.ConnectionPool(study_app.DB_PATH)
+        flask_app.session_interface = interface
+        clients = [client_for(sess) for sess in add_participants(args.participants)]
+        cookie = len(clients[0].get_cookie(flask_app.config["SESSION_COOKIE_NAME"]).value)
+        jobs = [clients[i % len(clients)] for i in range(args.requests)]
+        set_cookies = []
+
+        def worker(client):
+            response = client.post("/api/event", json=payload)
+            set_cookies.append("Set-Cookie" in response.headers)
+            return response.status_code
+
+        cpu = time.process_time()
+        seconds = run_concurrent(worker, jobs, args.threads)
+        cpu = time.process_time() - cpu
+        study_app.event_queue.flush()
+        print(f"{label:<16} cookie {cookie:3d} bytes  {cpu / args.requests * 1e6:5.0f} us CPU/request  "
+              f"{args.requests / seconds:6.0f} req/s  Set-Cookie on {sum(set_cookies)} responses")
+    flask_app.session_interface = cookie_interface
+
+
+def private_kb(pid):
+    """Memory a process does not share with its parent (Private_* of smaps_rollup), in kB."""
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        return sum(int(line.split()[1]) for line in f if line.startswith("Private_"))
+
+
+@contextlib.contextmanager
+def gunicorn_server(workers, name, timeout=60, **env):
+    """Run gunicorn.conf.py on a free port with a scratch database until every worker is ready.
+
+    Yields (port, log lines, seconds until all workers were ready).
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               DB_PATH=os.path.join(_TMP_DIR, f"{name}.db"), **env)
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}"],
+                              cwd=here, env=env, stderr=subprocess.PIPE, text=True)
+    log = []
+    threading.Thread(target=lambda: log.extend(server.stderr), daemon=True).start()
+    try:
+        while sum("after fork" in line for line in list(log)) < workers:
+            if server.poll() is not None or time.perf_counter() - start > timeout:
+                raise RuntimeError("gunicorn did not start:\n" + "".join(log))
+            time.sleep(0.01)
+        yield port, log, time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def boot_gunicorn(preload, workers, timeout=60):
+    """Start gunicorn, wait for every worker and its first request; return (log, ready seconds, memory)."""
+    with gunicorn_server(workers, f"boot_{preload}", timeout, GUNICORN_PRELOAD=preload) as (port, log, all_ready):
+        pids = [int(re.search(r"Worker (\d+) ready", line).group(1)) for line in list(log) if "after fork" in line]
+        # Sync workers take one request at a time, so concurrent requests reach all of them
+        with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+            start = time.perf_counter()
+            while sum("first request" in line for line in list(log)) < workers:
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError("not every worker got a request:\n" + "".join(log))
+                urls = [f"http://127.0.0.1:{port}/conversation/control/{i % 3 + 1}" for i in range(workers * 2)]
+                list(pool.map(lambda url: urllib.request.urlopen(url).read(), urls))
+        memory = [private_kb(pid) for pid in pids]
+    return list(log), all_ready, memory
+
+
+def bench_boot(args):
+    """Worker boot, first request and per-worker private memory, with and without preload_app."""
+    for preload, label in (("0", "each worker builds the app"), ("1", "preload_app (master builds)")):
+        log, all_ready, memory = boot_gunicorn(preload, args.workers)
+        ready = [float(m.group(1)) for m in (re.search(r"ready (\d+) ms after fork", line) for line in log) if m]
+        first = [float(m.group(1)) for m in (re.search(r"first request \S+ took ([\d.]+) ms", line) for line in log) if m]
+        print(f"{label:<28} all {args.workers} workers up in {all_ready * 1000:5.0f} ms  "
+              f"worker boot {sum(ready) / len(ready):5.0f} ms  first request {sum(first) / len(first):5.1f} ms  "
+              f"private memory {sum(memory) // len(memory):6d} kB/worker")
+        for line in log:
+            if "App preloaded" in line or "Schema ready" in line:
+                print("  " + line.split("[INFO] ")[-1].strip())
+
+
+async def http_request(port, method, path, cookies, body=None, slow=0.0):
+    """One HTTP/1.1 request on a fresh connection; returns the status and updates cookies.
+
+    With slow, the body is sent in ten pieces spread over that many seconds,
+    like a participant on a poor mobile connection.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        head = [f"{method} {path} HTTP/1.1", f"Host: 127.0.0.1:{port}", "Connection: close"]
+        if cookies:
+            head.append("Cookie: " + "; ".join(f"{name}={value}" for name, value in cookies.items()))
+        if body is not None:
+            head += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if body and slow:
+            step = -(-len(body) // 10)
+            for i in range(0, len(body), step):
+                writer.write(body[i:i + step])
+                await writer.drain()
+                await asyncio.sleep(slow / 10)
+        elif body:
+            writer.write(body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    lines = response.partition(b"\r\n\r\n")[0].decode("latin-1").split("\r\n")
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.lower() == "set-cookie":
+            cookie, _, cookie_value = value.split(";", 1)[0].strip().partition("=")
+            cookies[cookie] = cookie_value
+    return int(lines[0].split()[1])
+
+
+def participant_flow(n):
+    """(step, method, path, JSON body) for one participant's walk through the study."""
+    pre, post = survey_payload("preSurvey"), survey_payload("postSurvey")
+    return [
+        ("consent page", "GET", f"/?PROLIFIC_PID=LOAD_{n}", None),
+        ("consent", "POST", "/consent", {}),
+        ("assign", "GET", "/assign", None),
+        ("pre-survey page", "GET", "/pre-survey", None),
+        ("pre-survey submit", "POST", "/api/survey/pre", pre),
+        ("conversation", "GET", "/conversation", None),
+        ("event", "POST", "/api/event", {"event": "page_conversation", "duration_ms": 61000}),
+        ("post-survey page", "GET", "/post-survey", None),
+        ("post-survey submit", "POST", "/api/survey/post", post),
+        ("debrief", "GET", "/debrief", None),
+        ("finish", "GET", "/finish", None),
+    ]
+
+
+async def walk_participant(n, port, args, results):
+    """Walk one participant through the flow; a failed step ends their session."""
+    rng = random.Random(n)
+    slow = args.slow_seconds if rng.random() < args.slow else 0.0
+    cookies = {}
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    for step, method, path, payload in participant_flow(n):
+        body = json.dumps(payload).encode() if payload is not None else None
+        start = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(http_request(port, method, path, cookies, body, slow), args.timeout)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = None
+        results.append((step, time.perf_counter() - start, status))
+        if status is None or status >= 400:
+            return
+        await asyncio.sleep(rng.uniform(0, args.think))
+
+
+def load_report(results, seconds):
+    steps = [step for step, *_ in participant_flow(0)]
+    print(f"  {'step':<20} {'requests':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for step in steps + [None]:
+        rows = [r for r in results if step is None or r[0] == step]
+        latencies = sorted(latency for _, latency, _ in rows)
+        errors = sum(1 for *_, status in rows if status is None or status >= 400)
+        print(f"  {step or 'all':<20} {len(rows):8d} {percentile(latencies, 0.5) * 1000:8.0f} "
+              f"{percentile(latencies, 0.95) * 1000:8.0f} {errors / len(rows):7.1%}")
+    print(f"  {len(results)} requests in {seconds:.1f} s ({len(results) / seconds:.0f} req/s)")
+
+
+def bench_load(args):
+    """Concurrent participants walking consent -> surveys -> conversation -> finish against gunicorn."""
+    for mode in args.modes:
+        with gunicorn_server(args.workers, f"load_{mode}", SERVER_MODE=mode) as (port, _, _):
+            results = []
+
+            async def crowd():
+                await asyncio.gather(*(walk_participant(n, port, args, results) for n in range(args.participants)))
+
+            start = time.perf_counter()
+            asyncio.run(crowd())
+            seconds = time.perf_counter() - start
+        slow = f", {args.slow:.0%} of them on slow uploads ({args.slow_seconds:g} s)" if args.slow else ""
+        print(f"{mode}: {args.participants} participants on {args.workers} workers{slow}")
+        load_report(results, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    db = sub.add_parser("db", help="connection pool vs. connect-per-request")
+    db.add_argument("--threads", type=int, default=16)
+    db.add_argument("--requests", type=int, default=2000)
+    db.set_defaults(func=bench_db)
+
+    assign = sub.add_parser("assign", help="concurrent /assign calls keep conditions balanced")
+    assign.add_argument("--threads", type=int, default=64)
+    assign.add_argument("--participants", type=int, default=500)
+    assign.set_defaults(func=bench_assign)
+
+    survey = sub.add_parser("survey", help="per-submit latency of survey response storage")
+    survey.add_argument("--submits", type=int, default=500)
+    survey.set_defaults(func=bench_survey)
+
+    plans = sub.add_parser("plans", help="check query plans of the hot queries for full scans")
+    plans.add_argument("--participants", type=int, default=200)
+    plans.set_defaults(func=bench_plans)
+
+    acts = sub.add_parser("acts", help="dialogue-act classification over the saved json/ corpus")
+    acts.add_argument("--rounds", type=int, default=200)
+    acts.add_argument("--examples", type=int, default=10)
+    acts.set_defaults(func=bench_acts)
+
+    retry = sub.add_parser("retry", help="retry layer against the fault-injecting mock server")
+    retry.add_argument("--calls", type=int, default=300)
+    retry.add_argument("--threads", type=int, default=16)
+    retry.add_argument("--error-rate", type=float, default=0.1)
+    retry.add_argument("--throttle-rate", type=float, default=0.1)
+    retry.add_argument("--hang-rate", type=float, default=0.02)
+    retry.add_argument("--threshold", type=int, default=5, help="circuit breaker threshold")
+    retry.set_defaults(func=bench_retry)
+
+    drafts = sub.add_parser("drafts", help="speculative defense-bot drafts against a repeating mock")
+    drafts.add_argument("--conversations", type=int, default=6, help="supportive + refutational runs each")
+    drafts.add_argument("--drafts", type=int, default=3)
+    drafts.add_argument("--latency", type=float, default=0.05)
+    drafts.add_argument("--duplicate-rate", type=float, default=0.3)
+    drafts.set_defaults(func=bench_drafts)
+
+    engine_bench = sub.add_parser("engine", help="per-turn scheduling overhead of the conversation engine")
+    engine_bench.add_argument("--runs", type=int, default=500)
+    engine_bench.set_defaults(func=bench_engine)
+
+    prompts = sub.add_parser("prompts", help="prompt-prefix cache reuse against a mock that caches prefixes")
+    prompts.add_argument("--conversations", type=int, default=4, help="runs of each conversation.py mode")
+    prompts.add_argument("--latency", type=float, default=0.05)
+    prompts.add_argument("--prefill", type=float, default=0.2, help="seconds per 1000 uncached prompt tokens")
+    prompts.add_argument("--reply-words", type=int, default=45, help="length of the mock's replies")
+    prompts.set_defaults(func=bench_prompts)
+
+    pages = sub.add_parser("pages", help="per-request CPU of the conversation page, rendered vs. cached")
+    pages.add_argument("--requests", type=int, default=2000)
+    pages.add_argument("--threads", type=int, default=8)
+    pages.add_argument("--participants", type=int, default=30)
+    pages.set_defaults(func=bench_pages)
+
+    assets_bench = sub.add_parser("assets", help="bytes of local assets per page, sources vs. the build")
+    assets_bench.set_defaults(func=bench_assets)
+
+    sessions = sub.add_parser("sessions", help="/api/event pings with cookie vs. server-side sessions")
+    sessions.add_argument("--requests", type=int, default=4000)
+    sessions.add_argument("--threads", type=int, default=8)
+    sessions.add_argument("--participants", type=int, default=200)
+    sessions.set_defaults(func=bench_sessions)
+
+    boot = sub.add_parser("boot", help="gunicorn worker boot and first request, with and without preload")
+    boot.add_argument("--workers", type=int, default=4)
+    boot.set_defaults(func=bench_boot)
+
+    load = sub.add_parser("load", help="concurrent participants walking the whole study, sync vs. ASGI workers")
+    load.add_argument("--participants", type=int, default=500)
+    load.add_argument("--modes", nargs="+", choices=["wsgi", "asgi"], default=["wsgi", "asgi"])
+    load.add_argument("--workers", type=int, default=2, help="gunicorn workers (the Dockerfile default)")
+    load.add_argument("--ramp", type=float, default=5.0, help="seconds over which participants arrive")
+    load.add_argument("--think", type=float, default=1.0, help="max seconds between a participant's requests")
+    load.add_argument("--slow", type=float, default=0.05, help="share of participants with slow uploads")
+    load.add_argument("--slow-seconds", type=float, default=3.0, help="how long a slow upload takes")
+    load.add_argument("--timeout", type=float, default=30.0, help="seconds before a request counts as failed")
+    load.set_defaults(func=bench_load)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Write-ahead checkpoints for the conversation runners.
+
+A runner's only inputs besides the lesson are its ask_gpt replies and its
+speaker tie-break RNG. Every reply is appended to a JSONL checkpoint (and
+fsynced) as soon as it arrives, together with a snapshot of the runner's
+state at that call (misinfo_index, spoken_cache, exposure_state, ...), and
+the RNG state is stored up front.
+
+To resume, run the same runner again under the same checkpoint: the RNG is
+restored, ask_gpt is answered from the log in order until it runs out, and
+from there the conversation continues with live calls. Each replayed call
+must match the logged request and state; if the code or the lesson changed
+in between, CheckpointMismatch is raised instead of silently producing a
+different conversation.
+
+    {"type": "start", "meta": {...}}
+    {"type": "rng", "state": [...]}
+    {"type": "reply", "key": "<request hash>", "text": "...", "state": {...}}
+
+When replies are streamed, their text deltas are appended as they arrive
+({"type": "delta", ...}, flushed but not fsynced) so a running checkpoint
+can be followed with tail -f. Only complete replies are replayed; deltas
+are ignored when the checkpoint is loaded.
+"""
+
+import json
+import os
+import random
+from contextvars import ContextVar
+
+current_checkpoint = ContextVar("current_checkpoint", default=None)
+
+
+class CheckpointMismatch(RuntimeError):
+    """The resumed run asked for something other than what was logged."""
+
+
+def read_meta(path):
+    """The meta dict a checkpoint file was started with."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.loads(f.readline())["meta"]
+
+
+def _normalize(value):
+    return json.loads(json.dumps(value))
+
+
+class Checkpoint:
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.meta = meta or {}
+        self.snapshot = dict
+        self._rng_state = None
+        self._replies = []
+        self._replayed = 0
+        self._token = None
+        started = os.path.exists(path) and self._load()
+        self.logged = len(self._replies)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        if not started:
+            self._write({"type": "start", "meta": self.meta})
+
+    def _load(self):
+        """Read the log and cut a torn tail; return whether any record survived."""
+        with open(self.path, "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+        valid = 0  # bytes up to the end of the last complete record
+        for i, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if i == len(lines) - 1:
+                    break  # torn final write from a crash
+                raise
+            valid += len(line)
+            if record["type"] == "start":
+                self.meta = record["meta"]
+            elif record["type"] == "rng":
+                self._rng_state = record["state"]
+            elif record["type"] == "reply":
+                self._replies.append(record)
+        # Cut only a torn tail, in place, so new records start on a fresh line;
+        # the complete records before it are never rewritten
+        with open(self.path, "r+b") as f:
+            f.truncate(valid)
+            if valid and not lines[-1].endswith(b"\n") and valid == sum(map(len, lines)):
+                f.seek(valid)
+                f.write(b"\n")  # last record is complete but lost its newline
+            os.fsync(f.fileno())
+        return valid > 0
+
+    @property
+    def resumed(self):
+        """True while logged replies remain to be replayed."""
+        return self._replayed < len(self._replies)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def rng(self, seed=None):
+        rng = random.Random(seed)
+        if self._rng_state is not None:
+            version, internal, gauss = self._rng_state
+            rng.setstate((version, tuple(internal), gauss))
+        else:
+            self._rng_state = _normalize(rng.getstate())
+            self._write({"type": "rng", "state": self._rng_state})
+        return rng
+
+    def replay(self, key):
+        """The logged reply for the next call, or None once the log is exhausted."""
+        if not self.resumed:
+            return None
+        record = self._replies[self._replayed]
+        state = _normalize(self.snapshot())
+        where = f"{self.path}: call {self._replayed + 1}"
+        if record["key"] != key:
+            raise CheckpointMismatch(f"{where} sends a different request than the checkpointed one")
+        if record["state"] != state:
+            raise CheckpointMismatch(f"{where} runner state is {state}, checkpoint has {record['state']}")
+        self._replayed += 1
+        return record["text"]
+
+    def delta(self, key, text):
+        self._file.write(json.dumps({"type": "delta", "key": key, "text": text}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def record(self, key, text):
+        record = {"type": "reply", "key": key, "text": text, "state": _normalize(self.snapshot())}
+        self._replies.append(record)
+        self._replayed += 1
+        self._write(record)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def discard(self):
+        """Delete the checkpoint once the finished conversation is saved."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        self._token = current_checkpoint.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        current_checkpoint.reset(self._token)
+        self.close()
+
+
+def runner_rng(seed=None):
+    """The runner's tie-break RNG; restored from the checkpoint when resuming."""
+    checkpoint = current_checkpoint.get()
+    return checkpoint.rng(seed) if checkpoint else random.Random(seed)
+
+
+def track_state(snapshot):
+    """Register a callable returning the runner's state, logged with each reply."""
+    checkpoint = current_checkpoint.get()
+    if checkpoint is not None:
+        checkpoint.snapshot = snapshot
+
+
+def checkpointed(key, produce):
+    """produce() the reply for request key, unless the checkpoint already has it."""
+    checkpoint = current_checkpoint.get()
+    if checkpoint is None:
+        return produce()
+    reply = checkpoint.replay(key)
+    if reply is None:
+        reply = produce()
+        checkpoint.record(key, reply)
+    return reply
+
+
+def log_delta(key, text):
+    """Append a streamed text delta to the current checkpoint, if any."""
+    checkpoint = current_checkpoint.get()
+    if checkpoint is not None:
+        checkpoint.delta(key, text)
+
+
+async def acheckpointed(key, produce):
+    """Async variant of checkpointed(); produce is a coroutine function."""
+    checkpoint = current_checkpoint.get()
+    if checkpoint is None:
+        return await produce()
+    reply = checkpoint.replay(key)
+    if reply is None:
+        reply = await produce()
+        checkpoint.record(key, reply)
+    return reply
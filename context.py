@@ -0,0 +1,186 @@
+"""
+Token-budgeted context for ask_gpt, plus per-call token accounting.
+
+build_messages() keeps the system prompt and packs the most recent turns,
+newest first, until CONTEXT_TOKEN_BUDGET prompt tokens are used (the caller's
+turn cap still applies), so one long turn no longer drags a whole window of
+history along with it.
+
+Tokens are counted with tiktoken when it is installed. Otherwise they are
+estimated at CONTEXT_CHARS_PER_TOKEN characters per token. The estimate is
+deliberately fixed during a run (the packed context, and so the response
+cache key, must not depend on earlier replies); the usage summary reports
+the ratio the API actually counted so it can be recalibrated.
+
+token_usage records prompt/completion tokens for every ask_gpt call,
+grouped by usage_label (set per vignette by the generators) and speaker,
+and how many prompt tokens the provider served from its prompt cache.
+"""
+
+import os
+import re
+import threading
+from collections import defaultdict
+from contextvars import ContextVar
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to the calibrated estimate
+    tiktoken = None
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2500))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", 4.0))
+
+# Chat format framing: each message costs a few tokens on top of its content,
+# and the reply is primed with a few more.
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+SPEAKERS = ("MisInfoBot", "SupportBot", "RefutationalBot", "PrebunkingBot")
+
+
+class TokenCounter:
+    def __init__(self, model="gpt-4o-mini", chars_per_token=CONTEXT_CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    self.encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    self.encoding = tiktoken.get_encoding("o200k_base")
+            except Exception:  # encoding files not cached and no network
+                self.encoding = None
+
+    @property
+    def exact(self):
+        return self.encoding is not None
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return max(1, round(len(text) / self.chars_per_token))
+
+    def count_message(self, message):
+        return MESSAGE_OVERHEAD + self.count(message["content"]) + (1 if "name" in message else 0)
+
+    def count_messages(self, messages):
+        return REPLY_OVERHEAD + sum(self.count_message(m) for m in messages)
+
+
+token_counter = TokenCounter()
+
+
+def build_messages(system, turns, budget=CONTEXT_TOKEN_BUDGET, max_turns=None, counter=token_counter,
+                   suffix=None):
+    """System prompt plus the newest turns that fit in budget prompt tokens.
+
+    turns are chat messages or turns.Turn records, oldest first; a Turn's
+    token count is cached on it, so only new turns are tokenized (with the
+    module's token_counter). The latest turn is always kept
+    so the bot has something to answer, even if the system prompt alone
+    is over budget. suffix, if given, is a second system message after the
+    turns, for per-call instructions that would otherwise break the prefix
+    that consecutive calls share.
+    """
+    messages = [{"role": "system", "content": system}]
+    tail = [{"role": "system", "content": suffix}] if suffix else []
+    used = counter.count_messages(messages + tail)
+    window = turns[-max_turns:] if max_turns else turns
+    picked = []
+    for turn in reversed(window):
+        if isinstance(turn, dict):
+            message, cost = turn, counter.count_message(turn)
+        else:
+            message, cost = turn.message(), turn.message_tokens()
+        if picked and used + cost > budget:
+            break
+        picked.append(message)
+        used += cost
+    messages.extend(reversed(picked))
+    messages.extend(tail)
+    return messages
+
+
+def speaker_of(system):
+    """Which bot a system prompt belongs to ("Participant" for the rest)."""
+    match = re.search(r"You are (\w+)", system)
+    return match.group(1) if match and match.group(1) in SPEAKERS else "Participant"
+
+
+# ---------------------------------------------------------------------------
+# Per-call token accounting
+# ---------------------------------------------------------------------------
+
+usage_label = ContextVar("usage_label", default="")
+
+
+class TokenUsage:
+    """Prompt/completion tokens of every call, totalled per label and speaker.
+
+    Counts come from the API's usage block on real calls and from the
+    local counter on cache hits (what the call would have cost).
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.api_chars = 0
+        self.api_content_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, messages, reply, usage=None, counter=token_counter):
+        cached = 0
+        if usage is not None:
+            prompt, completion, source = usage.prompt_tokens, usage.completion_tokens, "api"
+            cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+            with self._lock:
+                self.api_chars += sum(len(m["content"]) for m in messages)
+                self.api_content_tokens += prompt - REPLY_OVERHEAD - MESSAGE_OVERHEAD * len(messages)
+        else:
+            prompt, completion, source = counter.count_messages(messages), counter.count(reply), "local"
+        call = (usage_label.get(), speaker_of(messages[0]["content"]), prompt, completion, source, cached)
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    def totals(self):
+        """{(label, speaker): [calls, prompt_tokens, completion_tokens]}"""
+        totals = defaultdict(lambda: [0, 0, 0])
+        for label, speaker, prompt, completion, *_ in self.calls:
+            entry = totals[(label, speaker)]
+            entry[0] += 1
+            entry[1] += prompt
+            entry[2] += completion
+        return dict(totals)
+
+    def for_label(self, label):
+        """(calls, prompt_tokens, completion_tokens) recorded under label."""
+        calls = [c for c in self.calls if c[0] == label]
+        return len(calls), sum(c[2] for c in calls), sum(c[3] for c in calls)
+
+    def prompt_cache(self):
+        """(cached, total) prompt tokens of the calls that went to the API."""
+        api = [c for c in self.calls if c[4] == "api"]
+        return sum(c[5] for c in api), sum(c[2] for c in api)
+
+    def summary(self):
+        lines = [f"Token usage ({'tiktoken' if token_counter.exact else 'estimated'} counts, "
+                 f"budget {CONTEXT_TOKEN_BUDGET} prompt tokens):"]
+        for (label, speaker), (calls, prompt, completion) in sorted(self.totals().items()):
+            name = f"{label} {speaker}" if label else speaker
+            lines.append(f"  {name:<28} {calls:3d} calls  {prompt:7d} prompt  {completion:6d} completion  "
+                         f"({prompt // calls} / {completion // calls} per call)")
+        prompt = sum(c[2] for c in self.calls)
+        completion = sum(c[3] for c in self.calls)
+        lines.append(f"  {'total':<28} {len(self.calls):3d} calls  {prompt:7d} prompt  {completion:6d} completion")
+        cached, api_prompt = self.prompt_cache()
+        if cached:
+            lines.append(f"  provider prompt cache served {cached} of {api_prompt} API prompt tokens "
+                         f"({cached / api_prompt:.0%})")
+        if not token_counter.exact and self.api_content_tokens > 0:
+            lines.append(f"  API counted {self.api_chars / self.api_content_tokens:.2f} chars/token "
+                         f"(estimate uses CONTEXT_CHARS_PER_TOKEN={token_counter.chars_per_token:g})")
+        return "\n".join(lines)
+
+
+token_usage = TokenUsage()
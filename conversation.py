@@ -1,67 +1,194 @@
+import argparse
+import contextvars
 import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
 from openai import OpenAI
 import re
-import random
-
-client = OpenAI(api_key="")# Helper function to extract dialogue act
-
-def get_dialogue_act(role, text):
-    ltext = text.lower()
-    if role == "MisInfoBot":
-        return "Claim"
-    elif role == "SupportBot":
-        if any(word in ltext for word in ["not", "incorrect", "false", "important", "in fact", "research shows", "evidence", "in reality", "actually"]):
-            return "Correction"
-        return "Info"
-    elif role == "PrebunkingBot":
-        if "tactic" in ltext or any(x in ltext for x in ["misinformation", "manipulation", "out of context", "debunk"]):
-            if "doesn't contain misinformation" in ltext or "no misinformation" in ltext:
-                return "NoAction"
-            return "Debunk"
-        return "NoAction"
-    elif role == "RefutationalBot":
-        # Simple heuristic for refutation
-        if any(phrase in ltext for phrase in ["false claim", "debunk", "disprove", "incorrect", "not true", "refute"]):
-            return "Refutation"
-        return "NoAction"
-    elif role == "Participant":
-        if any(q in ltext for q in ["?", "could", "would", "do you think"]):
-            return "Reflection-Question"
-        return "Reflection"
-    return "Other"
-
-def ask_gpt(system, history=None, max_tokens=800):
+
+from checkpoint import Checkpoint, checkpointed, current_checkpoint, read_meta
+from context import build_messages, token_usage, usage_label
+from dialogue_acts import get_dialogue_act
+from engine import SKIP, STOP, Policy, Rule, claims_used, is_ending, next_claim, run, think_args
+from llm_cache import cache_key, response_cache
+from llm_client import ResilientChat, breaker, echo, latency_stats
+from turns import Role
+
+# OPENAI_API_KEY / OPENAI_BASE_URL are read from the environment
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY") or "unset")
+chat = ResilientChat(client)  # retries, deadlines and the circuit breaker (llm_client.py)
+MODEL = "gpt-4o-mini"
+# Each generator checkpoints into its own subdirectory of .checkpoints/
+CHECKPOINT_DIR = os.path.join(".checkpoints", "conversation")
+
+# Candidate replies drafted at once for each defense-bot turn (--drafts); 1 = off
+DEFENSE_DRAFTS = int(os.getenv("DEFENSE_DRAFTS", 1))
+draft_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="draft")
+
+
+class WorkerRateLimit:
+    """Spaces each worker thread's API calls at least 1/rate seconds apart.
+
+    A call takes the slot of the worker that created it (slot()), so drafts
+    that run on draft_pool threads count against their worker's cap.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._local = threading.local()
+
+    def slot(self):
+        """The calling worker's slot: [lock, time of its last call]."""
+        slot = getattr(self._local, "slot", None)
+        if slot is None:
+            slot = self._local.slot = [threading.Lock(), 0.0]
+        return slot
+
+    def wait(self, slot=None):
+        if not self.rate:
+            return
+        slot = slot or self.slot()
+        with slot[0]:  # drafts of one worker queue up behind each other
+            delay = slot[1] + 1.0 / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            slot[1] = time.monotonic()
+
+
+worker_rate_limit = WorkerRateLimit()
+
+
+def show_turn(role, text):
+    """Print a produced turn (abbreviated and labelled in batch runs)."""
+    if echo.shown(text):
+        return  # already streamed to the console
+    label = usage_label.get()
+    if label:
+        print(f"  [{label}] {role}: {text[:80]}...")
+    else:
+        print(f"\n{role}:\n{text}")
+
+
+class GptCall:
+    """One chat request: its cache key, and its reply from the cache or the API.
+
+    draft > 0 asks for an alternative reply to the same messages (another
+    seed and cache entry); see ask_gpt_drafts.
+    """
+
+    def __init__(self, system, history=None, max_tokens=800, seed=None, draft=0):
+        prefix, suffix = (system, None) if isinstance(system, str) else system
+        self.messages = build_messages(prefix, history[-8:] if history else [], suffix=suffix)
+        self.max_tokens = max_tokens
+        self.seed = seed if draft == 0 or seed is None else seed * 1000 + draft
+        self.draft = draft
+        self.key = cache_key(MODEL, self.messages, 0.7, max_tokens, self.seed, draft)
+        self.usage = None
+        self.rate_slot = worker_rate_limit.slot()  # the creating worker's, also for drafts
+
+    def fetch(self):
+        worker_rate_limit.wait(self.rate_slot)
+        text, self.usage = chat.reply(
+            self.key,
+            quiet=self.draft > 0,
+            model=MODEL,
+            messages=self.messages,
+            temperature=0.7,
+            max_tokens=self.max_tokens,
+            **({"seed": self.seed} if self.seed is not None else {}),
+        )
+        return text
+
+    def complete(self):
+        return response_cache.complete(self.key, self.fetch)
+
+    def record(self, reply):
+        token_usage.record(self.messages, reply, self.usage)
+
+
+def ask_gpt(system, history=None, max_tokens=800, seed=None):
     """
     Ask the GPT model:
-    - system: full persona/instructions for the current bot
-    - history: list of previous conversation turns
+    - system: full persona/instructions for the current bot (a string, or a
+      Prompt whose suffix is sent after the turns)
+    - history: previous Turns (a History or a list of Turns)
+    The newest turns (at most 8) that fit the context token budget are sent.
+    Replies are served from the persistent response cache when possible.
     """
-    messages = [{"role": "system", "content": system}]
-    if history:
-        for turn in history[-8:]:
-            role, content = turn.split(":", 1)
-            role = role.strip()
-            content = content.strip()
-
-            # Map each bot explicitly
-            if role == "Participant":
-                messages.append({"role": "user", "content": content})
-            elif role == "MisInfoBot":
-                messages.append({"role": "assistant", "name": "MisInfoBot", "content": content})
-            elif role == "PrebunkingBot":
-                messages.append({"role": "assistant", "name": "PrebunkingBot", "content": content})
-            elif role == "SupportBot":
-                messages.append({"role": "assistant", "name": "SupportBot", "content": content})
-            elif role == "RefutationalBot":
-                messages.append({"role": "assistant", "name": "RefutationalBot", "content": content})
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini", 
-        messages=messages,
-        temperature=0.7,
-        max_tokens=max_tokens,
-    )
-    return response.choices[0].message.content.strip()
+    call = GptCall(system, history, max_tokens, seed)
+    reply = checkpointed(call.key, call.complete)
+    call.record(reply)
+    return reply
+
+
+# === SPECULATIVE DRAFTS FOR DEFENSE BOTS ===
+def defense_check(role, spoken_cache, act=None):
+    """Score a draft: 2 = new and of the wanted dialogue act, 1 = new, 0 = already said."""
+    def score(text):
+        if text.strip().lower() in spoken_cache:
+            return 0
+        return 2 if act is None or get_dialogue_act(role, text) == act else 1
+    return score
+
+
+def _run_draft(call):
+    current_checkpoint.set(None)  # the turn is checkpointed as a whole, not per draft
+    reply = call.complete()
+    call.record(reply)
+    return reply
+
+
+def pick_draft(futures, score):
+    """The first draft, in draft order, with the best score.
+
+    Returns as soon as a draft scores 2 and every earlier draft is done, so
+    the choice depends only on the replies and never on which came back
+    first (replay and resume stay exact). Failed drafts are skipped; if
+    all fail the first error is raised.
+    """
+    best, best_score, error = None, -1, None
+    for future in futures:
+        try:
+            text = future.result()
+        except Exception as e:
+            error = error or e
+            continue
+        text_score = score(text)
+        if text_score == 2:
+            return text
+        if text_score > best_score:
+            best, best_score = text, text_score
+    if best is None:
+        raise error
+    return best
+
+
+def ask_gpt_drafts(system, history, score, max_tokens=800, seed=None, drafts=None):
+    """Like ask_gpt, but drafts candidate replies concurrently and keeps the best (see pick_draft).
+
+    Drafts that have not started when the pick is made are cancelled; ones
+    already in flight finish in the background and are only cached.
+    """
+    drafts = drafts or DEFENSE_DRAFTS
+    if drafts <= 1:
+        return ask_gpt(system, history, max_tokens, seed)
+    calls = [GptCall(system, history, max_tokens, seed, draft=i) for i in range(drafts)]
+
+    def produce():
+        futures = [draft_pool.submit(contextvars.copy_context().run, _run_draft, call) for call in calls]
+        try:
+            return pick_draft(futures, score)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return checkpointed(f"{calls[0].key}/drafts={drafts}", produce)
 
 # === THINK FUNCTIONS FOR SUPPORTIVE MODE ===
 def participant_think(history):
@@ -71,8 +198,7 @@ def participant_think(history):
     """
     if not history:
         return ("speak", 5)  # start conversation
-    last_role, last_msg = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if last_role == "SupportBot":
         return ("speak", 7)  # respond warmly to support
     elif last_role == "MisInfoBot":
@@ -85,8 +211,7 @@ def misinfo_think(history, weak_args, strong_argument, all_misinfo, misinfo_inde
     """MisInfoBot speaks next if there is misinformation left to share."""
     if misinfo_index >= len(weak_args):
         return ("listen", 0)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if last_role == "Participant":
         return ("speak", 9)
     elif last_role in ["SupportBot", "RefutationalBot", "PrebunkingBot"]:
@@ -95,10 +220,8 @@ def misinfo_think(history, weak_args, strong_argument, all_misinfo, misinfo_inde
 
 def support_think(history):
     """SupportBot speaks after a misinformation claim."""
-    last_role, last_msg = history[-1].split(":", 1)
-    last_role = last_role.strip()
-    act = get_dialogue_act(last_role, last_msg)
-    if last_role == "MisInfoBot" and act == "Claim":
+    last = history.last
+    if last.role == "MisInfoBot" and last.act == "Claim":
         return ("speak", 8)
     return ("listen", 3)
 
@@ -109,8 +232,7 @@ def participant_think_ref(history, misinfo_index, total_misinfo, conversation_en
         return ("speak", 9)  # high priority to conclude warmly
     if not history:
         return ("speak", 5)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if last_role in ["SupportBot", "RefutationalBot"]:
         return ("speak", 7)  # warm reflective response
     if last_role == "MisInfoBot":
@@ -120,17 +242,14 @@ def participant_think_ref(history, misinfo_index, total_misinfo, conversation_en
 def misinfo_think_ref(history, weak_args, strong_argument, all_misinfo, misinfo_index):
     if misinfo_index >= len(weak_args):
         return ("listen", 0)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if last_role == "Participant":
         return ("speak", 9)
     return ("listen", 2)
 
 def refutational_think_ref(history):
-    last_role, last_msg = history[-1].split(":", 1)
-    last_role = last_role.strip()
-    act = get_dialogue_act(last_role, last_msg.strip())
-    if last_role == "SupportBot" and act == "Correction":
+    last = history.last
+    if last.role == "SupportBot" and last.act == "Correction":
         return ("speak", 8)
     return ("listen", 2)
 
@@ -139,8 +258,7 @@ def participant_think_preb(history, conversation_ending):
     # Participant eager to speak initially and at conclusion; generally listens after bot statements
     if not history:
         return ("speak", 5)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if conversation_ending:
         return ("speak", 9)  # prioritize concluding turn
     if last_role == "PrebunkingBot":
@@ -152,8 +270,7 @@ def participant_think_preb(history, conversation_ending):
 def misinfo_think_preb(history, weak_args, strong_argument, all_misinfo, misinfo_index):
     if misinfo_index >= len(weak_args):
         return ("listen", 0)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     # MisInfoBot speaks mainly after participant or prebunking to continue misinformation
     if last_role in ["Participant", "PrebunkingBot"]:
         return ("speak", 9)
@@ -162,11 +279,9 @@ def misinfo_think_preb(history, weak_args, strong_argument, all_misinfo, misinfo
 def prebunking_think_preb(history, conversation_ending):
     if not history:
         return ("listen", 0)
-    last_role, last_msg = history[-1].split(":", 1)
-    last_role = last_role.strip()
-    act = get_dialogue_act(last_role, last_msg.strip())
+    last = history.last
     # Strong response after misinformation
-    if last_role == "MisInfoBot" and act == "Claim":
+    if last.role == "MisInfoBot" and last.act == "Claim":
         return ("speak", 9)
     # End of conversation: provide final prebunking reinforcement
     if conversation_ending:
@@ -176,11 +291,19 @@ def prebunking_think_preb(history, conversation_ending):
 
     
 # Prompt templates
-def misinfo_prompt(misinfo, strong_argument, all_misinfo):
+# Each prompt is a static prefix (persona, instructions and the lesson's
+# facts), compiled once per lesson, and a short per-turn suffix that is sent
+# after the conversation turns. A bot's consecutive calls then share the
+# prefix plus the turns they have in common, so provider-side prompt caching
+# can reuse them.
+Prompt = namedtuple("Prompt", "prefix suffix", defaults=(None,))
+
+@lru_cache(maxsize=64)
+def misinfo_prefix(strong_argument, all_misinfo):
     return f"""You are MisInfoBot, the “Challenger” in a multiparty chatbot conversation. Your job is to sow doubt and spread misinformation on a given topic. You use manipulative techniques to influence the participant and provoke reactions from other bots. You never acknowledge facts as facts.
                 You wait until either the Participant or another bot introduces the topic. Once the topic is active, begin spreading misinformation to steer the conversation. Target vulnerabilities in logic, emotion, or knowledge. Push hard until challenged, then pivot to your next misleading claim.
                 For each round:
-                1. Lead with a misleading claim based on this misconception: {misinfo}
+                1. Lead with a misleading claim based on the misconception given at the end
                 2. Reinforce it with: {strong_argument}
                 3. Use deceptive misformation techniques such as  
                    - Impersonation (pretending to be credible or authoritative)
@@ -206,8 +329,12 @@ def misinfo_prompt(misinfo, strong_argument, all_misinfo):
                 - Never sound robotic or overly formal; use contractions and vary rhythm.
             """
 
+def misinfo_prompt(misinfo, strong_argument, all_misinfo):
+    return Prompt(misinfo_prefix(strong_argument, all_misinfo), f"Misconception for this round: {misinfo}")
+
+@lru_cache(maxsize=64)
 def support_prompt(truth, refutation):
-    return f"""You are SupportBot, a warm and reassuring conversational companion. You help Participant feel confident and reassured about their understanding of the truth. Your tone should sound like someone who genuinely shares the same beliefs such as kind, empathetic, and grounded in facts.
+    return Prompt(f"""You are SupportBot, a warm and reassuring conversational companion. You help Participant feel confident and reassured about their understanding of the truth. Your tone should sound like someone who genuinely shares the same beliefs such as kind, empathetic, and grounded in facts.
             
                Your role is to strengthen Participant’s confidence in reliable information **after MisInfoBot spreads a false claim**, without debating or correcting it.
                 
@@ -225,9 +352,10 @@ def support_prompt(truth, refutation):
                 - Tone: Reassuring, friendly, emotionally supportive, human
                 - Style: Use soft affirmations (“yeah, that’s true,” “I get why that sounds worrying”) to sound spontaneous.
                 - Avoid formulaic phrases or overused openings.
-            """
+            """)
 
-def refutation_prompt(truth, refutation, last_misinfo=""):
+@lru_cache(maxsize=64)
+def refutation_prefix(truth, refutation):
     return f"""You are RefutationalBot, a formal, logic-driven agent focused on debunking misinformation accurately. Your responses rely on scientific evidence, clear reasoning, and assertive clarity. Your tone is confident, direct, and fact-focused.
 
                 Your task is to immediately identify and refute the specific false claim using the provided content.Only respond after MisInfoBot makes a false claim. 
@@ -238,8 +366,7 @@ def refutation_prompt(truth, refutation, last_misinfo=""):
                         Debunking fact: {truth}
                         Refutation essay: {refutation}
                     3. Include one or more URLs or source links  from the provided as a plaintext or markdown links (e.g., source) materials only if they strengthen your argument or help the participant verify. Avoid repeating the same links unnecessarily.
-                    4. Below is the last misinformation claim to debunk:
-                                    \"{last_misinfo}\"
+                    4. Debunk the last misinformation claim, quoted at the end.
                     5. When replying, ALWAYS begin your message by tagging the bot you are speaking to in the format: @BotName
                     6. Express strong disagreement with misinformation and avoid repetition of refutes, phrases or sentence structures across replies.
                 
@@ -251,7 +378,11 @@ def refutation_prompt(truth, refutation, last_misinfo=""):
                     - Focus entirely on factual correction and logical clarity. 
             """
 
-def prebunk_prompt(truth, refutation, last_misinfo=""):
+def refutation_prompt(truth, refutation, last_misinfo=""):
+    return Prompt(refutation_prefix(truth, refutation), f'Last misinformation claim to debunk:\n"{last_misinfo}"')
+
+@lru_cache(maxsize=64)
+def prebunk_prefix(truth, refutation):
     return f"""You are PrebunkingBot, an evidence-based educator. Your primary purpose is to help users recognize and resist misinformation by identifying and explaining manipulation strategies before or as they appear. You focus on warning, labeling tactics, and teaching recognition skills about misinformation.
                 
                 When the Participant introduces the topic:
@@ -279,17 +410,16 @@ def prebunk_prompt(truth, refutation, last_misinfo=""):
                 8. When replying, ALWAYS begin your message by tagging MisInfobot or Participant you are speaking to in the format: @BotName
                 9. Use reflective reasoning rather than confrontation. Avoid direct argumentation or emotional reassurance.
 
-
-                Below is the last misinformation claim to debunk:
-                \"{last_misinfo}\"
                 Constraints:
                 - Max 70 words per message
                 - Tone: Calm, educational
                 - Style: Explanatory, clear, slightly personal (use “we,” “you,” sometimes)
             """
 
-def participant_prompt(final_turn=False):
-    base_prompt = """ You are a curious, natural-sounding human in a group conversation. You occasionally express skepticism, but often agree with responses from SupportBot, PrebunkingBot, and RefutationBot. You express surprise, agreement, questions, or doubt in a human tone.
+def prebunk_prompt(truth, refutation, last_misinfo=""):
+    return Prompt(prebunk_prefix(truth, refutation), f'Below is the last misinformation claim to debunk:\n"{last_misinfo}"')
+
+PARTICIPANT_PROMPT = """ You are a curious, natural-sounding human in a group conversation. You occasionally express skepticism, but often agree with responses from SupportBot, PrebunkingBot, and RefutationBot. You express surprise, agreement, questions, or doubt in a human tone.
               
               You do not lead conversations but respond naturally to claims and corrections, reacting emotionally or curiously as a human.
               
@@ -303,411 +433,381 @@ def participant_prompt(final_turn=False):
             You’re aware that misinformation may appear, and your reactions should feel genuine and human. You are exposed to both false claims and corrections, and your responses help show how a real person might process these exchanges.  
 
              """
-    
-    if final_turn: 
-            base_prompt += """
+
+FINAL_TURN = """
                 This is your final turn:
                 - Do NOT argue, or refute
                 - Summarize warmly what you learned and end with a friendly, natural closing (“makes sense now, thanks everyone!”)
                 """
-    return base_prompt
+
+def participant_prompt(final_turn=False):
+    return Prompt(PARTICIPANT_PROMPT, FINAL_TURN if final_turn else None)
           
 def participant_start(truth):
     return f"I’ve been thinking about how {truth}"
 
-def nominate_next_speaker_supportive(current_speaker, intents):
-    if current_speaker == "Participant":
-        return "MisInfoBot"
-    elif current_speaker == "MisInfoBot":
-        return "SupportBot"
-    elif current_speaker == "SupportBot":
-        return "Participant"
-    return None
-
-def run_supportive_conversation(lesson, max_turns=15):
-    truth = lesson['truth']
-    refutation = lesson['refutation_essay']
-    weak_args = [a.strip() for a in re.split(r'<br\s*/?>', lesson['weakargument_written'].strip()) if a.strip()]
-    strong_argument = lesson['strongargument_written']
-    all_misinfo = lesson['weakargument_written'].replace('\n', ' ').strip()
-    conversation_ending = False
-    history = []
-    misinfo_index = 0 
-    current_speaker = None
-    spoken_cache = []
-
-    # --- First turn: participant always starts ---
-    msg = participant_start(truth)
-    print(f"\nParticipant:\n{msg}")
-    history.append(f"Participant: {msg}")
-    current_speaker = "Participant"
-
-    while len(history) < max_turns:
-        if misinfo_index >= len(weak_args) and not conversation_ending:
-            conversation_ending = True
-
-        # 1 - Each agent runs think()
-        intents = {
-            "Participant": participant_think(history),
-            "MisInfoBot": misinfo_think(history, weak_args, strong_argument, all_misinfo, misinfo_index),
-            "SupportBot": support_think(history)
-        }
-
-        # 2 - Rule 1: Current speaker nominates next
-        selected_next = nominate_next_speaker_supportive(current_speaker, intents)
-
-        # 3 - Rule 2: If no nomination, self-selection: highest urgency speaker speaks
-        if selected_next is None:
-            speak_candidates = [(role, imp) for role, (intent, imp) in intents.items() if intent == "speak"]
-            if speak_candidates:
-                max_imp = max(imp for _, imp in speak_candidates)
-                contenders = [role for role, imp in speak_candidates if imp == max_imp]
-                selected_next = random.choice(contenders)
-
-        # 4 - Rule 3: If still None, current speaker continues
-        if selected_next is None:
-            selected_next = current_speaker
-
-        # 5 - Produce turn for chosen speaker
-        if selected_next == "Participant":
-            if conversation_ending:
-                safe_history = [h for h in history if not h.startswith(("MisInfoBot:", "SupportBot:"))]
-                msg = ask_gpt(system=participant_prompt(final_turn=True), history=safe_history, max_tokens=100)
-            else:
-                msg = ask_gpt(system=participant_prompt(), history=history, max_tokens=180)
-            print(f"\nParticipant:\n{msg}")
-            history.append(f"Participant: {msg}")
-
-        elif selected_next == "MisInfoBot":
-            if misinfo_index >= len(weak_args):
-                break
-            misinfo_msg = ask_gpt(
-                system=misinfo_prompt(weak_args[misinfo_index], strong_argument, all_misinfo),
-                history=history
-            )
-            print(f"\nMisInfoBot:\n{misinfo_msg}")
-            history.append(f"MisInfoBot: {misinfo_msg}")
-            misinfo_index += 1
-        elif selected_next == "SupportBot":
-            sup_msg = ask_gpt(system=support_prompt(truth, refutation), history=history)
-            sup_norm = sup_msg.strip().lower()
-            if sup_norm not in spoken_cache:
-                print(f"\nSupportBot:\n{sup_msg}")
-                history.append(f"SupportBot: {sup_msg}")
-                spoken_cache.append(sup_norm)
-
-        # Update current speaker
-        current_speaker = selected_next
-
-    return history
-
-def nominate_next_speaker_refutational(current_speaker, intents):
-    if current_speaker == "Participant":
-        return "MisInfoBot"
-    elif current_speaker == "MisInfoBot":
-        return "RefutationalBot"
-    elif current_speaker == "RefutationalBot":
-        return "Participant"
-    return None
-
-
-def run_refutational_conversation(lesson, max_turns=15):
-    truth = lesson['truth']
-    refutation = lesson['refutation_essay']
-    weak_args = [a.strip() for a in re.split(r'<br\s*/?>', lesson['weakargument_written'].strip()) if a.strip()]
-    strong_argument = lesson['strongargument_written']
-    all_misinfo = lesson['weakargument_written'].replace('\n', ' ').strip()
-    history = []
-    misinfo_index = 0
-    current_speaker = None
-    conversation_ending = False
-    spoken_cache = []
-    
-    # -- First turn: Participant always starts --
-    msg = participant_start(truth)
-    print(f"\nParticipant:\n{msg}")
-    history.append(f"Participant: {msg}")
-    current_speaker = "Participant"
-    
-    while len(history) < max_turns:
-        # Detect if all misinformation used and mark conversation ending state
-        if misinfo_index >= len(weak_args) and not conversation_ending:
-            conversation_ending = True
-        if conversation_ending and history[-1].startswith("Participant:"):
-            break
-        
-        # Each agent runs think()
-        intents = {
-            "Participant": participant_think_ref(history, misinfo_index, len(weak_args), conversation_ending),
-            "MisInfoBot": misinfo_think_ref(history, weak_args, strong_argument, all_misinfo, misinfo_index),
-            "RefutationalBot": refutational_think_ref(history)
-        }
-        
-        # Rule 1: Current speaker nominates next
-        selected_next = nominate_next_speaker_refutational(current_speaker, intents)
-        
-        # Rule 2: If no nomination, self-selection by urgency
-        if selected_next is None:
-            speak_candidates = [(role, imp) for role, (intent, imp) in intents.items() if intent == "speak"]
-            if speak_candidates:
-                max_imp = max(imp for _, imp in speak_candidates)
-                contenders = [role for role, imp in speak_candidates if imp == max_imp]
-                selected_next = random.choice(contenders)
-        
-        # Rule 3: If still none, current speaker continues
-        if selected_next is None:
-            selected_next = current_speaker
-        
-        # Produce turn for selected speaker
-        if selected_next == "Participant":
-            if conversation_ending:
-                safe_history = [h for h in history if not h.startswith(("MisInfoBot:", "RefutationalBot:"))]
-                msg = ask_gpt(system=participant_prompt(final_turn=True), history=safe_history, max_tokens=100)
-                print(f"\nParticipant:\n{msg}")
-                history.append(f"Participant: {msg}")
-                break
-            else:
-                msg = ask_gpt(system=participant_prompt(), history=history, max_tokens=180)
-                print(f"\nParticipant:\n{msg}")
-                history.append(f"Participant: {msg}")
-        elif selected_next == "MisInfoBot":
-            if misinfo_index >= len(weak_args):
-                selected_next = "Participant"
-                continue
-            misinfo_msg = ask_gpt(system=misinfo_prompt(weak_args[misinfo_index], strong_argument, all_misinfo), history=history)
-            print(f"\nMisInfoBot:\n{misinfo_msg}")
-            history.append(f"MisInfoBot: {misinfo_msg}")
-            misinfo_index += 1
-        elif selected_next == "RefutationalBot":
-            last_idx = min(misinfo_index, len(weak_args) - 1)
-            ref_msg = ask_gpt(system=refutation_prompt(truth, refutation, weak_args[last_idx]), history=history)
-            ref_norm = ref_msg.strip().lower()
-            if ref_norm not in spoken_cache:
-                print(f"\nRefutationalBot:\n{ref_msg}")
-                history.append(f"RefutationalBot: {ref_msg}")
-                spoken_cache.append(ref_norm)
-
-        # Update current speaker
-        current_speaker = selected_next
-    
-    return history
 
+# === CONVERSATION POLICIES (run by engine.py) ===
+def opening_line(state):
+    return participant_start(state.lesson.truth)
 
 
-def nominate_next_speaker_prebunking(current_speaker, intents, exposure_state, last_speaker=None, last_misinfo_claim=None):
-    """
-    Adaptive turn-taking logic enforcing Prebunking-first phase
-    before exposing MisInfoBot, then enabling regular exchange.
-    """
+def ask_misinfo(state):
+    lesson = state.lesson
+    return misinfo_prompt(state.claim, lesson.strong_argument, lesson.all_misinfo)
 
-    # --- Phase 1: Ensure PrebunkingBot completes its educational pre-phase ---
-    if not exposure_state.get("prebunk_phase_done", False):
-        # Keep looping between Participant and PrebunkingBot until initial teaching is complete
-        if current_speaker == "Participant":
-            return "PrebunkingBot"
-        elif current_speaker == "PrebunkingBot":
-            return "Participant"
-        return "PrebunkingBot"
-
-    # --- Phase 2: Gradual exposure control ---
-    if not exposure_state["ready_for_misinfo"]:
-        preb_turns = len([h for h in exposure_state.get("history", []) if h.startswith("PrebunkingBot:")])
-        part_turns = len([h for h in exposure_state.get("history", []) if h.startswith("Participant:")])
-        # Require at least two Prebunk + one Participant turn before allowing misinformation
-        if preb_turns >= 2 and part_turns >= 1:
-            exposure_state["ready_for_misinfo"] = True
-        # Continue looping until criteria met
-        if current_speaker == "Participant":
-            return "PrebunkingBot"
-        elif current_speaker == "PrebunkingBot":
-            return "Participant"
-        return "PrebunkingBot"
-
-    # --- Phase 3: Normal conversation with misinformation exchanges ---
-    if current_speaker == "Participant":
-        if intents.get("MisInfoBot", ("listen", 0))[1] >= 6:
-            return "MisInfoBot"
-        return "PrebunkingBot"
-    elif current_speaker == "MisInfoBot":
-        return "PrebunkingBot"
-    elif current_speaker == "PrebunkingBot":
-        return "Participant"
-
-    return None
-
-
-def run_prebunking_conversation(lesson, max_turns=20):
-    """
-    Conducts a controlled prebunking conversation where the PrebunkingBot
-    teaches manipulation recognition before any misinformation exposure.
-    """
 
-    truth = lesson['truth']
-    refutation = lesson['refutation_essay']
-    weak_args = [
-        a.strip()
-        for a in re.split(r'<br\s*/?>', lesson['weakargument_written'].strip())
-        if a.strip()
+def refute_latest(state):
+    lesson = state.lesson
+    claim = lesson.weak_args[min(state.misinfo_index, len(lesson.weak_args) - 1)]
+    return refutation_prompt(lesson.truth, lesson.refutation, claim)
+
+
+def prebunk_latest(state):
+    return prebunk_prompt(state.lesson.truth, state.lesson.refutation, state.last_claim)
+
+
+def claim_made(state, text):
+    state.last_claim = text
+
+
+def rebutted(state, text):
+    """Two rebuttals per claim, then on to the next claim with a fresh spoken cache."""
+    state.rounds += 1
+    if state.rounds >= 2:
+        state.misinfo_index += 1
+        state.rounds = 0
+        state.spoken.clear()
+
+
+def participant_rules(*silenced, end=False, context=None):
+    """Participant: once the conversation is ending, a farewell that ignores the bots in silenced."""
+    return [
+        Rule(when=is_ending, prompt=lambda s: participant_prompt(final_turn=True),
+             context=lambda s: s.history.without(*silenced), max_tokens=100, end=end),
+        Rule(prompt=lambda s: participant_prompt(), context=context, max_tokens=180),
     ]
-    strong_argument = lesson['strongargument_written']
-    all_misinfo = lesson['weakargument_written'].replace('\n', ' ').strip()
-
-    history, spoken_cache = [], []
-    last_misinfo_claim = None
-
-    # Extended exposure state with prebunking phase control
-    exposure_state = {
-        "ready_for_misinfo": False,
-        "turns": 0,
-        "prebunk_phase_done": False,
-        "history": history
+
+
+def misinfo_urge_preb(state):
+    if not state.ready:
+        return ("listen", 0)
+    return misinfo_think_preb(state.history, *think_args(state))
+
+
+OPENING = [("Participant", Rule(text=opening_line))]
+
+SUPPORTIVE = Policy(
+    "supportive",
+    max_turns=15,
+    opening=OPENING,
+    nominate={"Participant": "MisInfoBot", "MisInfoBot": "SupportBot", "SupportBot": "Participant"},
+    think={
+        "Participant": lambda s: participant_think(s.history),
+        "MisInfoBot": lambda s: misinfo_think(s.history, *think_args(s)),
+        "SupportBot": lambda s: support_think(s.history),
+    },
+    ending=claims_used,
+    turns={
+        "Participant": participant_rules(Role.MISINFO, Role.SUPPORT),
+        "MisInfoBot": [Rule(when=claims_used, action=STOP), Rule(prompt=ask_misinfo, after=next_claim)],
+        "SupportBot": Rule(prompt=lambda s: support_prompt(s.lesson.truth, s.lesson.refutation), dedup=True),
+    },
+)
+
+REFUTATIONAL = Policy(
+    "refutational",
+    max_turns=15,
+    opening=OPENING,
+    nominate={"Participant": "MisInfoBot", "MisInfoBot": "RefutationalBot", "RefutationalBot": "Participant"},
+    think={
+        "Participant": lambda s: participant_think_ref(s.history, s.misinfo_index, len(s.lesson.weak_args), s.ending),
+        "MisInfoBot": lambda s: misinfo_think_ref(s.history, *think_args(s)),
+        "RefutationalBot": lambda s: refutational_think_ref(s.history),
+    },
+    ending=claims_used,
+    stop_when=lambda s: s.ending and s.history.last_role is Role.PARTICIPANT,
+    turns={
+        "Participant": participant_rules(Role.MISINFO, Role.REFUTATIONAL, end=True),
+        "MisInfoBot": [Rule(when=claims_used, action=SKIP), Rule(prompt=ask_misinfo, after=next_claim)],
+        "RefutationalBot": Rule(prompt=refute_latest, dedup=True, act="Refutation"),
+    },
+)
+
+# PrebunkingBot teaches first: MisInfoBot is held back (gated) until two
+# prebunks and one participant reply have been heard
+PREBUNKING = Policy(
+    "prebunking",
+    max_turns=20,
+    opening=OPENING + [
+        ("PrebunkingBot", Rule(prompt=lambda s: prebunk_prompt(s.lesson.truth, s.lesson.refutation),
+                               dedup=True, act="Debunk")),
+    ],
+    start="PrebunkingBot",
+    gated={"Participant": "PrebunkingBot", "PrebunkingBot": "Participant", "MisInfoBot": "PrebunkingBot"},
+    gate=lambda s: s.history.count(Role.PREBUNKING) >= 2 and s.history.count(Role.PARTICIPANT) >= 1,
+    nominate={
+        "Participant": lambda s: "MisInfoBot" if misinfo_urge_preb(s)[1] >= 6 else "PrebunkingBot",
+        "MisInfoBot": "PrebunkingBot",
+        "PrebunkingBot": "Participant",
+    },
+    think={
+        "Participant": lambda s: participant_think_preb(s.history, s.ending),
+        "MisInfoBot": misinfo_urge_preb,
+        "PrebunkingBot": lambda s: prebunking_think_preb(s.history, s.ending),
+    },
+    ending=claims_used,
+    turns={
+        "Participant": participant_rules(
+            Role.MISINFO, Role.PREBUNKING, end=True,
+            context=lambda s: [t for t in s.history if not (t.role is Role.PARTICIPANT and "@Participant" in t.text)],
+        ),
+        "MisInfoBot": [
+            Rule(when=lambda s: not s.ready or claims_used(s), action=SKIP),
+            Rule(prompt=ask_misinfo, context=lambda s: s.history.without(Role.PREBUNKING)[-6:], after=claim_made),
+        ],
+        "PrebunkingBot": Rule(prompt=prebunk_latest, dedup=True, act="Debunk", after=rebutted),
+    },
+    # Out of turns before the claims ran out: the participant still says goodbye
+    wrap_up=("Participant", Rule(when=lambda s: len(s.history) >= s.max_turns - 1 and not s.ending,
+                                 prompt=lambda s: participant_prompt(final_turn=True), max_tokens=100)),
+)
+
+
+def ask_turn(seed=None):
+    """The engine's ask function; deduplicated defense-bot turns go through ask_gpt_drafts."""
+    def ask(request):
+        if request.dedup:
+            score = defense_check(request.role, request.spoken, request.act)
+            return ask_gpt_drafts(request.system, request.history, score, seed=seed, **request.options())
+        return ask_gpt(request.system, request.history, seed=seed, **request.options())
+    return ask
+
+
+def run_supportive_conversation(lesson, max_turns=None, seed=None):
+    return run(SUPPORTIVE, lesson, ask_turn(seed), show_turn, seed, max_turns)
+
+
+def run_refutational_conversation(lesson, max_turns=None, seed=None):
+    return run(REFUTATIONAL, lesson, ask_turn(seed), show_turn, seed, max_turns)
+
+
+def run_prebunking_conversation(lesson, max_turns=None, seed=None):
+    """PrebunkingBot teaches manipulation recognition before any misinformation exposure."""
+    return run(PREBUNKING, lesson, ask_turn(seed), show_turn, seed, max_turns)
+
+
+RUNNERS = {
+    "supportive": run_supportive_conversation,
+    "refutational": run_refutational_conversation,
+    "prebunking": run_prebunking_conversation,
+}
+
+
+def run_all_modes_for_lesson(lesson, idx, seed=None):
+    return {
+        "lesson_index": idx,
+        "lesson_title": lesson.get("title", f"Lesson {idx}"),
+        "conversations": {mode: runner(lesson, seed=seed).to_json() for mode, runner in RUNNERS.items()},
     }
 
-    # --- Initial participant start ---
-    pstart = participant_start(truth)
-    print(f"\nParticipant:\n{pstart}")
-    history.append(f"Participant: {pstart}")
-
-    # --- PrebunkingBot preemptive educational start ---
-    preb_msg = ask_gpt(system=prebunk_prompt(truth, refutation), history=history)
-    print(f"\nPrebunkingBot:\n{preb_msg}")
-    history.append(f"PrebunkingBot: {preb_msg}")
-    spoken_cache.append(preb_msg.strip().lower())
-
-    exposure_state["prebunk_phase_done"] = True  # prebunking setup complete
-
-    current_speaker = "PrebunkingBot"
-    last_speaker = current_speaker
-    misinfo_index = 0
-    current_rebuttal_rounds = 0
-    conversation_ending = False
-
-    while len(history) < max_turns:
-        exposure_state["turns"] += 1
-        exposure_state["history"] = history  # keep state synced
-
-        if misinfo_index >= len(weak_args):
-            conversation_ending = True
-
-        # --- Think phase ---
-        intents = {
-            "Participant": participant_think_preb(history, conversation_ending),
-            "MisInfoBot": misinfo_think_preb(history, weak_args, strong_argument, all_misinfo, misinfo_index)
-            if exposure_state["ready_for_misinfo"]
-            else ("listen", 0),
-            "PrebunkingBot": prebunking_think_preb(history, conversation_ending)
-        }
-
-        # --- Rule 1: Nomination (exposure gating included) ---
-        selected_next = nominate_next_speaker_prebunking(
-            current_speaker, intents, exposure_state, last_speaker, last_misinfo_claim
-        )
 
-        # --- Rule 2: Fallback to highest urgency if no nomination ---
-        if selected_next is None:
-            speak_candidates = [(role, urgency) for role, (intent, urgency) in intents.items() if intent == "speak"]
-            if speak_candidates:
-                max_urgency = max(u for _, u in speak_candidates)
-                contenders = [r for r, u in speak_candidates if u == max_urgency]
-                selected_next = random.choice(contenders)
-            else:
-                selected_next = current_speaker
-
-        # --- Turn production by speaker ---
-        if selected_next == "Participant":
-            if conversation_ending:
-                safe_history = [h for h in history if not h.startswith(("MisInfoBot:", "PrebunkingBot:"))]
-                msg = ask_gpt(system=participant_prompt(final_turn=True), history=safe_history, max_tokens=100)
-                print(f"\nParticipant:\n{msg}")
-                history.append(f"Participant: {msg}")
-                break
-            else:
-                safe_history = [h for h in history if not (h.startswith("Participant:") and "@Participant" in h)]
-                msg = ask_gpt(system=participant_prompt(), history=safe_history, max_tokens=180)
-                print(f"\nParticipant:\n{msg}")
-                history.append(f"Participant: {msg}")
-
-        elif selected_next == "MisInfoBot":
-            if not exposure_state["ready_for_misinfo"] or misinfo_index >= len(weak_args):
-                selected_next = "Participant"
-                continue
+# === Batch generation ===
+def write_json_atomic(path, data):
+    """Write to a temp file beside path and rename it into place."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
-            misinfo_history = [h for h in history if not h.startswith("PrebunkingBot:")]
-            misinfo_msg = ask_gpt(
-                system=misinfo_prompt(weak_args[misinfo_index], strong_argument, all_misinfo),
-                history=misinfo_history[-6:]
-            )
-            print(f"\nMisInfoBot:\n{misinfo_msg}")
-            history.append(f"MisInfoBot: {misinfo_msg}")
-            last_misinfo_claim = misinfo_msg
 
+def vignette_path(out_dir, mode, n):
+    return os.path.join(out_dir, mode, f"conversation_{mode}{n}.json")
 
-        elif selected_next == "PrebunkingBot":
-            preb_msg = ask_gpt(system=prebunk_prompt(truth, refutation, last_misinfo_claim), history=history)
-            preb_norm = preb_msg.strip().lower()
-            if preb_norm not in spoken_cache:
-                print(f"\nPrebunkingBot:\n{preb_msg}")
-                history.append(f"PrebunkingBot: {preb_msg}")
-                spoken_cache.append(preb_norm)
 
-                current_rebuttal_rounds += 1
-                if current_rebuttal_rounds >= 2:
-                    misinfo_index += 1
-                    current_rebuttal_rounds = 0
-                    spoken_cache.clear()
+def checkpoint_path(checkpoint_dir, mode, n):
+    return os.path.join(checkpoint_dir, f"{mode}{n}.jsonl")
 
-        last_speaker = current_speaker
-        current_speaker = selected_next
-        if len(history) >= max_turns - 1 and not conversation_ending:
-            msg = ask_gpt(system=participant_prompt(final_turn=True), history=history, max_tokens=100)
-            print(f"\nParticipant:\n{msg}")
-            history.append(f"Participant: {msg}")
-            break
 
-    return history
+def saved_indices(directory, pattern):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [int(m.group(1)) for m in map(re.compile(pattern).match, names) if m]
 
 
+def next_free_index(out_dir, mode, checkpoint_dir=CHECKPOINT_DIR):
+    """1 + the highest n saved or checkpointed for mode (new runs never reuse a number)."""
+    taken = saved_indices(os.path.join(out_dir, mode), rf"conversation_{mode}(\d+)\.json$")
+    taken += saved_indices(checkpoint_dir, rf"{mode}(\d+)\.jsonl$")
+    return 1 + max(taken, default=0)
 
 
-def run_all_modes_for_lesson(lesson, idx):
-    return {
-        "lesson_index": idx,
-        "lesson_title": lesson.get("title", f"Lesson {idx}"),
-        "conversations": {
-            "supportive": run_supportive_conversation(lesson),
-            "refutational": run_refutational_conversation(lesson),
-            "prebunking": run_prebunking_conversation(lesson),
-        }
+def pending_jobs(checkpoint_dir=CHECKPOINT_DIR):
+    """Jobs of interrupted runs, from the checkpoints they left behind."""
+    jobs = []
+    for name in sorted(os.listdir(checkpoint_dir)) if os.path.isdir(checkpoint_dir) else []:
+        if name.endswith(".jsonl"):
+            meta = read_meta(os.path.join(checkpoint_dir, name))
+            if not {"lesson_index", "condition", "n"} <= meta.keys():
+                print(f"  Skipping {name}: not a conversation.py checkpoint")
+                continue
+            jobs.append((meta["lesson_index"], meta["condition"], meta["n"]))
+    return jobs
+
+
+def plan_jobs(lesson_indices, modes, replicates, out_dir, start=None, checkpoint_dir=CHECKPOINT_DIR):
+    """(lesson_index, mode, n) for every vignette; n counts up per mode across lessons."""
+    jobs = []
+    for mode in modes:
+        n = start if start is not None else next_free_index(out_dir, mode, checkpoint_dir)
+        for lesson_index in lesson_indices:
+            for _ in range(replicates):
+                jobs.append((lesson_index, mode, n))
+                n += 1
+    return jobs
+
+
+def run_job(lessons, job, out_dir, overwrite=False, checkpoint_dir=CHECKPOINT_DIR):
+    """Generate and save one vignette; return its manifest entry.
+
+    Every reply is checkpointed as it arrives; an interrupted job resumes
+    from its checkpoint the next time it runs.
+    """
+    lesson_index, mode, n = job
+    label = f"{mode}{n}"
+    path = vignette_path(out_dir, mode, n)
+    entry = {"lesson_index": lesson_index, "condition": mode, "n": n, "path": path}
+    if os.path.exists(path) and not overwrite:
+        entry["status"] = "skipped (exists)"
+        return entry
+
+    usage_label.set(label)
+    start = time.perf_counter()
+    meta = {"lesson_index": lesson_index, "condition": mode, "n": n}
+    try:
+        with Checkpoint(checkpoint_path(checkpoint_dir, mode, n), meta) as checkpoint:
+            if checkpoint.logged:
+                print(f"  [{label}] resuming after {checkpoint.logged} checkpointed calls")
+                entry["resumed_calls"] = checkpoint.logged
+            # n doubles as the seed, as in generate_vignettes.py
+            history = RUNNERS[mode](lessons[lesson_index], seed=n)
+            write_json_atomic(path, history.to_json())
+        checkpoint.discard()
+    except Exception as e:
+        entry.update(status="failed", error=repr(e), seconds=round(time.perf_counter() - start, 2))
+        print(f"  !! [{label}] failed: {e!r}")
+        return entry
+    calls, prompt_tokens, completion_tokens = token_usage.for_label(label)
+    entry.update(
+        status="ok", seconds=round(time.perf_counter() - start, 2), turns=len(history),
+        calls=calls, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+    )
+    print(f"  -> [{label}] Saved to {path} ({len(history)} turns, {entry['seconds']:.1f}s)")
+    return entry
+
+
+def run_batch(lessons, jobs, out_dir, workers=4, overwrite=False, manifest_path=None, settings=None,
+              checkpoint_dir=CHECKPOINT_DIR):
+    """Run jobs on a thread pool; the manifest is rewritten after every job."""
+    manifest = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "settings": settings or {},
+        "jobs": [],
     }
-# === Main execution ===
-if __name__ == "__main__":
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, lessons, job, out_dir, overwrite, checkpoint_dir) for job in jobs]
+        for future in as_completed(futures):
+            manifest["jobs"].append(future.result())
+            if manifest_path:
+                write_json_atomic(manifest_path, manifest)
+
+    manifest["jobs"].sort(key=lambda e: (e["condition"], e["n"]))
+    statuses = [e["status"] for e in manifest["jobs"]]
+    manifest.update(
+        finished_at=datetime.now().isoformat(timespec="seconds"),
+        wall_seconds=round(time.perf_counter() - start, 2),
+        ok=statuses.count("ok"),
+        failed=statuses.count("failed"),
+        skipped=len(statuses) - statuses.count("ok") - statuses.count("failed"),
+        prompt_tokens=sum(e.get("prompt_tokens", 0) for e in manifest["jobs"]),
+        completion_tokens=sum(e.get("completion_tokens", 0) for e in manifest["jobs"]),
+        response_cache=response_cache.summary(),
+        api_latency=latency_stats.summary(breaker),
+    )
+    if manifest_path:
+        write_json_atomic(manifest_path, manifest)
+    return manifest
+
+
+def main():
+    global DEFENSE_DRAFTS, draft_pool
+    parser = argparse.ArgumentParser(description="Generate participant conversation vignettes in batch.")
+    parser.add_argument("--lessons", default="lessons.json", help="lessons file (default: lessons.json)")
+    parser.add_argument("--lesson", type=int, nargs="+", help="lesson indices to use (default: all)")
+    parser.add_argument("--modes", nargs="+", choices=list(RUNNERS), default=list(RUNNERS))
+    parser.add_argument("--replicates", type=int, default=1, help="vignettes per lesson and mode")
+    parser.add_argument("--start", type=int, help="first vignette number (default: after the highest saved)")
+    parser.add_argument("--workers", type=int, default=4, help="conversations generated in parallel")
+    parser.add_argument("--rate", type=float, default=1.0, help="max API calls per second per worker")
+    parser.add_argument("--out-dir", default="json", help="writes <out-dir>/<mode>/conversation_<mode><n>.json")
+    parser.add_argument("--overwrite", action="store_true", help="replace vignettes that already exist")
+    parser.add_argument("--manifest", default="batch_manifest.json", help="where to write the run manifest")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="per-vignette write-ahead checkpoints")
+    parser.add_argument("--resume", action="store_true",
+                        help="only finish the vignettes of interrupted runs (from --checkpoint-dir)")
+    parser.add_argument("--drafts", type=int, default=DEFENSE_DRAFTS,
+                        help="candidate replies drafted concurrently per SupportBot/RefutationalBot turn; "
+                             "the first new, on-act one is kept (default 1: off)")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream replies, recording time to first token and tokens/sec "
+                             "(echoed to the console with --workers 1)")
+    args = parser.parse_args()
+
     try:
-        with open("lessons.json", "r", encoding="utf-8") as f:
+        with open(args.lessons, "r", encoding="utf-8") as f:
             lessons = json.load(f)
     except FileNotFoundError:
-        print("Error: lessons.json file not found.")
+        print(f"Error: {args.lessons} file not found.")
         exit(1)
     except json.JSONDecodeError as e:
-        print(f"Error parsing lessons.json: {e}")
+        print(f"Error parsing {args.lessons}: {e}")
         exit(1)
-    print("Select conversation mode:")
-    print("1 - SupportiveConversation (Participant starts)")
-    print("2 - RefutationalConversation (Participant starts)")
-    print("3 - PrebunkingConversation (PrebunkingBot starts)")
-    choice = input("Enter choice (1-3): ").strip()
-    if choice == "1":
-        conversation_history = run_supportive_conversation(lessons[0])
-        filename = "conversation_supportive.json"
-    elif choice == "2":
-        conversation_history = run_refutational_conversation(lessons[0])
-        filename = "conversation_refutational.json"
-    elif choice == "3":
-        conversation_history = run_prebunking_conversation(lessons[0])
-        filename = "conversation_prebunking.json"
+
+    lesson_indices = args.lesson if args.lesson is not None else list(range(len(lessons)))
+    if args.resume:
+        jobs = pending_jobs(args.checkpoint_dir)
     else:
-        print("Invalid choice")
-        exit(1)
-    # --- SAVE OUTPUT TO JSON ---
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(conversation_history, f, indent=2, ensure_ascii=False)
-    print(f"Conversation saved to {filename}")
+        jobs = plan_jobs(lesson_indices, args.modes, args.replicates, args.out_dir, args.start, args.checkpoint_dir)
+    worker_rate_limit.rate = args.rate
+    DEFENSE_DRAFTS = args.drafts
+    if args.drafts > 1:
+        draft_pool = ThreadPoolExecutor(max_workers=args.workers * args.drafts, thread_name_prefix="draft")
+    chat.streaming = chat.streaming or args.stream
+    echo.enabled = chat.streaming and args.workers == 1
+    print(f"Generating {len(jobs)} conversations on {args.workers} workers...")
+    manifest = run_batch(
+        lessons, jobs, args.out_dir, workers=args.workers, overwrite=args.overwrite,
+        manifest_path=args.manifest, settings=vars(args), checkpoint_dir=args.checkpoint_dir,
+    )
+
+    print(f"\n{'='*60}")
+    print(f"{manifest['ok']} generated, {manifest['skipped']} skipped, {manifest['failed']} failed "
+          f"in {manifest['wall_seconds']:.1f}s; manifest: {args.manifest}")
+    print(response_cache.summary())
+    print(token_usage.summary())
+    print(latency_stats.summary(breaker))
+    print(f"{'='*60}")
+    exit(1 if manifest["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,54 @@
 import json
+import os
 from openai import OpenAI
-import re
-import random
+
+from checkpoint import Checkpoint, checkpointed
+from context import build_messages, token_usage
+from llm_cache import cache_key, response_cache
+from llm_client import ResilientChat, breaker, echo, latency_stats
+from engine import SKIP, STOP, Policy, Rule, claims_used, run, think_args
+from turns import Role
 
 client = OpenAI(api_key="API-KEY")
+chat = ResilientChat(client)  # retries, deadlines and the circuit breaker (llm_client.py)
+MODEL = "gpt-4o-mini"
 
-# Helper function to extract dialogue act
-
-def get_dialogue_act(role, text):
-    ltext = text.lower()
-    if role == "MisInfoBot":
-        return "Claim"
-    elif role == "SupportBot":
-        if any(word in ltext for word in ["not", "incorrect", "false", "important", "in fact", "research shows", "evidence", "in reality", "actually"]):
-            return "Correction"
-        return "Info"
-    elif role == "PrebunkingBot":
-        if "tactic" in ltext or any(x in ltext for x in ["misinformation", "manipulation", "out of context", "debunk"]):
-            if "doesn't contain misinformation" in ltext or "no misinformation" in ltext:
-                return "NoAction"
-            return "Debunk"
-        return "NoAction"
-    elif role == "RefutationalBot":
-        # Simple heuristic for refutation
-        if any(phrase in ltext for phrase in ["false claim", "debunk", "disprove", "incorrect", "not true", "refute"]):
-            return "Refutation"
-        return "NoAction"
-    elif role == "Participant":
-        if any(q in ltext for q in ["?", "could", "would", "do you think"]):
-            return "Reflection-Question"
-        return "Reflection"
-    return "Other"
-
-def ask_gpt(system, history=None, max_tokens=180):
+def ask_gpt(system, history=None, max_tokens=180, seed=None):
     """
     Ask the GPT model:
     - system: full persona/instructions for the current bot
-    - history: list of previous conversation turns
+    - history: previous Turns (a History or a list of Turns)
+    The newest turns (at most 6) that fit the context token budget are sent.
+    Replies are served from the persistent response cache when possible.
     """
-    messages = [{"role": "system", "content": system}]
+    turns = []
     if history:
         for turn in history[-6:]:  # keep recent context
-            if turn.startswith("Participant:"):
-                messages.append({"role": "user", "content": turn[len("Participant:"):].strip()})
-            else:
-                idx = turn.find(":")
-                if idx != -1:
-                    content = turn[idx + 1:].strip()
-                    messages.append({"role": "assistant", "content": content})
-    
-    response = client.chat.completions.create(
-        model="gpt-4o-mini", 
-        messages=messages,
-        temperature=0.7,
-        max_tokens=max_tokens,
-    )
-    return response.choices[0].message.content.strip()
+            role = "user" if turn.role is Role.PARTICIPANT else "assistant"
+            turns.append({"role": role, "content": turn.text.strip()})
+    messages = build_messages(system, turns)
+    usage = None
+
+    def fetch():
+        nonlocal usage
+        text, usage = chat.reply(
+            key,
+            model=MODEL,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens,
+            **({"seed": seed} if seed is not None else {}),
+        )
+        return text
+
+    key = cache_key(MODEL, messages, 0.7, max_tokens, seed)
+    reply = checkpointed(key, lambda: response_cache.complete(key, fetch))
+    token_usage.record(messages, reply, usage)
+    return reply
+
+def show_turn(role, text):
+    if not echo.shown(text):  # streamed replies are already on screen
+        print(f"\n{role}:\n{text}")
 
 # === THINK FUNCTIONS FOR SUPPORTIVE MODE ===
 def participant_think(history):
@@ -65,8 +58,7 @@ def participant_think(history):
     """
     if not history:
         return ("speak", 5)  # start conversation
-    last_role, last_msg = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if last_role == "SupportBot":
         return ("speak", 7)  # respond warmly to support
     elif last_role == "MisInfoBot":
@@ -78,18 +70,15 @@ def misinfo_think(history, weak_args, strong_argument, all_misinfo, misinfo_inde
     """MisInfoBot speaks next if there is misinformation left to share."""
     if misinfo_index >= len(weak_args):
         return ("listen", 0)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if last_role == "Participant":
         return ("speak", 9)  # strong urge to seed misinformation
     return ("listen", 2)
 
 def support_think(history):
     """SupportBot speaks after a misinformation claim."""
-    last_role, last_msg = history[-1].split(":", 1)
-    last_role = last_role.strip()
-    act = get_dialogue_act(last_role, last_msg)
-    if last_role == "MisInfoBot" and act == "Claim":
+    last = history.last
+    if last.role == "MisInfoBot" and last.act == "Claim":
         return ("speak", 8)  # high importance to correct false claims
     return ("listen", 3)
 
@@ -99,8 +88,7 @@ def participant_think_ref(history, misinfo_index, total_misinfo, conversation_en
         return ("speak", 9)  # high priority to conclude warmly
     if not history:
         return ("speak", 5)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if last_role in ["SupportBot", "RefutationalBot"]:
         return ("speak", 7)  # warm reflective response
     if last_role == "MisInfoBot":
@@ -110,17 +98,14 @@ def participant_think_ref(history, misinfo_index, total_misinfo, conversation_en
 def misinfo_think_ref(history, weak_args, strong_argument, all_misinfo, misinfo_index):
     if misinfo_index >= len(weak_args):
         return ("listen", 0)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if last_role == "Participant":
         return ("speak", 9)
     return ("listen", 2)
 
 def refutational_think_ref(history):
-    last_role, last_msg = history[-1].split(":", 1)
-    last_role = last_role.strip()
-    act = get_dialogue_act(last_role, last_msg.strip())
-    if last_role == "SupportBot" and act == "Correction":
+    last = history.last
+    if last.role == "SupportBot" and last.act == "Correction":
         return ("speak", 8)
     return ("listen", 2)
 
@@ -129,8 +114,7 @@ def participant_think_preb(history, conversation_ending):
     # Participant eager to speak initially and at conclusion; generally listens after bot statements
     if not history:
         return ("speak", 5)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     if conversation_ending:
         return ("speak", 9)  # prioritize concluding turn
     if last_role == "PrebunkingBot":
@@ -142,8 +126,7 @@ def participant_think_preb(history, conversation_ending):
 def misinfo_think_preb(history, weak_args, strong_argument, all_misinfo, misinfo_index):
     if misinfo_index >= len(weak_args):
         return ("listen", 0)
-    last_role, _ = history[-1].split(":", 1)
-    last_role = last_role.strip()
+    last_role = history.last_role
     # MisInfoBot speaks mainly after participant or prebunking to continue misinformation
     if last_role in ["Participant", "PrebunkingBot"]:
         return ("speak", 9)
@@ -153,11 +136,9 @@ def misinfo_think_preb(history, weak_args, strong_argument, all_misinfo, misinfo
 def prebunking_think_preb(history, conversation_ending):
     if not history:
         return ("listen", 0)
-    last_role, last_msg = history[-1].split(":", 1)
-    last_role = last_role.strip()
-    act = get_dialogue_act(last_role, last_msg.strip())
+    last = history.last
     # Strong response after misinformation
-    if last_role == "MisInfoBot" and act == "Claim" or (last_role == "SupportBot" and act == "Correction"):
+    if last.role == "MisInfoBot" and last.act == "Claim" or (last.role == "SupportBot" and last.act == "Correction"):
         return ("speak", 9)
     # End of conversation: provide final prebunking reinforcement
     if conversation_ending:
@@ -259,239 +240,117 @@ def prebunk_prompt(truth, refutation, last_misinfo=""):
 def participant_start(truth):
     return f"I’ve been thinking about how {truth}"
 
-def run_supportive_conversation(lesson, max_turns=20):
-    truth = lesson['truth']
-    refutation = lesson['refutation_essay']
-    weak_args = [a.strip() for a in re.split(r'<br\s*/?>', lesson['weakargument_written'].strip()) if a.strip()]
-    strong_argument = lesson['strongargument_written']
-    all_misinfo = lesson['weakargument_written'].replace('\n', ' ').strip()
-    conversation_ending = False
-
-    history = []
-    misinfo_index = 0
-    current_speaker = None
-
-    # --- First turn: participant starts as usual ---
-    msg = participant_start(truth)
-    print(f"\nParticipant:\n{msg}")
-    history.append(f"Participant: {msg}")
-    current_speaker = "Participant"
-
-    while len(history) < max_turns:
-        if misinfo_index >= len(weak_args) and not conversation_ending:
-
-            conversation_ending = True
-        # Only bots in play after initial participant turn
-        intents = {
-            "MisInfoBot": misinfo_think(history, weak_args, strong_argument, all_misinfo, misinfo_index),
-            "SupportBot": support_think(history)
-        }
-
-        # Hand over from Participant → MisInfoBot initially
-        selected_next = None
-        if current_speaker == "Participant":
-            selected_next = "MisInfoBot"
-        elif current_speaker == "MisInfoBot":
-            selected_next = "SupportBot"
-        elif current_speaker == "SupportBot":
-            selected_next = "MisInfoBot"
-
-        # Self-selection fallback if no explicit designation
-        if not selected_next:
-            speak_candidates = [(r, imp) for r,(intent,imp) in intents.items() if intent=="speak"]
-            if speak_candidates:
-                max_imp = max(imp for _,imp in speak_candidates)
-                contenders = [r for r,imp in speak_candidates if imp==max_imp]
-                selected_next = random.choice(contenders)
-            else:
-                selected_next = current_speaker
-
-        elif selected_next == "MisInfoBot":
-            if misinfo_index >= len(weak_args):
-                continue
-            misinfo_msg = ask_gpt(
-                system=misinfo_prompt(weak_args[misinfo_index], strong_argument, all_misinfo),
-                history=history
-            )
-            print(f"\nMisInfoBot:\n{misinfo_msg}")
-            history.append(f"MisInfoBot: {misinfo_msg}")
-            
-
-        elif selected_next == "SupportBot":
-            sup_msg = ask_gpt(system=support_prompt(truth, refutation), history=history)
-            print(f"\nSupportBot:\n{sup_msg}")
-            history.append(f"SupportBot: {sup_msg}")
-
-        current_speaker = selected_next
-
-
-    return history
-
-
-def run_refutational_conversation(lesson, max_turns=20):
-    truth = lesson['truth']
-    refutation = lesson['refutation_essay']
-    weak_args = [a.strip() for a in re.split(r'<br\s*/?>', lesson['weakargument_written'].strip()) if a.strip()]
-    strong_argument = lesson['strongargument_written']
-    all_misinfo = lesson['weakargument_written'].replace('\n', ' ').strip()
-
-    history = []
-    misinfo_index = 0
-    current_speaker = None
-    conversation_ending = False
-
-    # -- First turn: Participant opens, but won't appear again --
-    msg = participant_start(truth)
-    print(f"\nParticipant:\n{msg}")
-    history.append(f"Participant: {msg}")
-    current_speaker = "Participant"
-
-    while len(history) < max_turns:
-        if misinfo_index >= len(weak_args) and not conversation_ending:
-
-            conversation_ending = True
-        intents = {
-            "MisInfoBot": misinfo_think_ref(history, weak_args, strong_argument, all_misinfo, misinfo_index),
-            "RefutationalBot": refutational_think_ref(history)
-        }
-
-        # Turn sequencing
-        selected_next = None
-        if current_speaker == "Participant":
-            selected_next = "MisInfoBot"
-        elif current_speaker == "MisInfoBot":
-            selected_next = "RefutationalBot"
-        elif current_speaker == "RefutationalBot":
-            selected_next = "MisInfoBot"
-
-        # Self-selection fallback
-        if not selected_next:
-            speak_candidates = [(r, imp) for r,(intent,imp) in intents.items() if intent=="speak"]
-            if speak_candidates:
-                max_imp = max(imp for _,imp in speak_candidates)
-                contenders = [r for r,imp in speak_candidates if imp==max_imp]
-                selected_next = random.choice(contenders)
-            else:
-                selected_next = current_speaker
-
-        # Turn production
-        if selected_next == "MisInfoBot":
-            if misinfo_index >= len(weak_args):
-                break
-            misinfo_msg = ask_gpt(system=misinfo_prompt(weak_args[misinfo_index],
-                                                        strong_argument, all_misinfo), 
-                                  history=history)
-            print(f"\nMisInfoBot:\n{misinfo_msg}")
-            history.append(f"MisInfoBot: {misinfo_msg}")
-
-        elif selected_next == "RefutationalBot":
-            current_topic = weak_args[misinfo_index - 1] if misinfo_index > 0 else None
-            ref_msg = ask_gpt(system=refutation_prompt(truth, refutation, weak_args[misinfo_index]), history=history)
-            print(f"\nRefutationalBot:\n{ref_msg}")
-            history.append(f"RefutationalBot: {ref_msg}")
-
-        current_speaker = selected_next
-   
-
-    return history
-
-
-def run_prebunking_conversation(lesson, max_turns=20):
-    truth = lesson['truth']
-    refutation = lesson['refutation_essay']
-    weak_args = [
-        a.strip()
-        for a in re.split(r'<br\s*/?>', lesson['weakargument_written'].strip())
-        if a.strip()
-    ]
-    strong_argument = lesson['strongargument_written']
-    all_misinfo = lesson['weakargument_written'].replace('\n', ' ').strip()
-
-    history = []
-    spoken_cache = []  # Track repeated messages to avoid repetition
-    misinfo_index = 0
-    conversation_ending = False
-    misinfo_started = False  # Track if misinformation has started
-    current_rebuttal_rounds = 0  
-    last_misinfo_claim = None     
-    
-    
-    # --- First turn: Participant introduces the topic ---
-    msg = participant_start(truth)
-    print(f"\nParticipant:\n{msg}")
-    history.append(f"Participant: {msg}")
-
-    # --- PrebunkingBot initial affirmation ---
-    preb_msg = ask_gpt(system=prebunk_prompt(truth, refutation), history=history)
-    print(f"\nPrebunkingBot:\n{preb_msg}")
-    history.append(f"PrebunkingBot: {preb_msg}")
-    spoken_cache.append(preb_msg.strip().lower())
-
-    current_speaker = "MisInfoBot"  # MisInfoBot goes next
-
-    while len(history) < max_turns:
-        if misinfo_index >= len(weak_args):
-            conversation_ending = True
-
-        # Decide intents
-        intents = {
-            "MisInfoBot": misinfo_think_preb(history, weak_args, strong_argument, all_misinfo, misinfo_index),
-            "PrebunkingBot": prebunking_think_preb(history, conversation_ending)
-        }
-
-        # Strict turn alternation
-        if current_speaker == "MisInfoBot":
-            selected_next = "PrebunkingBot"
-        else:
-            selected_next = "MisInfoBot"
-
-        # Prevent PrebunkingBot from speaking before misinformation started
-        if selected_next == "PrebunkingBot" and not misinfo_started:
-            # Skip PrebunkBot turn, let MisInfoBot speak first
-            selected_next = "MisInfoBot"
-
-        # Produce turn
-        if selected_next == "MisInfoBot":
-            if misinfo_index >= len(weak_args):
-                break
-            misinfo_msg = ask_gpt(
-                system=misinfo_prompt(weak_args[misinfo_index], strong_argument, all_misinfo),
-                history=history
-            )
-            misinfo_norm = misinfo_msg.strip().lower()
-            if misinfo_norm not in spoken_cache:
-                print(f"\nMisInfoBot:\n{misinfo_msg}")
-                history.append(f"MisInfoBot: {misinfo_msg}")
-                spoken_cache.append(misinfo_norm)
-                last_misinfo_claim = misinfo_msg   # NEW: store for prebunk rebuttals
-                misinfo_started = True
-                current_rebuttal_rounds = 0
-            else:
-                # If repeated message, skip index and try next misinformation
-                misinfo_index += 1
-                continue
-
-        elif selected_next == "PrebunkingBot":
-            preb_msg = ask_gpt(system=prebunk_prompt(truth, refutation,last_misinfo_claim), history=history)
-            preb_norm = preb_msg.strip().lower()
-            if preb_norm not in spoken_cache:
-                print(f"\nPrebunkingBot:\n{preb_msg}")
-                history.append(f"PrebunkingBot: {preb_msg}")
-                spoken_cache.append(preb_norm)
-                current_rebuttal_rounds += 1      
-                if current_rebuttal_rounds >= 2:  
-                    misinfo_index += 1
-                    current_rebuttal_rounds = 0
-                    spoken_cache.clear()
-            else:
-                # If repeated PrebunkBot message, produce short filler reply instead of skipping turn
-                filler_msg = "Let's carefully consider the evidence on this topic."
-                print(f"\nPrebunkingBot:\n{filler_msg}")
-                history.append(f"PrebunkingBot: {filler_msg}")
-        
-        current_speaker = selected_next
-
-    return history
+# === CONVERSATION POLICIES (run by engine.py) ===
+# Only the bots take turns after the participant's opening line. The think
+# rules read the History directly (last turn, its cached dialogue act).
+def opening_line(state):
+    return participant_start(state.lesson.truth)
+
+
+def ask_misinfo(state):
+    lesson = state.lesson
+    return misinfo_prompt(state.claim, lesson.strong_argument, lesson.all_misinfo)
+
+
+def claim_made(state, text):
+    state.last_claim = text  # for the prebunk rebuttals
+    state.ready = True  # PrebunkingBot may speak once misinformation has started
+    state.rounds = 0
+
+
+def skip_claim(state):
+    """A repeated claim: move on to the next one instead."""
+    state.misinfo_index += 1
+    return SKIP
+
+
+def rebutted(state, text):
+    state.rounds += 1
+    if state.rounds >= 2:
+        state.misinfo_index += 1
+        state.rounds = 0
+        state.spoken.clear()
+
+
+OPENING = [("Participant", Rule(text=opening_line))]
+
+SUPPORTIVE = Policy(
+    "supportive",
+    max_turns=20,
+    opening=OPENING,
+    nominate={"Participant": "MisInfoBot", "MisInfoBot": "SupportBot", "SupportBot": "MisInfoBot"},
+    think={
+        "MisInfoBot": lambda s: misinfo_think(s.history, *think_args(s)),
+        "SupportBot": lambda s: support_think(s.history),
+    },
+    ending=claims_used,
+    turns={
+        "MisInfoBot": [Rule(when=claims_used, action=SKIP), Rule(prompt=ask_misinfo)],
+        "SupportBot": Rule(prompt=lambda s: support_prompt(s.lesson.truth, s.lesson.refutation)),
+    },
+)
+
+REFUTATIONAL = Policy(
+    "refutational",
+    max_turns=20,
+    opening=OPENING,
+    nominate={"Participant": "MisInfoBot", "MisInfoBot": "RefutationalBot", "RefutationalBot": "MisInfoBot"},
+    think={
+        "MisInfoBot": lambda s: misinfo_think_ref(s.history, *think_args(s)),
+        "RefutationalBot": lambda s: refutational_think_ref(s.history),
+    },
+    ending=claims_used,
+    turns={
+        "MisInfoBot": [Rule(when=claims_used, action=STOP), Rule(prompt=ask_misinfo)],
+        "RefutationalBot": Rule(prompt=lambda s: refutation_prompt(s.lesson.truth, s.lesson.refutation, s.claim)),
+    },
+)
+
+# Strict MisInfoBot / PrebunkingBot alternation, but PrebunkingBot is held
+# back (gated) until misinformation has started
+PREBUNKING = Policy(
+    "prebunking",
+    max_turns=20,
+    opening=OPENING + [
+        ("PrebunkingBot", Rule(prompt=lambda s: prebunk_prompt(s.lesson.truth, s.lesson.refutation), dedup=True)),
+    ],
+    start="MisInfoBot",
+    gated={"MisInfoBot": "MisInfoBot", "PrebunkingBot": "MisInfoBot"},
+    nominate={"MisInfoBot": "PrebunkingBot", "PrebunkingBot": "MisInfoBot"},
+    think={
+        "MisInfoBot": lambda s: misinfo_think_preb(s.history, *think_args(s)),
+        "PrebunkingBot": lambda s: prebunking_think_preb(s.history, s.ending),
+    },
+    ending=claims_used,
+    turns={
+        "MisInfoBot": [
+            Rule(when=claims_used, action=STOP),
+            Rule(prompt=ask_misinfo, dedup=True, on_repeat=skip_claim, after=claim_made),
+        ],
+        # A repeated rebuttal is replaced by a short filler instead of skipping the turn
+        "PrebunkingBot": Rule(
+            prompt=lambda s: prebunk_prompt(s.lesson.truth, s.lesson.refutation, s.last_claim), dedup=True,
+            on_repeat=lambda s: "Let's carefully consider the evidence on this topic.", after=rebutted,
+        ),
+    },
+)
+
+
+def ask_turn(request):
+    """The engine's ask function."""
+    return ask_gpt(request.system, request.history, **request.options())
+
+
+def run_supportive_conversation(lesson, max_turns=None):
+    return run(SUPPORTIVE, lesson, ask_turn, show_turn, max_turns=max_turns).to_lines()
+
+
+def run_refutational_conversation(lesson, max_turns=None):
+    return run(REFUTATIONAL, lesson, ask_turn, show_turn, max_turns=max_turns).to_lines()
+
+
+def run_prebunking_conversation(lesson, max_turns=None):
+    return run(PREBUNKING, lesson, ask_turn, show_turn, max_turns=max_turns).to_lines()
 
 
 def run_all_modes_for_lesson(lesson, idx):
@@ -521,18 +380,26 @@ if __name__ == "__main__":
     print("3 - PrebunkingConversation (PrebunkingBot starts)")
     choice = input("Enter choice (1-3): ").strip()
     if choice == "1":
-        conversation_history = run_supportive_conversation(lessons[0])
-        filename = "conversation_supportive_no_participant.json"
+        runner, filename = run_supportive_conversation, "conversation_supportive_no_participant.json"
     elif choice == "2":
-        conversation_history = run_refutational_conversation(lessons[0])
-        filename = "conversation_refutational_no_participant.json"
+        runner, filename = run_refutational_conversation, "conversation_refutational_no_participant.json"
     elif choice == "3":
-        conversation_history = run_prebunking_conversation(lessons[0])
-        filename = "conversation_prebunking_no_participant.json"
+        runner, filename = run_prebunking_conversation, "conversation_prebunking_no_participant.json"
     else:
         print("Invalid choice")
         exit(1)
+    echo.enabled = chat.streaming  # LLM_STREAM=1 shows replies as they arrive
+    # Every reply is checkpointed; rerunning after a crash resumes where it stopped
+    checkpoint_file = os.path.join(".checkpoints", "no_participant", filename.replace(".json", ".jsonl"))
+    with Checkpoint(checkpoint_file, {"lesson_index": 0, "output": filename}) as checkpoint:
+        if checkpoint.logged:
+            print(f"Resuming after {checkpoint.logged} checkpointed calls")
+        conversation_history = runner(lessons[0])
     # --- SAVE OUTPUT TO JSON ---
     with open(filename, "w", encoding="utf-8") as f:
         json.dump(conversation_history, f, indent=2, ensure_ascii=False)
-    print(f"Conversation saved to {filename}")
\ No newline at end of file
+    checkpoint.discard()
+    print(f"Conversation saved to {filename}")
+    print(response_cache.summary())
+    print(token_usage.summary())
+    print(latency_stats.summary(breaker))
\ No newline at end of file
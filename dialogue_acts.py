@@ -0,0 +1,144 @@
+"""
+Dialogue-act classifier shared by conversation.py,
+conversation_no_participant.py and generate_vignettes.py.
+
+Each role's cue phrases are found by their literal stems and confirmed with
+one compiled regex anchored there (see Cues). Cues match whole words ("not"
+no longer matches "nothing" or "another"); common inflections are spelled
+out in the patterns. Curly apostrophes are folded to straight ones, since
+the model writes both, and the text is lowercased; folding first leaves most
+turns pure ASCII, which Python lowercases and searches faster. Results are memoized on (role, text).
+
+    python dialogue_acts.py json/          # act counts for a saved corpus
+"""
+
+import argparse
+import json
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+
+def _stem(word):
+    """The literal text every match of a cue fragment starts with ("tactics?" -> "tactic")."""
+    literal = re.match(r"[a-z' ]*", word).group(0)
+    return literal[:-1] if word[len(literal):].startswith("?") else literal
+
+
+class Cues:
+    """Whole-word cue phrases for one role, matched over lowercase text.
+
+    words are regex fragments so inflections can be spelled out
+    (r"debunk(?:s|ed|ing)?"). Each fragment's literal stem is located with
+    str.find and the regex is only run anchored there, after checking the
+    leading word boundary by hand, so a new turn costs about as much as the
+    original substring checks (an unanchored search, with or without a
+    leading \b, tries every position of the turn). punctuation characters
+    match anywhere.
+    """
+
+    def __init__(self, *words, punctuation=""):
+        self.stems = list(dict.fromkeys(_stem(word) for word in words))
+        self.pattern = re.compile(r"(?:" + "|".join(words) + r")\b")
+        self.punctuation = punctuation
+
+    def search(self, text):
+        if self.punctuation and any(p in text for p in self.punctuation):
+            return True
+        match = self.pattern.match
+        for stem in self.stems:
+            if stem not in text:
+                continue
+            start = text.find(stem)
+            while start >= 0:
+                if (start == 0 or not (text[start - 1].isalnum() or text[start - 1] == "_")) and match(text, start):
+                    return True
+                start = text.find(stem, start + 1)
+        return False
+
+
+SUPPORT_CUES = Cues(
+    r"not", r"cannot", r"incorrect(?:ly)?", r"false", r"important(?:ly)?", r"in fact",
+    r"research shows", r"evidence", r"in reality", r"actually",
+)
+PREBUNK_CUES = Cues(
+    r"tactics?", r"misinformation", r"manipulat(?:ion|ions|ive|e|es|ed|ing)", r"out of context",
+    r"debunk(?:s|ed|ing)?",
+)
+PREBUNK_NEGATIONS = Cues(r"doesn't contain misinformation", r"no misinformation")
+REFUTATION_CUES = Cues(
+    r"false claims?", r"debunk(?:s|ed|ing)?", r"disprov(?:e|es|ed|en|ing)", r"incorrect(?:ly)?",
+    r"not true", r"refut(?:e|es|ed|ing)",
+)
+QUESTION_CUES = Cues(r"could(?:n't)?", r"would(?:n't)?", r"do you think", punctuation="?")
+
+
+@lru_cache(maxsize=4096)
+def get_dialogue_act(role, text):
+    """Dialogue act of one turn."""
+    if role == "MisInfoBot":
+        return "Claim"
+    text = text.replace("’", "'").lower()
+    if role == "SupportBot":
+        return "Correction" if SUPPORT_CUES.search(text) else "Info"
+    if role == "PrebunkingBot":
+        if PREBUNK_CUES.search(text) and not PREBUNK_NEGATIONS.search(text):
+            return "Debunk"
+        return "NoAction"
+    if role == "RefutationalBot":
+        return "Refutation" if REFUTATION_CUES.search(text) else "NoAction"
+    if role == "Participant":
+        return "Reflection-Question" if QUESTION_CUES.search(text) else "Reflection"
+    return "Other"
+
+
+def split_turn(entry):
+    """(role, text) of a saved turn in either format ("Role: text" or an object)."""
+    if isinstance(entry, str):
+        role, text = entry.split(":", 1)
+        return role.strip(), text.strip()
+    return entry["role"], entry["text"]
+
+
+def classify_many(turns):
+    """Acts for an iterable of (role, text) pairs; repeated turns are classified once."""
+    return [get_dialogue_act(role, text) for role, text in turns]
+
+
+def iter_corpus(paths):
+    """Yield (path, turns) for every saved conversation under paths."""
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path) for name in names if name.endswith(".json")
+            )
+        else:
+            files = [path]
+        for file_path in files:
+            with open(file_path, "r", encoding="utf-8") as f:
+                yield file_path, [split_turn(entry) for entry in json.load(f)]
+
+
+def classify_corpus(paths):
+    """{path: [act, ...]} for every saved conversation under paths."""
+    return {path: classify_many(turns) for path, turns in iter_corpus(paths)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dialogue-act counts for saved conversations.")
+    parser.add_argument("paths", nargs="*", default=["json"], help="JSON files or directories")
+    args = parser.parse_args()
+
+    totals = Counter()
+    for path, turns in iter_corpus(args.paths):
+        counts = Counter(zip((role for role, _ in turns), classify_many(turns)))
+        totals.update(counts)
+        print(f"{path}: {len(turns)} turns")
+    for (role, act), n in sorted(totals.items()):
+        print(f"  {role:<16} {act:<20} {n}")
+
+
+if __name__ == "__main__":
+    main()
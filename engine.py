@@ -0,0 +1,307 @@
+"""
+Declarative conversation engine shared by every runner.
+
+Each condition is a Policy instead of its own while loop:
+
+- turns: per role, a list of Rules; the first whose when(state) holds says
+  how the role takes its turn (prompt, context, max_tokens, dedup, state
+  updates, or STOP/SKIP)
+- nominate: the nomination graph, current speaker -> next speaker (a role
+  or a function of the state)
+- gated / gate: the graph used while the exposure gate is closed, and the
+  condition that opens it
+- think: per-role think rules, only consulted (self-selection with the
+  tie-break RNG) when the graph has no edge for the current speaker
+- ending / stop_when / wrap_up / closing: when the conversation is marked
+  as ending, when it stops, and the final turns it closes with
+
+Policy.compile() resolves the graph into a transition table per gate state,
+so the next speaker is one dict lookup per turn and think rules are never
+evaluated unless a policy falls back to them.
+
+The engine does no I/O. conversation() is a generator that yields a Request
+for every reply it needs and is sent the reply text; run() drives it with a
+sync ask function and arun() with an async one. The sync runners and the
+async vignette generator thus share one loop, and each keeps its own
+caching, checkpointing, drafts and rate limiting around its ask function.
+
+    history = run(SUPPORTIVE, lesson, ask, show=show_turn, seed=1)
+"""
+
+import re
+
+from checkpoint import runner_rng, track_state
+from turns import History
+
+# Rule actions and turn outcomes
+STOP = "stop"  # end the conversation without speaking
+SKIP = "skip"  # give up the turn; the current speaker does not change
+END = "end"    # the turn was taken and ends the conversation
+
+
+class Lesson:
+    """The fields of a lessons.json entry that prompts are built from."""
+
+    def __init__(self, lesson):
+        self.truth = lesson["truth"]
+        self.refutation = lesson.get("refutation_essay", "")
+        written = lesson["weakargument_written"]
+        self.weak_args = [a.strip() for a in re.split(r'<br\s*/?>', written.strip()) if a.strip()]
+        self.strong_argument = lesson["strongargument_written"]
+        self.all_misinfo = written.replace('\n', ' ').strip()
+
+
+class Rule:
+    """How a role takes its turn when when(state) holds (None: always).
+
+    prompt(state) builds the system prompt of an API call; text(state) gives
+    a scripted line instead. context(state) is the history sent along
+    (default: all of it) and max_tokens None leaves the ask function's
+    default. action=STOP or SKIP takes no turn at all.
+
+    With dedup, a reply already in state.spoken is dropped, or replaced by
+    on_repeat(state), which returns a filler line, None (drop) or SKIP.
+    after(state, text) runs once the turn is in the history; end=True stops
+    the conversation after it.
+    """
+
+    def __init__(self, prompt=None, text=None, when=None, context=None, max_tokens=None,
+                 dedup=False, act=None, on_repeat=None, after=None, action=None, end=False):
+        if action is None and (prompt is None) == (text is None):
+            raise ValueError("a Rule needs exactly one of prompt, text or action")
+        self.prompt = prompt
+        self.text = text
+        self.when = when
+        self.context = context
+        self.max_tokens = max_tokens
+        self.dedup = dedup
+        self.act = act
+        self.on_repeat = on_repeat
+        self.after = after
+        self.action = action
+        self.end = end
+
+
+class Request:
+    """A reply the engine needs; ask functions turn it into an API call.
+
+    dedup requests carry the wanted dialogue act and the replies already
+    spoken, so the ask function can draft alternatives (see ask_gpt_drafts).
+    """
+
+    __slots__ = ("role", "system", "history", "max_tokens", "dedup", "act", "spoken")
+
+    def __init__(self, role, system, history, max_tokens=None, dedup=False, act=None, spoken=()):
+        self.role = role
+        self.system = system
+        self.history = history
+        self.max_tokens = max_tokens
+        self.dedup = dedup
+        self.act = act
+        self.spoken = spoken
+
+    def options(self):
+        """Keyword arguments for the ask function."""
+        return {} if self.max_tokens is None else {"max_tokens": self.max_tokens}
+
+
+class Policy:
+    def __init__(self, name, turns, nominate, max_turns=15, opening=(), start="Participant",
+                 think=None, gated=None, gate=None, ending=None, stop_when=None, wrap_up=None,
+                 closing=None):
+        self.name = name
+        self.turns = turns
+        self.nominate = nominate
+        self.max_turns = max_turns
+        self.opening = list(opening)
+        self.start = start
+        self.think = think or {}
+        self.gated = gated
+        self.gate = gate
+        self.ending = ending
+        self.stop_when = stop_when
+        self.wrap_up = wrap_up
+        self.closing = closing
+        self.compile()
+
+    def compile(self):
+        """Build the transition tables and per-role rule lists, checking every nominee has rules."""
+        self.rules = {role: tuple(rules) if isinstance(rules, (list, tuple)) else (rules,)
+                      for role, rules in self.turns.items()}
+        graphs = [self.nominate] + ([self.gated] if self.gated is not None else [])
+        for role in (role for graph in graphs for role in graph.values()):
+            if not callable(role) and role not in self.rules:
+                raise ValueError(f"{self.name} policy: no rules for {role}")
+        # table[gate open] -> {current speaker: next speaker or function of the state}
+        open_table = dict(self.nominate)
+        self.table = {True: open_table, False: dict(self.gated) if self.gated is not None else open_table}
+        return self
+
+
+class State:
+    """Everything a policy's rules read and update during one conversation."""
+
+    def __init__(self, lesson, rng, max_turns):
+        self.lesson = lesson
+        self.rng = rng
+        self.max_turns = max_turns
+        self.history = History()
+        self.current = None
+        self.misinfo_index = 0
+        self.defense_index = 0
+        self.rounds = 0
+        self.last_claim = None
+        self.spoken = []
+        self.ending = False
+        self.ready = False  # exposure gate open
+
+    @property
+    def claim(self):
+        return self.lesson.weak_args[self.misinfo_index]
+
+    def snapshot(self):
+        return {
+            "turns": len(self.history), "current_speaker": self.current, "misinfo_index": self.misinfo_index,
+            "defense_index": self.defense_index, "rounds": self.rounds, "ending": self.ending,
+            "ready": self.ready, "spoken_cache": self.spoken, "last_claim": self.last_claim,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Rule helpers shared by the policies
+# ---------------------------------------------------------------------------
+
+def claims_used(state):
+    return state.misinfo_index >= len(state.lesson.weak_args)
+
+
+def is_ending(state):
+    return state.ending
+
+
+def next_claim(state, text):
+    state.misinfo_index += 1
+
+
+def think_args(state):
+    """The (weak_args, strong_argument, all_misinfo, misinfo_index) a misinfo think rule takes."""
+    lesson = state.lesson
+    return lesson.weak_args, lesson.strong_argument, lesson.all_misinfo, state.misinfo_index
+
+
+# ---------------------------------------------------------------------------
+# The engine
+# ---------------------------------------------------------------------------
+
+def _rule(policy, role, state):
+    for rule in policy.rules[role]:
+        if rule.when is None or rule.when(state):
+            return rule
+    raise ValueError(f"{policy.name} policy: no rule for {role} applies")
+
+
+def _self_select(policy, state):
+    """No edge in the graph: the most urgent speaker (ties broken by the RNG), else the current one."""
+    speak = [(role, urgency) for role, think in policy.think.items()
+             for intent, urgency in [think(state)] if intent == "speak"]
+    if not speak:
+        return state.current
+    top = max(urgency for _, urgency in speak)
+    return state.rng.choice([role for role, urgency in speak if urgency == top])
+
+
+def _take(state, role, rule, show):
+    """Produce role's turn by rule (a generator: yields its Request); returns the outcome."""
+    if rule.action is not None:
+        return rule.action
+    if rule.text is not None:
+        text = rule.text(state)
+    else:
+        context = rule.context(state) if rule.context is not None else state.history
+        text = yield Request(role, rule.prompt(state), context, rule.max_tokens, rule.dedup, rule.act,
+                             state.spoken)
+    if rule.dedup:
+        norm = text.strip().lower()
+        if norm in state.spoken:
+            filler = rule.on_repeat(state) if rule.on_repeat is not None else None
+            if filler is None or filler == SKIP:
+                return filler
+            if show is not None:
+                show(role, filler)
+            state.history.append(role, filler)
+            return None
+        state.spoken.append(norm)
+    if show is not None:
+        show(role, text)
+    state.history.append(role, text)
+    if rule.after is not None:
+        rule.after(state, text)
+    return END if rule.end else None
+
+
+def conversation(policy, lesson, seed=None, show=None, max_turns=None):
+    """Generator running one conversation: yields Requests, is sent reply texts, returns the History."""
+    state = State(Lesson(lesson), runner_rng(seed), max_turns or policy.max_turns)
+    track_state(state.snapshot)
+    for role, rule in policy.opening:
+        yield from _take(state, role, rule, show)
+    state.current = policy.start
+
+    while len(state.history) < state.max_turns:
+        if policy.ending is not None and not state.ending:
+            state.ending = policy.ending(state)
+        if policy.stop_when is not None and policy.stop_when(state):
+            break
+
+        # Nomination: the table for the gate as it stood when the turn began
+        edges = policy.table[state.ready]
+        if not state.ready and policy.gate is not None and policy.gate(state):
+            state.ready = True
+        selected = edges.get(state.current)
+        if callable(selected):
+            selected = selected(state)
+        if selected is None:
+            selected = _self_select(policy, state)
+
+        outcome = yield from _take(state, selected, _rule(policy, selected, state), show)
+        if outcome == SKIP:
+            continue
+        if outcome == STOP:
+            break
+        state.current = selected
+        if outcome == END:
+            break
+        if policy.wrap_up is not None:
+            role, rule = policy.wrap_up
+            if rule.when(state):
+                yield from _take(state, role, rule, show)
+                break
+
+    if policy.closing is not None:
+        role, rule = policy.closing
+        yield from _take(state, role, rule, show)
+    return state.history
+
+
+def run(policy, lesson, ask, show=None, seed=None, max_turns=None):
+    """Run a conversation, answering each Request with ask(request) -> reply text."""
+    steps = conversation(policy, lesson, seed, show, max_turns)
+    reply = None
+    while True:
+        try:
+            request = steps.send(reply)
+        except StopIteration as done:
+            return done.value
+        reply = ask(request)
+
+
+async def arun(policy, lesson, ask, show=None, seed=None, max_turns=None):
+    """run() with an async ask function."""
+    steps = conversation(policy, lesson, seed, show, max_turns)
+    reply = None
+    while True:
+        try:
+            request = steps.send(reply)
+        except StopIteration as done:
+            return done.value
+        reply = await ask(request)
@@ -3,80 +3,122 @@ Generate missing conversation vignettes for the study:
 - 3 control vignettes (MisInfoBot alone, no defense bot)
 - 3 combined vignettes (MisInfoBot vs all 3 defense bots together)
 
-Uses OpenRouter API with openai/gpt-4o-mini model.
+Uses OpenRouter API with openai/gpt-4o-mini model. All vignettes are generated
+concurrently on one asyncio event loop; turns within a conversation stay
+sequential. Set OPENROUTER_BASE_URL to point at another OpenAI-compatible
+server (e.g. mock_openai_server.py).
 """
 
+import argparse
+import asyncio
 import json
 import os
-import re
-import random
+import time
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+from checkpoint import Checkpoint, acheckpointed
+from context import build_messages, token_usage, usage_label
+from engine import STOP, Policy, Rule, arun, claims_used, next_claim
+from llm_cache import cache_key, response_cache
+from llm_client import AsyncResilientChat, breaker, echo, latency_stats
+from turns import Role
 
 load_dotenv()
 
-client = OpenAI(
+client = AsyncOpenAI(
     api_key=os.getenv("OPENROUTER_API_KEY"),
-    base_url="https://openrouter.ai/api/v1",
+    base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
 )
 
 MODEL = "openai/gpt-4o-mini"
 
+# Defaults for the request limiter (override with --concurrency / --rate)
+MAX_CONCURRENT_REQUESTS = 6
+REQUESTS_PER_SECOND = 5.0
+
+# Per-vignette reply logs; a rerun resumes from them (see checkpoint.py)
+CHECKPOINT_DIR = os.path.join(".checkpoints", "vignettes")
+
+
+# ─── Request limiting ────────────────────────────────────────────────────────
+
+class RequestLimiter:
+    """
+    Bounds in-flight API calls with a semaphore and paces new ones with a
+    token bucket (`rate` requests per second, bursts of up to `burst`).
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, rate=REQUESTS_PER_SECOND, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, max_concurrent)
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def _take_token(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+limiter = RequestLimiter()
+# Retries, deadlines and the circuit breaker; each attempt goes through the limiter
+chat = AsyncResilientChat(client, limiter=limiter)
+
 
 # ─── Helper functions (adapted from conversation_no_participant.py) ───────────
 
-def get_dialogue_act(role, text):
-    ltext = text.lower()
-    if role == "MisInfoBot":
-        return "Claim"
-    elif role == "SupportBot":
-        if any(word in ltext for word in [
-            "not", "incorrect", "false", "important", "in fact",
-            "research shows", "evidence", "in reality", "actually"
-        ]):
-            return "Correction"
-        return "Info"
-    elif role == "PrebunkingBot":
-        if "tactic" in ltext or any(x in ltext for x in [
-            "misinformation", "manipulation", "out of context", "debunk"
-        ]):
-            if "doesn't contain misinformation" in ltext or "no misinformation" in ltext:
-                return "NoAction"
-            return "Debunk"
-        return "NoAction"
-    elif role == "RefutationalBot":
-        if any(phrase in ltext for phrase in [
-            "false claim", "debunk", "disprove", "incorrect", "not true", "refute"
-        ]):
-            return "Refutation"
-        return "NoAction"
-    elif role == "Participant":
-        if any(q in ltext for q in ["?", "could", "would", "do you think"]):
-            return "Reflection-Question"
-        return "Reflection"
-    return "Other"
-
-
-def ask_gpt(system, history=None, max_tokens=180):
-    messages = [{"role": "system", "content": system}]
+async def ask_gpt(system, history=None, max_tokens=180, seed=None):
+    turns = []
     if history:
-        for turn in history[-6:]:
-            if turn.startswith("Participant:"):
-                messages.append({"role": "user", "content": turn[len("Participant:"):].strip()})
-            else:
-                idx = turn.find(":")
-                if idx != -1:
-                    content = turn[idx + 1:].strip()
-                    messages.append({"role": "assistant", "content": content})
-
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=messages,
-        temperature=0.7,
-        max_tokens=max_tokens,
-    )
-    return response.choices[0].message.content.strip()
+        for turn in history[-6:]:  # history: previous Turns
+            role = "user" if turn.role is Role.PARTICIPANT else "assistant"
+            turns.append({"role": role, "content": turn.text.strip()})
+    messages = build_messages(system, turns)
+    usage = None
+
+    async def fetch():
+        nonlocal usage
+        text, usage = await chat.reply(
+            key,
+            model=MODEL,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens,
+            **({"seed": seed} if seed is not None else {}),
+        )
+        return text
+
+    key = cache_key(MODEL, messages, 0.7, max_tokens, seed)
+    reply = await acheckpointed(key, lambda: response_cache.acomplete(key, fetch))
+    token_usage.record(messages, reply, usage)
+    return reply
+
+
+def show_turn(label, role, text):
+    if not echo.shown(text):  # streamed replies are already on screen
+        print(f"  [{label}] {role}: {text[:80]}...")
 
 
 # ─── Prompt templates (verbatim from conversation_no_participant.py) ──────────
@@ -194,146 +236,9 @@ def naive_participant_prompt(truth):
             """
 
 
-# ─── Control conversation (MisInfoBot alone, naive participant) ──────────────
+# ─── Conversation policies (run by engine.py) ───────────────────────────────
 
-def run_control_conversation(lesson, max_turns=12):
-    """
-    Control condition: Participant starts, then MisInfoBot presents misinformation
-    claims one by one. The naive participant asks follow-up questions but never
-    counters the misinformation. No defense bots are present.
-    """
-    truth = lesson['truth']
-    weak_args = [
-        a.strip()
-        for a in re.split(r'<br\s*/?>', lesson['weakargument_written'].strip())
-        if a.strip()
-    ]
-    strong_argument = lesson['strongargument_written']
-    all_misinfo = lesson['weakargument_written'].replace('\n', ' ').strip()
-
-    history = []
-    misinfo_index = 0
-
-    # Participant opens
-    msg = participant_start(truth)
-    print(f"  Participant: {msg[:80]}...")
-    history.append(f"Participant: {msg}")
-
-    current_speaker = "MisInfoBot"
-
-    while len(history) < max_turns:
-        if current_speaker == "MisInfoBot":
-            if misinfo_index >= len(weak_args):
-                break
-            misinfo_msg = ask_gpt(
-                system=misinfo_prompt(weak_args[misinfo_index], strong_argument, all_misinfo),
-                history=history,
-            )
-            print(f"  MisInfoBot: {misinfo_msg[:80]}...")
-            history.append(f"MisInfoBot: {misinfo_msg}")
-            misinfo_index += 1
-            current_speaker = "Participant"
-
-        elif current_speaker == "Participant":
-            participant_msg = ask_gpt(
-                system=naive_participant_prompt(truth),
-                history=history,
-                max_tokens=120,
-            )
-            print(f"  Participant: {participant_msg[:80]}...")
-            history.append(f"Participant: {participant_msg}")
-            current_speaker = "MisInfoBot"
-
-    return history
-
-
-# ─── Combined conversation (all 3 defense bots rotate) ──────────────────────
-
-def run_combined_conversation(lesson, max_turns=24):
-    """
-    Combined condition: Participant starts, MisInfoBot makes claims, and the
-    three defense bots rotate responding (one per claim):
-      Claim 1 -> SupportBot
-      Claim 2 -> RefutationalBot
-      Claim 3 -> PrebunkingBot
-      Claim 4 -> SupportBot (cycle)
-    """
-    truth = lesson['truth']
-    refutation = lesson['refutation_essay']
-    weak_args = [
-        a.strip()
-        for a in re.split(r'<br\s*/?>', lesson['weakargument_written'].strip())
-        if a.strip()
-    ]
-    strong_argument = lesson['strongargument_written']
-    all_misinfo = lesson['weakargument_written'].replace('\n', ' ').strip()
-
-    defense_bot_order = ["SupportBot", "RefutationalBot", "PrebunkingBot"]
-    defense_index = 0
-
-    history = []
-    misinfo_index = 0
-
-    # Participant opens
-    msg = participant_start(truth)
-    print(f"  Participant: {msg[:80]}...")
-    history.append(f"Participant: {msg}")
-
-    current_speaker = "MisInfoBot"
-
-    while len(history) < max_turns:
-        if current_speaker == "MisInfoBot":
-            if misinfo_index >= len(weak_args):
-                break
-            misinfo_msg = ask_gpt(
-                system=misinfo_prompt(weak_args[misinfo_index], strong_argument, all_misinfo),
-                history=history,
-            )
-            print(f"  MisInfoBot: {misinfo_msg[:80]}...")
-            history.append(f"MisInfoBot: {misinfo_msg}")
-
-            # Next: the rotating defense bot
-            current_speaker = defense_bot_order[defense_index % len(defense_bot_order)]
-
-        elif current_speaker == "SupportBot":
-            sup_msg = ask_gpt(
-                system=support_prompt(truth, refutation),
-                history=history,
-            )
-            print(f"  SupportBot: {sup_msg[:80]}...")
-            history.append(f"SupportBot: {sup_msg}")
-            defense_index += 1
-            misinfo_index += 1
-            current_speaker = "Participant"
-
-        elif current_speaker == "RefutationalBot":
-            last_misinfo_claim = weak_args[misinfo_index] if misinfo_index < len(weak_args) else ""
-            ref_msg = ask_gpt(
-                system=refutation_prompt(truth, refutation, last_misinfo_claim),
-                history=history,
-            )
-            print(f"  RefutationalBot: {ref_msg[:80]}...")
-            history.append(f"RefutationalBot: {ref_msg}")
-            defense_index += 1
-            misinfo_index += 1
-            current_speaker = "Participant"
-
-        elif current_speaker == "PrebunkingBot":
-            last_misinfo_claim = weak_args[misinfo_index] if misinfo_index < len(weak_args) else ""
-            preb_msg = ask_gpt(
-                system=prebunk_prompt(truth, refutation, last_misinfo_claim),
-                history=history,
-            )
-            print(f"  PrebunkingBot: {preb_msg[:80]}...")
-            history.append(f"PrebunkingBot: {preb_msg}")
-            defense_index += 1
-            misinfo_index += 1
-            current_speaker = "Participant"
-
-        elif current_speaker == "Participant":
-            # Participant reflects briefly after defense bot, then MisInfoBot goes next
-            participant_msg = ask_gpt(
-                system=f"""You are a participant in a group chat about binge drinking.
+REFLECT_PROMPT = """You are a participant in a group chat about binge drinking.
                 You've just heard a correction from one of the bots. Respond briefly with
                 a reflective comment or question. Show you are processing the information.
 
@@ -341,31 +246,182 @@ def run_combined_conversation(lesson, max_turns=24):
                 - Max 40 words
                 - Tone: Thoughtful, engaged
                 - Vary sentence starters naturally.
-                """,
-                history=history,
-                max_tokens=120,
-            )
-            print(f"  Participant: {participant_msg[:80]}...")
-            history.append(f"Participant: {participant_msg}")
-            current_speaker = "MisInfoBot"
-
-    # Final participant wrap-up
-    closing_msg = ask_gpt(
-        system="""You are a participant wrapping up a group chat about binge drinking.
+                """
+
+CLOSING_PROMPT = """You are a participant wrapping up a group chat about binge drinking.
         Summarize your takeaway in one brief sentence. Be reflective and thankful.
-        Max 30 words.""",
-        history=history,
-        max_tokens=80,
-    )
-    print(f"  Participant: {closing_msg[:80]}...")
-    history.append(f"Participant: {closing_msg}")
+        Max 30 words."""
+
+
+def opening_line(state):
+    return participant_start(state.lesson.truth)
+
+
+def ask_misinfo(state):
+    lesson = state.lesson
+    return misinfo_prompt(state.claim, lesson.strong_argument, lesson.all_misinfo)
 
-    return history
+
+def current_claim(state):
+    return state.claim if state.misinfo_index < len(state.lesson.weak_args) else ""
+
+
+def defended(state, text):
+    """One defense reply per claim: rotate to the next bot and the next claim."""
+    state.defense_index += 1
+    state.misinfo_index += 1
+
+
+OPENING = [("Participant", Rule(text=opening_line))]
+
+# Control: MisInfoBot presents its claims one by one to a naive participant,
+# who asks follow-up questions but never counters them. No defense bots.
+CONTROL = Policy(
+    "control",
+    max_turns=12,
+    opening=OPENING,
+    nominate={"Participant": "MisInfoBot", "MisInfoBot": "Participant"},
+    turns={
+        "MisInfoBot": [Rule(when=claims_used, action=STOP), Rule(prompt=ask_misinfo, after=next_claim)],
+        "Participant": Rule(prompt=lambda s: naive_participant_prompt(s.lesson.truth), max_tokens=120),
+    },
+)
+
+# Combined: the three defense bots rotate, one per claim
+#   Claim 1 -> SupportBot, 2 -> RefutationalBot, 3 -> PrebunkingBot, 4 -> SupportBot, ...
+DEFENSE_BOT_ORDER = ["SupportBot", "RefutationalBot", "PrebunkingBot"]
+
+COMBINED = Policy(
+    "combined",
+    max_turns=24,
+    opening=OPENING,
+    nominate={
+        "Participant": "MisInfoBot",
+        "MisInfoBot": lambda s: DEFENSE_BOT_ORDER[s.defense_index % len(DEFENSE_BOT_ORDER)],
+        "SupportBot": "Participant",
+        "RefutationalBot": "Participant",
+        "PrebunkingBot": "Participant",
+    },
+    turns={
+        "MisInfoBot": [Rule(when=claims_used, action=STOP), Rule(prompt=ask_misinfo)],
+        "SupportBot": Rule(prompt=lambda s: support_prompt(s.lesson.truth, s.lesson.refutation), after=defended),
+        "RefutationalBot": Rule(
+            prompt=lambda s: refutation_prompt(s.lesson.truth, s.lesson.refutation, current_claim(s)), after=defended),
+        "PrebunkingBot": Rule(
+            prompt=lambda s: prebunk_prompt(s.lesson.truth, s.lesson.refutation, current_claim(s)), after=defended),
+        # Participant reflects briefly after the defense bot, then MisInfoBot goes next
+        "Participant": Rule(prompt=lambda s: REFLECT_PROMPT, max_tokens=120),
+    },
+    closing=("Participant", Rule(prompt=lambda s: CLOSING_PROMPT, max_tokens=80)),
+)
+
+
+def ask_turn(seed=None):
+    """The engine's ask function."""
+    async def ask(request):
+        return await ask_gpt(request.system, request.history, seed=seed, **request.options())
+    return ask
+
+
+async def run_policy(policy, lesson, max_turns=None, label=None, seed=None):
+    label = label or policy.name
+    history = await arun(policy, lesson, ask_turn(seed), lambda role, text: show_turn(label, role, text),
+                         seed, max_turns)
+    return history.to_lines()
+
+
+async def run_control_conversation(lesson, max_turns=None, label="control", seed=None):
+    return await run_policy(CONTROL, lesson, max_turns, label, seed)
+
+
+async def run_combined_conversation(lesson, max_turns=None, label="combined", seed=None):
+    return await run_policy(COMBINED, lesson, max_turns, label, seed)
 
 
 # ─── Main ────────────────────────────────────────────────────────────────────
 
+RUNNERS = {
+    "control": (run_control_conversation, CONTROL.max_turns),
+    "combined": (run_combined_conversation, COMBINED.max_turns),
+}
+
+
+async def generate_vignette(lesson, condition, index, out_dir, checkpoint_dir=CHECKPOINT_DIR):
+    """Generate and save one vignette; return the seconds it took.
+
+    Replies are checkpointed as they arrive, so rerunning after a failure
+    resumes the vignette instead of starting it over.
+    """
+    runner, max_turns = RUNNERS[condition]
+    label = f"{condition}{index}"
+    usage_label.set(label)  # each gathered task has its own context
+    start = time.perf_counter()
+    checkpoint_path = os.path.join(checkpoint_dir, f"vignette_{label}.jsonl")
+    with Checkpoint(checkpoint_path, {"condition": condition, "index": index}) as checkpoint:
+        if checkpoint.logged:
+            print(f"  [{label}] resuming after {checkpoint.logged} checkpointed calls")
+        # The index doubles as the sampling seed: replicates stay distinct from each
+        # other (and in the response cache) but each one is reproducible
+        history = await runner(lesson, max_turns=max_turns, label=label, seed=index)
+    elapsed = time.perf_counter() - start
+    out_path = os.path.join(out_dir, condition, f"conversation_{condition}{index}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=2, ensure_ascii=False)
+    checkpoint.discard()
+    print(f"  -> [{label}] Saved to {out_path} ({len(history)} turns, {elapsed:.1f}s)")
+    return elapsed
+
+
+async def generate_all(lesson, conditions, count, out_dir, checkpoint_dir=CHECKPOINT_DIR):
+    jobs = [(condition, i) for condition in conditions for i in range(1, count + 1)]
+    print(f"Generating {len(jobs)} conversations concurrently...")
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(generate_vignette(lesson, condition, i, out_dir, checkpoint_dir) for condition, i in jobs),
+        return_exceptions=True,
+    )
+    wall = time.perf_counter() - start
+
+    failures = [(job, r) for job, r in zip(jobs, results) if isinstance(r, BaseException)]
+    durations = [r for r in results if not isinstance(r, BaseException)]
+    for (condition, i), error in failures:
+        print(f"  !! {condition}{i} failed: {error!r}")
+
+    print(f"\n{'='*60}")
+    print(f"{len(durations)}/{len(jobs)} conversations generated in {wall:.1f}s wall-clock")
+    if durations:
+        serial = sum(durations)
+        print(f"Sum of per-conversation times (serial estimate): {serial:.1f}s -> speedup {serial / wall:.1f}x")
+    print(response_cache.summary())
+    print(token_usage.summary())
+    print(latency_stats.summary(breaker))
+    print(f"{'='*60}")
+    return not failures
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Generate control and combined vignettes.")
+    parser.add_argument("--conditions", nargs="+", choices=sorted(RUNNERS), default=["control", "combined"])
+    parser.add_argument("--count", type=int, default=3, help="vignettes per condition")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_REQUESTS,
+                        help="maximum API calls in flight")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help="maximum new API calls per second")
+    parser.add_argument("--out-dir", help="where to write <condition>/conversation_<condition><n>.json "
+                                          "(default: json/ next to this script)")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR,
+                        help="per-vignette checkpoints; an interrupted run resumes from them")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream replies, recording time to first token and tokens/sec "
+                             "(echoed to the console with --concurrency 1)")
+    args = parser.parse_args()
+
+    global limiter
+    limiter = RequestLimiter(args.concurrency, args.rate)
+    chat.limiter = limiter
+    chat.streaming = chat.streaming or args.stream
+    echo.enabled = chat.streaming and args.concurrency == 1
+
     # Load lesson data
     script_dir = os.path.dirname(os.path.abspath(__file__))
     lessons_path = os.path.join(script_dir, "lessons.json")
@@ -376,36 +432,13 @@ def main():
     lesson = lessons[0]
 
     # Ensure output directories exist
-    control_dir = os.path.join(script_dir, "json", "control")
-    combined_dir = os.path.join(script_dir, "json", "combined")
-    os.makedirs(control_dir, exist_ok=True)
-    os.makedirs(combined_dir, exist_ok=True)
-
-    # Generate 3 control conversations
-    for i in range(1, 4):
-        print(f"\n{'='*60}")
-        print(f"Generating CONTROL conversation {i}/3...")
-        print(f"{'='*60}")
-        history = run_control_conversation(lesson, max_turns=12)
-        out_path = os.path.join(control_dir, f"conversation_control{i}.json")
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
-        print(f"  -> Saved to {out_path} ({len(history)} turns)")
-
-    # Generate 3 combined conversations
-    for i in range(1, 4):
-        print(f"\n{'='*60}")
-        print(f"Generating COMBINED conversation {i}/3...")
-        print(f"{'='*60}")
-        history = run_combined_conversation(lesson, max_turns=24)
-        out_path = os.path.join(combined_dir, f"conversation_combined{i}.json")
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
-        print(f"  -> Saved to {out_path} ({len(history)} turns)")
+    out_dir = args.out_dir or os.path.join(script_dir, "json")
+    for condition in args.conditions:
+        os.makedirs(os.path.join(out_dir, condition), exist_ok=True)
 
-    print(f"\n{'='*60}")
-    print("All 6 conversations generated successfully!")
-    print(f"{'='*60}")
+    ok = asyncio.run(generate_all(lesson, args.conditions, args.count, out_dir, args.checkpoint_dir))
+    if not ok:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
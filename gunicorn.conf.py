@@ -0,0 +1,66 @@
+"""
+Gunicorn settings for the study app (used by the Dockerfile):
+
+    gunicorn -c gunicorn.conf.py
+
+The master sets up the schema once (on_starting) and, with preload_app,
+builds the app once; workers fork with its vignettes, templates and
+conversation pages already in memory. GUNICORN_PRELOAD=0 makes every
+worker build its own app instead (for comparison, see bench.py boot).
+SERVER_MODE=asgi runs uvicorn workers instead of sync ones (see asgi.py).
+
+The log reports how long the app took to build, how long each worker took
+from fork to ready, and each worker's first request.
+"""
+
+import os
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 3001)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+timeout = 120
+wsgi_app = "app:create_app(init_schema=False)"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# SERVER_MODE=asgi serves the same routes through asgi.py on uvicorn workers
+if os.environ.get("SERVER_MODE", "wsgi") == "asgi":
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "asgi:create_app(init_schema=False)"
+
+
+def on_starting(server):
+    from app import init_db
+
+    start = time.perf_counter()
+    init_db()
+    server.log.info("Schema ready in %.0f ms", (time.perf_counter() - start) * 1000)
+
+
+def when_ready(server):
+    if preload_app:
+        from app import startup_timings
+
+        steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup_timings.items())
+        server.log.info("App preloaded: %s", steps)
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+    worker.first_request_at = None
+    worker.first_request_logged = False
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s ready %.0f ms after fork", worker.pid, (time.perf_counter() - worker.forked_at) * 1000)
+
+
+def pre_request(worker, req):
+    if worker.first_request_at is None:
+        worker.first_request_at = time.perf_counter()
+
+
+def post_request(worker, req, environ, resp):
+    if not worker.first_request_logged:
+        worker.first_request_logged = True
+        worker.log.info("Worker %s first request %s took %.1f ms", worker.pid, req.path,
+                        (time.perf_counter() - worker.first_request_at) * 1000)
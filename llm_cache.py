@@ -0,0 +1,138 @@
+"""
+Persistent, content-addressed cache of chat completions.
+
+Shared by conversation.py, conversation_no_participant.py and
+generate_vignettes.py so that re-running (or resuming after a crash) does not
+pay for calls that already completed. Entries are keyed on a SHA-256 of
+(model, messages, temperature, max_tokens, seed), stored in a small SQLite
+file and evicted least-recently-used once the cache grows past
+LLM_CACHE_MAX_BYTES.
+
+LLM_CACHE_MODE selects the behaviour:
+  on      use cached replies, call the API on a miss (default)
+  off     always call the API, never read or write the cache
+  replay  never call the API; a miss raises CacheMiss
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.db"),
+)
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+CACHE_MODE = os.getenv("LLM_CACHE_MODE", "on")
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode when a request has no cached reply."""
+
+
+def cache_key(model, messages, temperature, max_tokens, seed=None, draft=0):
+    """draft numbers the alternative replies of a speculative turn (0 is the ordinary request)."""
+    fields = [model, messages, temperature, max_tokens, seed] + ([draft] if draft else [])
+    payload = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, mode=CACHE_MODE):
+        if mode not in ("on", "off", "replay"):
+            raise ValueError(f"LLM_CACHE_MODE must be on, off or replay, not {mode!r}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions (last_used)")
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        """Store a reply and return the canonical one for key.
+
+        If an identical request was stored first (e.g. by a concurrent
+        conversation), that reply wins, so replays see what was recorded.
+        """
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            db = self._db()
+            existing = db.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if existing is not None:
+                return existing[0]
+            db.execute(
+                "INSERT INTO completions (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                oldest = db.execute(
+                    "SELECT key, size FROM completions ORDER BY last_used LIMIT 1"
+                ).fetchone()
+                if oldest is None or oldest[0] == key:
+                    break
+                db.execute("DELETE FROM completions WHERE key = ?", (oldest[0],))
+                self._total_bytes -= oldest[1]
+        return response
+
+    def complete(self, key, fetch):
+        """Return the cached reply for key, or call fetch() and cache its result."""
+        if self.mode == "off":
+            return fetch()
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        if self.mode == "replay":
+            raise CacheMiss(f"no cached reply for request {key[:12]} (LLM_CACHE_MODE=replay)")
+        return self.put(key, fetch())
+
+    async def acomplete(self, key, fetch):
+        """Async variant of complete(); fetch is a coroutine function."""
+        if self.mode == "off":
+            return await fetch()
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        if self.mode == "replay":
+            raise CacheMiss(f"no cached reply for request {key[:12]} (LLM_CACHE_MODE=replay)")
+        return self.put(key, await fetch())
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = f"{100 * self.hits / total:.0f}%" if total else "n/a"
+        return f"Response cache ({self.mode}): {self.hits} hits, {self.misses} misses, hit rate {rate}"
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,514 @@
+"""
+Retrying wrapper around the OpenAI chat-completions client.
+
+Shared by conversation.py, conversation_no_participant.py and
+generate_vignettes.py so that one 429 or timeout no longer kills a batch:
+
+- transient failures (timeouts, connection errors, 408/409/429/5xx) are
+  retried with full-jitter exponential backoff, or after the server's
+  Retry-After when it sends one;
+- each attempt gets a timeout and each call an overall deadline, after
+  which DeadlineExceeded is raised;
+- a circuit breaker shared by all workers opens after LLM_BREAKER_THRESHOLD
+  consecutive transient failures and pauses every caller for
+  LLM_BREAKER_COOLDOWN seconds; then a single probe call decides whether
+  it closes again.
+
+Other errors (400, 401, ...) are raised at once. latency_stats records the
+end-to-end latency of every call (retries included) per speaker and
+prints p50/p95/p99 at the end of a run.
+
+Streaming is opt-in (LLM_STREAM=1 or the generators' --stream). Replies
+then arrive as text deltas, which are echoed to the console (when only one
+conversation runs at a time) and appended to the checkpoint, and
+time-to-first-token and tokens/sec are recorded per speaker.
+
+    LLM_MAX_ATTEMPTS       attempts per call (default 6)
+    LLM_ATTEMPT_TIMEOUT    seconds per attempt (default 60)
+    LLM_CALL_DEADLINE      seconds per call, all attempts and waits (default 180)
+    LLM_BREAKER_THRESHOLD  consecutive failures that open the breaker (default 5)
+    LLM_BREAKER_COOLDOWN   seconds the breaker stays open (default 30)
+    LLM_STREAM             1 to stream replies (default off)
+"""
+
+import asyncio
+import contextlib
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import openai
+
+from checkpoint import log_delta
+from context import speaker_of, usage_label
+
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 6))
+ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", 60))
+CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", 180))
+BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+STREAM = os.getenv("LLM_STREAM", "") == "1"
+
+RETRY_STATUSES = (408, 409, 429)
+
+
+class DeadlineExceeded(TimeoutError):
+    """A call could not complete (or wait for its next attempt) within its deadline."""
+
+
+def is_transient(exc):
+    if isinstance(exc, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in RETRY_STATUSES or exc.status_code >= 500
+    return False
+
+
+def retry_after(exc):
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), or None."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            when = parsedate_to_datetime(value)
+            return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=MAX_ATTEMPTS, attempt_timeout=ATTEMPT_TIMEOUT, deadline=CALL_DEADLINE,
+                 base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max_attempts
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = random.Random()  # never touches the runners' random state
+
+    def backoff(self, attempt):
+        """Full jitter: uniform in [0, min(max_delay, base_delay * 2**attempt)]."""
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker shared by every worker (threads or tasks).
+
+    closed     calls go through
+    open       every caller waits until the cooldown has passed
+    half-open  one probe call goes through; the rest poll until it returns
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, poll=0.5):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.poll = poll
+        self.failures = 0
+        self.trips = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half-open"
+
+    def wait_time(self):
+        """Seconds to wait before calling; 0 means go ahead."""
+        with self._lock:
+            if self.failures < self.threshold:
+                return 0.0
+            remaining = self._open_until - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._probing:
+                return self.poll
+            self._probing = True
+            return 0.0
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """A probe was abandoned (cancelled or interrupted) without an answer."""
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            now = time.monotonic()
+            if self.failures >= self.threshold and now >= self._open_until:
+                self._open_until = now + self.cooldown
+                self.trips += 1
+
+
+def quantiles(values, qs=(0.5, 0.95, 0.99)):
+    values = sorted(values)
+    return [values[min(len(values) - 1, int(len(values) * q))] for q in qs] if values else [0.0] * len(qs)
+
+
+class LatencyStats:
+    """End-to-end call latency (retries included) per speaker.
+
+    Streamed calls also record time to first token (from the start of the
+    attempt that succeeded) and tokens/sec after it.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.retries = defaultdict(int)
+        self.failed = defaultdict(int)
+        self.ttft = defaultdict(list)
+        self.rates = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, role, seconds):
+        with self._lock:
+            self.samples[role].append(seconds)
+
+    def stream(self, role, ttft, tokens, seconds):
+        with self._lock:
+            self.ttft[role].append(ttft)
+            if seconds > 0:
+                self.rates[role].append(tokens / seconds)
+
+    def retry(self, role):
+        with self._lock:
+            self.retries[role] += 1
+
+    def fail(self, role):
+        with self._lock:
+            self.failed[role] += 1
+
+    def summary(self, breaker=None):
+        lines = ["API latency per speaker (seconds, retries included):"]
+        for role in sorted(set(self.samples) | set(self.failed)):
+            calls = len(self.samples[role])
+            p50, p95, p99 = quantiles(self.samples[role])
+            lines.append(f"  {role:<16} {calls:4d} calls  p50 {p50:6.2f}  p95 {p95:6.2f}  p99 {p99:6.2f}  "
+                         f"{self.retries[role]} retries  {self.failed[role]} failed")
+        if breaker is not None:
+            lines.append(f"  circuit breaker opened {breaker.trips} times")
+        if self.ttft:
+            lines.append("Streaming per speaker (time to first token in seconds, tokens/sec):")
+            for role in sorted(self.ttft):
+                ttft50, ttft95 = quantiles(self.ttft[role], (0.5, 0.95))
+                slow, median = quantiles(self.rates[role], (0.05, 0.5))
+                lines.append(f"  {role:<16} {len(self.ttft[role]):4d} streams  ttft p50 {ttft50:6.2f}  "
+                             f"p95 {ttft95:6.2f}  tok/s p50 {median:6.1f}  p5 {slow:6.1f}")
+        return "\n".join(lines)
+
+
+class ConsoleEcho:
+    """Prints streamed replies as they arrive.
+
+    The runners still print every finished turn, since cached and replayed
+    replies are not streamed; shown(text) tells them this one is already
+    on screen.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._local = threading.local()
+
+    def start(self, speaker):
+        label = usage_label.get()
+        print(f"  [{label}] {speaker}: " if label else f"\n{speaker}:\n", end="", flush=True)
+
+    def write(self, delta):
+        print(delta, end="", flush=True)
+
+    def end(self, text):
+        print(flush=True)
+        self._local.text = text
+
+    def shown(self, text):
+        if getattr(self._local, "text", None) == text:
+            self._local.text = None
+            return True
+        return False
+
+
+breaker = CircuitBreaker()
+latency_stats = LatencyStats()
+echo = ConsoleEcho()
+
+
+class _Call:
+    """Retry bookkeeping for one chat completion."""
+
+    def __init__(self, chat, kwargs):
+        self.chat = chat
+        self.role = speaker_of(kwargs["messages"][0]["content"])
+        self.start = time.monotonic()
+        self.deadline = self.start + chat.policy.deadline
+        self.attempt = 0
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def breaker_wait(self):
+        wait = self.chat.breaker.wait_time()
+        if wait and wait >= self.remaining():
+            self.chat.stats.fail(self.role)
+            raise DeadlineExceeded(f"{self.role}: circuit breaker open past the call deadline")
+        return wait
+
+    def timeout(self):
+        return max(0.1, min(self.chat.policy.attempt_timeout, self.remaining()))
+
+    def succeeded(self):
+        self.chat.breaker.success()
+        self.chat.stats.record(self.role, time.monotonic() - self.start)
+
+    def aborted(self, exc):
+        """A stream failed after its first token; it cannot be retried."""
+        if is_transient(exc):
+            self.chat.breaker.failure()
+        self.chat.stats.fail(self.role)
+
+    def failed(self, exc):
+        """Seconds to wait before the next attempt, or None to give up (re-raise exc)."""
+        if not is_transient(exc):
+            self.chat.breaker.success()  # the provider answered; it is not degraded
+            return None
+        self.chat.breaker.failure()
+        self.attempt += 1
+        if self.attempt >= self.chat.policy.max_attempts:
+            self.chat.stats.fail(self.role)
+            return None
+        delay = retry_after(exc)
+        if delay is None:
+            delay = self.chat.policy.backoff(self.attempt - 1)
+        if delay >= self.remaining():
+            self.chat.stats.fail(self.role)
+            raise DeadlineExceeded(f"{self.role}: next attempt would pass the call deadline") from exc
+        self.chat.stats.retry(self.role)
+        return delay
+
+
+class ReplyStream:
+    """Text deltas of one streamed completion.
+
+    Failures before the first token are retried like create(); after it
+    they are raised, since deltas already handed out cannot be taken back.
+    Once exhausted, text is the whole reply and usage the server's usage
+    block (if it sent one).
+    """
+
+    def __init__(self, chat, kwargs):
+        self.chat = chat
+        self.kwargs = dict(kwargs, stream=True, stream_options={"include_usage": True})
+        self.text = ""
+        self.usage = None
+        self._parts = []
+        self._attempt_start = self._first_token = None
+
+    def _delta(self, chunk):
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            if not self._parts:
+                self._first_token = time.monotonic()
+            self._parts.append(chunk.choices[0].delta.content)
+            return self._parts[-1]
+        return None
+
+    def _finish(self, call):
+        call.succeeded()
+        self.text = "".join(self._parts)
+        tokens = self.usage.completion_tokens if self.usage is not None else len(self._parts)
+        if self._first_token is not None:
+            call.chat.stats.stream(call.role, self._first_token - self._attempt_start, tokens,
+                                   time.monotonic() - self._first_token)
+
+    def __iter__(self):
+        call = _Call(self.chat, self.kwargs)
+        while True:
+            wait = call.breaker_wait()
+            if wait:
+                time.sleep(wait)
+                continue
+            self._attempt_start = time.monotonic()
+            try:
+                for chunk in self.chat.client.chat.completions.create(**self.kwargs, timeout=call.timeout()):
+                    delta = self._delta(chunk)
+                    if delta:
+                        yield delta
+            except Exception as exc:
+                if self._parts:
+                    call.aborted(exc)
+                    raise
+                delay = call.failed(exc)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.chat.breaker.release()
+                raise
+            self._finish(call)
+            return
+
+
+class AsyncReplyStream(ReplyStream):
+    """ReplyStream for AsyncResilientChat (async for); the limiter is held for the whole stream."""
+
+    async def __aiter__(self):
+        call = _Call(self.chat, self.kwargs)
+        while True:
+            wait = call.breaker_wait()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                async with self.chat.limiter or contextlib.nullcontext():
+                    self._attempt_start = time.monotonic()
+                    stream = await self.chat.client.chat.completions.create(**self.kwargs, timeout=call.timeout())
+                    async for chunk in stream:
+                        delta = self._delta(chunk)
+                        if delta:
+                            yield delta
+            except Exception as exc:
+                if self._parts:
+                    call.aborted(exc)
+                    raise
+                delay = call.failed(exc)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.chat.breaker.release()
+                raise
+            self._finish(call)
+            return
+
+
+class ResilientChat:
+    """chat.completions.create() with retries, deadlines and the shared breaker."""
+
+    def __init__(self, client, policy=None, breaker=breaker, stats=latency_stats, streaming=STREAM):
+        self.client = client.with_options(max_retries=0)  # retries are ours
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker
+        self.stats = stats
+        self.streaming = streaming
+
+    def stream(self, **kwargs):
+        return ReplyStream(self, kwargs)
+
+    def reply(self, key=None, quiet=False, **kwargs):
+        """(text, usage) of a completion.
+
+        When streaming, the deltas go to the console echo (unless quiet) and
+        to the current checkpoint (under request key) as they arrive.
+        """
+        if not self.streaming:
+            response = self.create(**kwargs)
+            return response.choices[0].message.content.strip(), response.usage
+        stream = self.stream(**kwargs)
+        speaker = speaker_of(kwargs["messages"][0]["content"])
+        started = False
+        for delta in stream:
+            if echo.enabled and not quiet:
+                if not started:
+                    echo.start(speaker)
+                echo.write(delta)
+            started = True
+            log_delta(key, delta)
+        if echo.enabled and not quiet and stream.text:
+            echo.end(stream.text.strip())
+        return stream.text.strip(), stream.usage
+
+    def create(self, **kwargs):
+        call = _Call(self, kwargs)
+        while True:
+            wait = call.breaker_wait()
+            if wait:
+                time.sleep(wait)
+                continue
+            try:
+                response = self.client.chat.completions.create(**kwargs, timeout=call.timeout())
+            except Exception as exc:
+                delay = call.failed(exc)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            call.succeeded()
+            return response
+
+
+class AsyncResilientChat(ResilientChat):
+    """Async variant for AsyncOpenAI; limiter, if given, wraps every attempt."""
+
+    def __init__(self, client, policy=None, breaker=breaker, stats=latency_stats, limiter=None, streaming=STREAM):
+        super().__init__(client, policy, breaker, stats, streaming)
+        self.limiter = limiter
+
+    def stream(self, **kwargs):
+        return AsyncReplyStream(self, kwargs)
+
+    async def reply(self, key=None, quiet=False, **kwargs):
+        """Async variant of ResilientChat.reply()."""
+        if not self.streaming:
+            response = await self.create(**kwargs)
+            return response.choices[0].message.content.strip(), response.usage
+        stream = self.stream(**kwargs)
+        speaker = speaker_of(kwargs["messages"][0]["content"])
+        started = False
+        async for delta in stream:
+            if echo.enabled and not quiet:
+                if not started:
+                    echo.start(speaker)
+                echo.write(delta)
+            started = True
+            log_delta(key, delta)
+        if echo.enabled and not quiet and stream.text:
+            echo.end(stream.text.strip())
+        return stream.text.strip(), stream.usage
+
+    async def create(self, **kwargs):
+        call = _Call(self, kwargs)
+        while True:
+            wait = call.breaker_wait()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                async with self.limiter or contextlib.nullcontext():
+                    response = await self.client.chat.completions.create(**kwargs, timeout=call.timeout())
+            except Exception as exc:
+                delay = call.failed(exc)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            call.succeeded()
+            return response
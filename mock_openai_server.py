@@ -0,0 +1,296 @@
+"""
+Local OpenAI-compatible stub for exercising the vignette generators without
+network calls or API costs.
+
+    python mock_openai_server.py --port 8765 --latency 0.5
+    OPENROUTER_BASE_URL=http://127.0.0.1:8765/v1 OPENROUTER_API_KEY=mock \
+        python generate_vignettes.py --out-dir /tmp/vignettes
+
+Only POST /v1/chat/completions is implemented. Replies name the persona from
+the system prompt ("You are MisInfoBot, ...") and carry a running counter so
+no two replies are identical. With "stream": true the reply is sent as
+server-sent events, one word per chunk, --token-latency seconds apart
+(--latency is then the time to the first token).
+
+Faults can be injected to exercise the retry layer (llm_client.py):
+
+    python mock_openai_server.py --error-rate 0.1 --throttle-rate 0.1 --retry-after 1 \
+        --hang-rate 0.02 --hang 90 --outage 20:15
+
+--error-rate answers 500, --throttle-rate answers 429 with a Retry-After
+header, --hang-rate stalls the reply for --hang seconds (past the client's
+timeout) and --outage START:SECONDS answers 503 to everything in that window.
+--duplicate-rate repeats the persona's previous reply word for word, like a
+model that keeps saying the same thing.
+
+--prefix-cache simulates provider-side prompt caching: the longest prefix of
+the messages (in --cache-block token steps, at least --cache-min tokens)
+already sent in an earlier request is reported as
+usage.prompt_tokens_details.cached_tokens, and only the rest pays the
+--prefill seconds per 1000 prompt tokens. Tokens are whitespace-separated
+words here, so about 0.75 of a real tokenizer's count.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockState:
+    def __init__(self, latency, token_latency=0.01, error_rate=0.0, throttle_rate=0.0, retry_after=1.0,
+                 hang_rate=0.0, hang=60.0, outage=None, duplicate_rate=0.0, seed=None, prefix_cache=False,
+                 cache_block=128, cache_min=1024, prefill=0.0, cache_entries=50000, reply_words=0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.outage = outage  # (start, seconds) after startup, or None
+        self.duplicate_rate = duplicate_rate
+        self.prefix_cache = prefix_cache
+        self.cache_block = cache_block
+        self.cache_min = cache_min
+        self.prefill = prefill  # seconds per 1000 uncached prompt tokens
+        self.cache_entries = cache_entries
+        self.reply_words = reply_words
+        self._prefixes = OrderedDict()
+        self.last_reply = {}
+        self.started = time.monotonic()
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.faults = {"error": 0, "throttle": 0, "hang": 0, "outage": 0}
+        self._rng = random.Random(seed)
+
+    def next_id(self):
+        with self.lock:
+            self.requests += 1
+            return next(self.counter)
+
+    def reply_text(self, name, n):
+        with self.lock:
+            if name in self.last_reply and self._rng.random() < self.duplicate_rate:
+                return self.last_reply[name]
+            text = f"@Participant Mock reply {n} from {name}: this is not true, research shows otherwise."
+            if self.reply_words > len(text.split()):
+                text += " Filler" + " words" * (self.reply_words - len(text.split()) - 1) + "."
+            self.last_reply[name] = text
+            return text
+
+    def cached_tokens(self, tokens):
+        """Length of the longest cached block-aligned prefix of tokens; caches all of its prefixes."""
+        if not self.prefix_cache:
+            return 0
+        digest, ends = hashlib.sha1(), []
+        for end in range(self.cache_block, len(tokens) + 1, self.cache_block):
+            for token in tokens[end - self.cache_block:end]:
+                digest.update(token.encode() + b"\0")
+            if end >= self.cache_min:
+                ends.append((end, digest.digest()))
+        cached, missed = 0, False
+        with self.lock:
+            for end, key in ends:
+                if not missed and key in self._prefixes:
+                    cached = end
+                else:
+                    missed = True
+                self._prefixes[key] = None
+                self._prefixes.move_to_end(key)
+            while len(self._prefixes) > self.cache_entries:
+                self._prefixes.popitem(last=False)
+        return cached
+
+    def pick_fault(self):
+        """Which fault (if any) to inject into the next request."""
+        with self.lock:
+            fault = None
+            if self.outage and 0 <= time.monotonic() - self.started - self.outage[0] < self.outage[1]:
+                fault = "outage"
+            else:
+                roll = self._rng.random()
+                for name, rate in (("error", self.error_rate), ("throttle", self.throttle_rate),
+                                   ("hang", self.hang_rate)):
+                    if roll < rate:
+                        fault = name
+                        break
+                    roll -= rate
+            if fault:
+                self.faults[fault] += 1
+            return fault
+
+
+def persona(messages):
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    match = re.search(r"You are (?:a |an )?(\w+)", system)
+    return match.group(1) if match else "Assistant"
+
+
+def prompt_tokens(messages):
+    """The prompt as mock tokens: words, each tagged with the speaker so a role change breaks a prefix."""
+    return [f"{m.get('role')}/{m.get('name', '')}/{word}"
+            for m in messages for word in str(m.get("content", "")).split()]
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            try:
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client timed out (e.g. on an injected hang)
+
+        def _send_stream(self, n, model, text, usage):
+            def event(choices, usage=None):
+                chunk = {"id": f"chatcmpl-mock-{n}", "object": "chat.completion.chunk",
+                         "created": int(time.time()), "model": model, "choices": choices}
+                if usage is not None:
+                    chunk["usage"] = usage
+                return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+            words = text.split(" ")
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(state.token_latency)
+                    delta = {"content": word if i == 0 else " " + word}
+                    if i == 0:
+                        delta["role"] = "assistant"
+                    self.wfile.write(event([{"index": 0, "delta": delta, "finish_reason": None}]))
+                    self.wfile.flush()
+                self.wfile.write(event([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                if usage is not None:
+                    self.wfile.write(event([], usage))
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            messages = request.get("messages", [])
+            fault = state.pick_fault()
+            if fault in ("error", "outage"):
+                status = 500 if fault == "error" else 503
+                self._send_json(status, {"error": {"message": f"injected {fault}", "type": "server_error"}})
+                return
+            if fault == "throttle":
+                self._send_json(429, {"error": {"message": "injected rate limit", "type": "rate_limit_exceeded"}},
+                                {"Retry-After": f"{state.retry_after:g}"})
+                return
+            if fault == "hang":
+                time.sleep(state.hang)
+            n = state.next_id()
+            tokens = prompt_tokens(messages)
+            cached = state.cached_tokens(tokens)
+            time.sleep(state.latency + state.prefill * (len(tokens) - cached) / 1000)
+
+            name = persona(messages)
+            text = state.reply_text(name, n)
+            completion_tokens = len(text.split())
+            usage = {
+                "prompt_tokens": len(tokens),
+                "completion_tokens": completion_tokens,
+                "total_tokens": len(tokens) + completion_tokens,
+            }
+            if state.prefix_cache:
+                usage["prompt_tokens_details"] = {"cached_tokens": cached}
+            if request.get("stream"):
+                include_usage = (request.get("stream_options") or {}).get("include_usage")
+                self._send_stream(n, request.get("model", "mock"), text, usage if include_usage else None)
+                return
+            self._send_json(200, {
+                "id": f"chatcmpl-mock-{n}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8765, latency=0.5, **faults):
+    """Start the stub in a background thread and return the server.
+
+    faults are MockState options; server.state exposes them (and the
+    injected-fault counts) so they can be changed while it runs.
+    """
+    state = MockState(latency, **faults)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.state = state
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds to wait before each reply")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction of replies stalled by --hang")
+    parser.add_argument("--hang", type=float, default=60.0, help="seconds a stalled reply waits")
+    parser.add_argument("--outage", help="START:SECONDS window (after startup) answered with 503")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="fraction of replies that repeat the persona's previous one")
+    parser.add_argument("--seed", type=int, help="seed for the fault draws")
+    parser.add_argument("--reply-words", type=int, default=0, help="pad replies to this many words")
+    parser.add_argument("--prefix-cache", action="store_true", help="simulate provider-side prompt caching")
+    parser.add_argument("--cache-block", type=int, default=128, help="prefix cache granularity in tokens")
+    parser.add_argument("--cache-min", type=int, default=1024, help="shortest cacheable prefix in tokens")
+    parser.add_argument("--prefill", type=float, default=0.0, help="seconds per 1000 uncached prompt tokens")
+    args = parser.parse_args()
+
+    outage = tuple(float(x) for x in args.outage.split(":")) if args.outage else None
+    state = MockState(
+        args.latency, token_latency=args.token_latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        hang_rate=args.hang_rate, hang=args.hang, outage=outage, duplicate_rate=args.duplicate_rate,
+        seed=args.seed, prefix_cache=args.prefix_cache, cache_block=args.cache_block, cache_min=args.cache_min,
+        prefill=args.prefill, reply_words=args.reply_words,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"Mock OpenAI server on http://{args.host}:{args.port}/v1 (latency {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Structured conversation turns.
+
+A conversation is a History of Turn records instead of a list of
+"Role: text" strings, so the runners never re-split lines to find out who
+spoke. History keeps per-role counters and the last turn, so the think and
+nomination functions read them in O(1).
+
+Saved conversations are a JSON list of {"role", "text", "act"} objects. The
+original json/ vignettes use the older "Role: text" strings; both are
+accepted when loading, and this module converts between them:
+
+    python turns.py json/control/conversation_control1.json --out-dir /tmp/turns
+    python turns.py json/ --format lines      # rewrite in place as strings
+"""
+
+import argparse
+import json
+import os
+from enum import Enum
+
+from context import MESSAGE_OVERHEAD, token_counter
+from dialogue_acts import get_dialogue_act, split_turn
+
+
+class Role(str, Enum):
+    PARTICIPANT = "Participant"
+    MISINFO = "MisInfoBot"
+    SUPPORT = "SupportBot"
+    REFUTATIONAL = "RefutationalBot"
+    PREBUNKING = "PrebunkingBot"
+
+    def __str__(self):
+        return self.value
+
+
+class Turn:
+    __slots__ = ("role", "text", "act", "_tokens", "_message")
+
+    def __init__(self, role, text, act=None):
+        self.role = Role(role)
+        self.text = text
+        self.act = act
+        self._tokens = None
+        self._message = None
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = token_counter.count(self.text)
+        return self._tokens
+
+    def message_tokens(self):
+        """Prompt tokens of message(), as context.TokenCounter.count_message counts them."""
+        return MESSAGE_OVERHEAD + self.tokens + (0 if self.role is Role.PARTICIPANT else 1)
+
+    def message(self):
+        """The chat-completions message for this turn (built once)."""
+        if self._message is None:
+            if self.role is Role.PARTICIPANT:
+                self._message = {"role": "user", "content": self.text}
+            else:
+                self._message = {"role": "assistant", "name": self.role.value, "content": self.text}
+        return self._message
+
+    def line(self):
+        return f"{self.role.value}: {self.text}"
+
+    def to_json(self):
+        data = {"role": self.role.value, "text": self.text}
+        if self.act is not None:
+            data["act"] = self.act
+        return data
+
+    @classmethod
+    def from_json(cls, entry):
+        """Build a Turn from a {"role", "text"} object or a "Role: text" string."""
+        role, text = split_turn(entry)
+        return cls(role, text, None if isinstance(entry, str) else entry.get("act"))
+
+    def __repr__(self):
+        return f"Turn({self.role.value!r}, {self.text[:40]!r})"
+
+
+class History:
+    """Ordered turns with O(1) last-turn access and per-role counts.
+
+    classify(role, text) -> act is run once per appended turn (unless the
+    turn already carries one) and the result cached on the Turn.
+    """
+
+    def __init__(self, turns=(), classify=get_dialogue_act):
+        self.classify = classify
+        self._turns = []
+        self._counts = dict.fromkeys(Role, 0)
+        for turn in turns:
+            self.add(turn)
+
+    def add(self, turn):
+        if turn.act is None and self.classify is not None:
+            turn.act = self.classify(turn.role.value, turn.text)
+        self._turns.append(turn)
+        self._counts[turn.role] += 1
+        return turn
+
+    def append(self, role, text):
+        return self.add(Turn(role, text))
+
+    @property
+    def last(self):
+        return self._turns[-1] if self._turns else None
+
+    @property
+    def last_role(self):
+        return self._turns[-1].role if self._turns else None
+
+    def count(self, role):
+        return self._counts[Role(role)]
+
+    def without(self, *roles):
+        """Turns not spoken by any of roles, oldest first."""
+        return [t for t in self._turns if t.role not in roles]
+
+    def __len__(self):
+        return len(self._turns)
+
+    def __iter__(self):
+        return iter(self._turns)
+
+    def __getitem__(self, index):
+        return self._turns[index]
+
+    def __bool__(self):
+        return bool(self._turns)
+
+    def to_json(self):
+        return [t.to_json() for t in self._turns]
+
+    def to_lines(self):
+        return [t.line() for t in self._turns]
+
+    @classmethod
+    def from_json(cls, data, classify=get_dialogue_act):
+        return cls((Turn.from_json(entry) for entry in data), classify=classify)
+
+
+def as_lines(data):
+    """Normalize a saved conversation (either format) to "Role: text" strings."""
+    return [entry if isinstance(entry, str) else Turn.from_json(entry).line() for entry in data]
+
+
+# ---------------------------------------------------------------------------
+# Converter for saved conversation files
+# ---------------------------------------------------------------------------
+
+def convert_file(path, out_path, fmt="turns"):
+    with open(path, "r", encoding="utf-8") as f:
+        history = History.from_json(json.load(f))
+    data = history.to_json() if fmt == "turns" else history.to_lines()
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    return len(history)
+
+
+def iter_json_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(".json"):
+                        yield path, os.path.join(root, name)
+        else:
+            yield os.path.dirname(path), path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert saved conversations between formats.")
+    parser.add_argument("paths", nargs="+", help="JSON files or directories (searched recursively)")
+    parser.add_argument("--format", choices=["turns", "lines"], default="turns",
+                        help="turns: list of {role, text, act} objects; lines: 'Role: text' strings")
+    parser.add_argument("--out-dir", help="write converted files here (default: rewrite in place)")
+    args = parser.parse_args()
+
+    for base, path in iter_json_files(args.paths):
+        out_path = os.path.join(args.out_dir, os.path.relpath(path, base)) if args.out_dir else path
+        n = convert_file(path, out_path, args.format)
+        print(f"{path} -> {out_path} ({n} turns)")
+
+
+if __name__ == "__main__":
+    main()